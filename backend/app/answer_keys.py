@@ -0,0 +1,205 @@
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import settings
+
+# Скомпилированный ключ ответов теста:
+# question_id -> {"answer_type_id", "correct_answer", "correct_option_ids", "points"}
+AnswerKey = Dict[int, dict]
+
+# test_id -> (версия теста, ключ). Версия - Test.updated_at: его сдвигает любая
+# правка теста, его вопросов и вариантов (mark_test_changed / mark_question_changed).
+# Она сверяется при каждом чтении, поэтому правки из других процессов тоже
+# сбрасывают ключ, даже если invalidate_* вызван не здесь.
+_cache: "OrderedDict[int, Tuple[Any, AnswerKey]]" = OrderedDict()
+_lock = threading.Lock()
+# Растет при каждой инвалидации: ключ, скомпилированный до нее, в кэш не кладем
+_generation = 0
+
+
+def _normalize_text(value: Optional[str]) -> Optional[str]:
+    if not value:
+        return None
+    return value.strip().lower()
+
+
+def compile_answer_key(db: Session, test_id: int) -> AnswerKey:
+    """Построить ключ ответов теста двумя запросами"""
+    rows = db.query(
+        models.TestQuestion.question_id,
+        models.TestQuestion.points.label("test_points"),
+        models.Question.points.label("question_points"),
+        models.Question.answer_type_id,
+        models.Question.correct_answer
+    ).join(
+        models.Question,
+        models.Question.id == models.TestQuestion.question_id
+    ).filter(
+        models.TestQuestion.test_id == test_id
+    ).all()
+
+    key = {}
+    for row in rows:
+        key[row.question_id] = {
+            "answer_type_id": row.answer_type_id,
+            "correct_answer": _normalize_text(row.correct_answer),
+            "correct_option_ids": set(),
+            "points": row.test_points or row.question_points or 1
+        }
+
+    if key:
+        correct_options = db.query(
+            models.AnswerOption.id,
+            models.AnswerOption.question_id
+        ).filter(
+            models.AnswerOption.question_id.in_(list(key.keys())),
+            models.AnswerOption.is_correct == True
+        ).all()
+
+        for option in correct_options:
+            key[option.question_id]["correct_option_ids"].add(option.id)
+
+    for entry in key.values():
+        entry["correct_option_ids"] = frozenset(entry["correct_option_ids"])
+
+    return key
+
+
+def compile_question_entries(db: Session, question_ids) -> Dict[int, dict]:
+    """Ключи для вопросов вне теста двумя запросами (не кэшируются, 1 балл по умолчанию)"""
+    question_ids = list(set(question_ids))
+    if not question_ids:
+        return {}
+
+    entries = {
+        row.id: {
+            "answer_type_id": row.answer_type_id,
+            "correct_answer": _normalize_text(row.correct_answer),
+            "correct_option_ids": set(),
+            "points": 1
+        }
+        for row in db.query(
+            models.Question.id,
+            models.Question.answer_type_id,
+            models.Question.correct_answer
+        ).filter(models.Question.id.in_(question_ids)).all()
+    }
+
+    if entries:
+        for option in db.query(
+            models.AnswerOption.id,
+            models.AnswerOption.question_id
+        ).filter(
+            models.AnswerOption.question_id.in_(list(entries.keys())),
+            models.AnswerOption.is_correct == True
+        ).all():
+            entries[option.question_id]["correct_option_ids"].add(option.id)
+
+    for entry in entries.values():
+        entry["correct_option_ids"] = frozenset(entry["correct_option_ids"])
+
+    return entries
+
+
+def compile_question_entry(db: Session, question_id: int) -> Optional[dict]:
+    """Ключ для одного вопроса вне теста"""
+    return compile_question_entries(db, [question_id]).get(question_id)
+
+
+def mark_test_changed(db: Session, test_id: int) -> None:
+    """Сдвинуть версию теста после правки его вопросов (без commit)"""
+    db.execute(update(models.Test).where(models.Test.id == test_id).values(updated_at=datetime.utcnow()))
+
+
+def mark_question_changed(db: Session, question_id: int) -> None:
+    """Сдвинуть версию всех тестов, в которые входит вопрос (без commit)"""
+    db.execute(update(models.Test).where(models.Test.id.in_(
+        select(models.TestQuestion.test_id).where(models.TestQuestion.question_id == question_id)
+    )).values(updated_at=datetime.utcnow()))
+
+
+def get_answer_key(db: Session, test_id: int, version: Any = None) -> AnswerKey:
+    """Получить ключ ответов теста из LRU-кэша, при промахе - скомпилировать.
+
+    version - Test.updated_at, если вызывающий код уже загрузил тест
+    (например, вместе с сессией); иначе читается одним запросом по ключу.
+    """
+    if version is None:
+        version = db.query(models.Test.updated_at).filter(models.Test.id == test_id).scalar()
+
+    with _lock:
+        cached = _cache.get(test_id)
+        if cached is not None and cached[0] == version:
+            _cache.move_to_end(test_id)
+            return cached[1]
+        generation = _generation
+
+    key = compile_answer_key(db, test_id)
+
+    with _lock:
+        # Пока компилировали, тест или вопрос могли изменить - такой ключ уже устарел
+        if generation == _generation:
+            _cache[test_id] = (version, key)
+            _cache.move_to_end(test_id)
+            while len(_cache) > settings.ANSWER_KEY_CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    return key
+
+
+def invalidate_test(test_id: int) -> None:
+    """Сбросить ключ ответов теста"""
+    global _generation
+    with _lock:
+        _generation += 1
+        _cache.pop(test_id, None)
+
+
+def invalidate_question(question_id: int) -> None:
+    """Сбросить ключи всех тестов, в которые входит вопрос"""
+    global _generation
+    with _lock:
+        _generation += 1
+        stale = [test_id for test_id, (_, key) in _cache.items() if question_id in key]
+        for test_id in stale:
+            del _cache[test_id]
+
+
+def clear() -> None:
+    global _generation
+    with _lock:
+        _generation += 1
+        _cache.clear()
+
+
+def grade_answer(entry: dict, answer_text: Optional[str], selected_options: Optional[str]) -> Tuple[bool, int]:
+    """Проверить ответ по ключу вопроса, вернуть (is_correct, points_earned)"""
+    is_correct = False
+    answer_type_id = entry["answer_type_id"]
+
+    # Проверка для текстовых ответов
+    if answer_type_id == 1 and answer_text and entry["correct_answer"]:
+        is_correct = answer_text.strip().lower() == entry["correct_answer"]
+
+    # Проверка для выбора вариантов
+    elif answer_type_id in [2, 3] and selected_options:
+        try:
+            selected_ids = json.loads(selected_options)
+            correct_ids = entry["correct_option_ids"]
+
+            if answer_type_id == 2:  # single choice
+                is_correct = len(selected_ids) == 1 and selected_ids[0] in correct_ids
+            else:  # multiple choice
+                is_correct = set(selected_ids) == correct_ids
+        except Exception as e:
+            print(f"❌ Ошибка проверки вариантов: {e}")
+            is_correct = False
+
+    return is_correct, entry["points"] if is_correct else 0
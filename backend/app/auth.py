@@ -1,39 +1,70 @@
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import NamedTuple, Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import event, inspect
 from sqlalchemy.orm import Session
 
-from . import schemas
+from . import schemas, passwords
 from .config import settings
 from .database import get_db
 from .models import User
 
-# Используем Argon2 вместо bcrypt - нет ограничений на длину пароля
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+pwd_context = passwords.pwd_context
 security = HTTPBearer()
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Проверяет пароль"""
+    """Проверяет пароль (синхронно, для скриптов; в запросах - authenticate_user)"""
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
-    """Хеширует пароль"""
+    """Хеширует пароль (синхронно, для скриптов; в запросах - passwords.hash_password_async)"""
     return pwd_context.hash(password)
 
 def get_user(db: Session, username: str) -> Optional[User]:
     return db.query(User).filter(User.username == username).first()
 
-def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
-    user = get_user(db, username)
+def _update_password_hash(db: Session, user: User, new_hash: str) -> None:
+    # Хеш с устаревшими параметрами Argon2 - заменяем. Запрос в обход ORM-событий:
+    # это не смена пароля, выданные токены должны остаться действительными
+    db.query(User).filter(User.id == user.id).update(
+        {"password_hash": new_hash}, synchronize_session=False
+    )
+    db.commit()
+    db.refresh(user)
+    print(f"🔐 Хеш пароля пользователя {user.id} обновлен под новые параметры")
+
+async def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
+    """Проверка пароля: запросы к базе - в пуле потоков, Argon2 - в пуле хеширования.
+
+    Event loop при этом не блокируется ни базой (например, занятой SQLite),
+    ни хешированием.
+    """
+    user = await run_in_threadpool(get_user, db, username)
     if not user:
         return None
-    if not verify_password(password, user.password_hash):
+    is_valid, new_hash = await passwords.verify_and_update_async(password, user.password_hash)
+    if not is_valid:
         return None
+    if new_hash:
+        await run_in_threadpool(_update_password_hash, db, user, new_hash)
     return user
 
+def build_token_claims(user: User) -> dict:
+    """Данные пользователя, которые кладем в access-токен"""
+    return {
+        "sub": user.username,
+        "uid": user.id,
+        "role": user.role_id,
+        "active": bool(user.is_active),
+        "ver": user.token_version or 0
+    }
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
@@ -44,10 +75,100 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
+class Principal(NamedTuple):
+    """Пользователь запроса, достаточный для проверки прав (без обращения к базе)"""
+    id: int
+    username: str
+    role_id: int
+    is_active: bool
+    token_version: int
+
+
+class PrincipalCache:
+    """Ограниченный LRU-кэш с TTL: (uid, sub, ver) токена -> Principal"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[Principal]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, principal = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return principal
+
+    def set(self, key: tuple, principal: Principal) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, principal)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            stale = [key for key, (_, principal) in self._items.items() if principal.id == user_id]
+            for key in stale:
+                del self._items[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+principal_cache = PrincipalCache(settings.PRINCIPAL_CACHE_SIZE, settings.PRINCIPAL_CACHE_TTL)
+
+# Изменения пользователя, после которых выданные токены должны перестать действовать
+_TOKEN_FIELDS = ("role_id", "is_active", "password_hash", "username")
+
+@event.listens_for(User, "before_update")
+def _bump_token_version(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in _TOKEN_FIELDS):
+        target.token_version = (target.token_version or 0) + 1
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_principal(mapper, connection, target):
+    principal_cache.invalidate_user(target.id)
+
+
+def load_principal(db: Session, payload: dict) -> Optional[Principal]:
+    """Проверить токен по базе и собрать Principal (при промахе кэша)"""
+    username = payload.get("sub")
+    user_id = payload.get("uid")
+
+    if user_id is not None:
+        user = db.query(User).filter(User.id == user_id).first()
+        if user is None or user.username != username:
+            return None
+        if payload.get("ver") != (user.token_version or 0):
+            return None
+    else:
+        # Токены, выданные до появления uid/ver, действуют до истечения срока
+        user = get_user(db, username=username)
+        if user is None:
+            return None
+
+    return Principal(
+        id=user.id,
+        username=user.username,
+        role_id=user.role_id,
+        is_active=bool(user.is_active),
+        token_version=user.token_version or 0
+    )
+
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
-) -> User:
+) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Неверные учетные данные",
@@ -65,12 +186,21 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
     
-    user = get_user(db, username=username)
-    if user is None:
+    user_id = payload.get("uid")
+    # uid входит в ключ: после удаления пользователя его имя может занять
+    # другой, и токены старого аккаунта не должны получить чужой Principal
+    cache_key = (user_id, username, payload.get("ver"))
+    principal = principal_cache.get(cache_key)
+    if principal is None:
+        principal = await run_in_threadpool(load_principal, db, payload)
+        if principal is None:
+            raise credentials_exception
+        principal_cache.set(cache_key, principal)
+    if user_id is not None and principal.id != user_id:
         raise credentials_exception
-    return user
+    return principal
 
-async def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
+async def get_current_active_user(current_user: Principal = Depends(get_current_user)) -> Principal:
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Неактивный пользователь")
     return current_user
\ No newline at end of file
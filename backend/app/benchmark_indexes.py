@@ -0,0 +1,250 @@
+"""Бенчмарк составных индексов: планы запросов и время до/после.
+
+Создает отдельную SQLite-базу, заполняет ее синтетическими данными
+(по умолчанию 1 000 000 ответов) и выполняет частые запросы без индексов
+из app.indexes и с ними.
+
+Запуск из папки backend:
+    python -m app.benchmark_indexes [--answers 1000000] [--db ./benchmark.db] [--keep]
+"""
+import argparse
+import os
+import random
+import time
+
+from sqlalchemy import create_engine, text
+
+from . import models, indexes
+
+QUESTIONS_PER_TEST = 40
+OPTIONS_PER_QUESTION = 4
+USERS = 2000
+TESTS = 50
+GROUPS = 50
+MEMBERS_PER_GROUP = 40
+CATEGORIES = 20
+CHUNK_SIZE = 50000
+
+# Частые запросы приложения в виде SQL с параметрами
+HOT_QUERIES = {
+    "session_attempts": (
+        "SELECT id FROM test_sessions "
+        "WHERE user_id = :user_id AND test_id = :test_id AND assignment_id = :assignment_id"
+    ),
+    "answer_lookup": (
+        "SELECT id FROM user_answers WHERE session_id = :session_id AND question_id = :question_id"
+    ),
+    "test_question": (
+        "SELECT points FROM test_questions WHERE test_id = :test_id AND question_id = :question_id"
+    ),
+    "group_membership": (
+        "SELECT id FROM group_members "
+        "WHERE group_id = :group_id AND user_id = :user_id AND is_active = 1"
+    ),
+    "test_access": (
+        "SELECT access_level FROM test_access WHERE test_id = :test_id AND user_id = :user_id"
+    ),
+    "user_statistics": (
+        "SELECT id FROM user_statistics WHERE user_id = :user_id AND category_id = :category_id"
+    ),
+    "correct_options": (
+        "SELECT id FROM answer_options WHERE question_id = :question_id AND is_correct = 1"
+    ),
+}
+
+
+def _insert(connection, model, rows):
+    for start in range(0, len(rows), CHUNK_SIZE):
+        connection.execute(model.__table__.insert(), rows[start:start + CHUNK_SIZE])
+
+
+def seed(connection, answers: int, rng: random.Random) -> dict:
+    """Заполнить базу; вернуть данные для выбора параметров запросов"""
+    sessions_count = max(answers // QUESTIONS_PER_TEST, 1)
+
+    _insert(connection, models.Role, [{"id": 1, "name": "student"}])
+    _insert(connection, models.QuestionType, [{"id": 1, "name": "text"}])
+    _insert(connection, models.AnswerType, [{"id": 1, "name": "single"}])
+    _insert(connection, models.Category, [
+        {"id": i, "name": f"category-{i}"} for i in range(1, CATEGORIES + 1)
+    ])
+    _insert(connection, models.User, [
+        {"id": i, "username": f"user{i}", "password_hash": "x", "role_id": 1}
+        for i in range(1, USERS + 1)
+    ])
+
+    questions_count = TESTS * QUESTIONS_PER_TEST
+    _insert(connection, models.Question, [
+        {
+            "id": i, "question_text": f"Вопрос {i}", "type_id": 1, "answer_type_id": 1,
+            "category_id": i % CATEGORIES + 1, "author_id": 1
+        }
+        for i in range(1, questions_count + 1)
+    ])
+    _insert(connection, models.AnswerOption, [
+        {
+            "question_id": q, "option_text": f"Вариант {o}",
+            "is_correct": o == 0, "sort_order": o
+        }
+        for q in range(1, questions_count + 1) for o in range(OPTIONS_PER_QUESTION)
+    ])
+
+    test_questions = {
+        t: list(range((t - 1) * QUESTIONS_PER_TEST + 1, t * QUESTIONS_PER_TEST + 1))
+        for t in range(1, TESTS + 1)
+    }
+    _insert(connection, models.Test, [
+        {"id": t, "title": f"Тест {t}", "author_id": 1} for t in range(1, TESTS + 1)
+    ])
+    _insert(connection, models.TestQuestion, [
+        {"test_id": t, "question_id": q, "sort_order": i, "points": 1}
+        for t, question_ids in test_questions.items() for i, q in enumerate(question_ids)
+    ])
+
+    _insert(connection, models.StudyGroup, [
+        {"id": g, "name": f"Группа {g}", "invite_code": f"CODE{g}", "created_by": 1}
+        for g in range(1, GROUPS + 1)
+    ])
+    _insert(connection, models.GroupMember, [
+        {"group_id": g, "user_id": rng.randint(1, USERS), "is_active": rng.random() > 0.1}
+        for g in range(1, GROUPS + 1) for _ in range(MEMBERS_PER_GROUP)
+    ])
+    # Назначение теста t - группе t по модулю числа групп, id назначения = id теста
+    _insert(connection, models.TestAssignment, [
+        {"id": t, "test_id": t, "group_id": (t - 1) % GROUPS + 1, "assigned_by": 1}
+        for t in range(1, TESTS + 1)
+    ])
+    _insert(connection, models.TestAccess, [
+        {"test_id": rng.randint(1, TESTS), "user_id": rng.randint(1, USERS), "access_level": "read"}
+        for _ in range(USERS * 2)
+    ])
+    _insert(connection, models.UserStatistics, [
+        {"user_id": u, "category_id": c}
+        for u in range(1, USERS + 1) for c in range(1, CATEGORIES + 1)
+    ])
+
+    sessions = []
+    for s in range(1, sessions_count + 1):
+        test_id = rng.randint(1, TESTS)
+        sessions.append({
+            "id": s, "user_id": rng.randint(1, USERS), "test_id": test_id,
+            "assignment_id": test_id if rng.random() > 0.3 else None,
+            "is_completed": True
+        })
+    _insert(connection, models.TestSession, sessions)
+
+    rows = []
+    written = 0
+    for session in sessions:
+        for question_id in test_questions[session["test_id"]]:
+            rows.append({
+                "session_id": session["id"], "question_id": question_id,
+                "selected_options": "[]", "is_correct": rng.random() > 0.5, "points_earned": 0
+            })
+            written += 1
+            if written >= answers:
+                break
+        if len(rows) >= CHUNK_SIZE:
+            _insert(connection, models.UserAnswer, rows)
+            rows = []
+        if written >= answers:
+            break
+    if rows:
+        _insert(connection, models.UserAnswer, rows)
+
+    print(f"🌱 Сессий: {len(sessions)}, ответов: {written}")
+    return {"sessions": sessions, "test_questions": test_questions}
+
+
+def sample_params(name: str, data: dict, rng: random.Random) -> dict:
+    session = rng.choice(data["sessions"])
+    question_id = rng.choice(data["test_questions"][session["test_id"]])
+    return {
+        "session_attempts": {
+            "user_id": session["user_id"], "test_id": session["test_id"],
+            "assignment_id": session["assignment_id"] or session["test_id"]
+        },
+        "answer_lookup": {"session_id": session["id"], "question_id": question_id},
+        "test_question": {"test_id": session["test_id"], "question_id": question_id},
+        "group_membership": {"group_id": rng.randint(1, GROUPS), "user_id": session["user_id"]},
+        "test_access": {"test_id": session["test_id"], "user_id": session["user_id"]},
+        "user_statistics": {"user_id": session["user_id"], "category_id": rng.randint(1, CATEGORIES)},
+        "correct_options": {"question_id": question_id},
+    }[name]
+
+
+def measure(connection, data: dict, repeats: int) -> dict:
+    """План и среднее время каждого запроса"""
+    results = {}
+    for name, sql in HOT_QUERIES.items():
+        rng = random.Random(name)
+        params = sample_params(name, data, rng)
+        plan = connection.execute(text("EXPLAIN QUERY PLAN " + sql), params).fetchall()
+
+        started = time.perf_counter()
+        for _ in range(repeats):
+            connection.execute(text(sql), sample_params(name, data, rng)).fetchall()
+        elapsed = (time.perf_counter() - started) / repeats
+
+        results[name] = {
+            "plan": "; ".join(row[-1] for row in plan),
+            "avg_ms": elapsed * 1000
+        }
+    return results
+
+
+def report(before: dict, after: dict) -> None:
+    for name in HOT_QUERIES:
+        b, a = before[name], after[name]
+        speedup = b["avg_ms"] / a["avg_ms"] if a["avg_ms"] else float("inf")
+        print(f"\n📌 {name}")
+        print(f"   до:    {b['avg_ms']:.3f} мс | {b['plan']}")
+        print(f"   после: {a['avg_ms']:.3f} мс | {a['plan']}")
+        print(f"   ускорение: x{speedup:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк составных индексов")
+    parser.add_argument("--answers", type=int, default=1000000)
+    parser.add_argument("--db", default="./benchmark_indexes.db")
+    parser.add_argument("--repeats", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="Не удалять базу после замеров")
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+
+    db_engine = create_engine(f"sqlite:///{args.db}")
+    rng = random.Random(args.seed)
+
+    try:
+        models.Base.metadata.create_all(bind=db_engine)
+        with db_engine.begin() as connection:
+            indexes.drop_hot_indexes(connection)
+            started = time.perf_counter()
+            data = seed(connection, args.answers, rng)
+            print(f"⏱️ Заполнение: {time.perf_counter() - started:.1f} с")
+
+        with db_engine.connect() as connection:
+            connection.execute(text("ANALYZE"))
+            before = measure(connection, data, args.repeats)
+
+        with db_engine.begin() as connection:
+            started = time.perf_counter()
+            indexes.create_hot_indexes(connection)
+            connection.execute(text("ANALYZE"))
+            print(f"⏱️ Создание индексов: {time.perf_counter() - started:.1f} с")
+
+        with db_engine.connect() as connection:
+            after = measure(connection, data, args.repeats)
+
+        report(before, after)
+    finally:
+        db_engine.dispose()
+        if not args.keep and os.path.exists(args.db):
+            os.remove(args.db)
+
+
+if __name__ == "__main__":
+    main()
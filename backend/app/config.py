@@ -5,8 +5,52 @@ load_dotenv()
 
 class Settings:
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./testing_platform.db")
+    # Реплика для читающих эндпоинтов; пусто - читаем с основной базы
+    DATABASE_READ_URL: str = os.getenv("DATABASE_READ_URL", "")
+    # Заголовок, которым клиент требует прочитать свои записи с основной базы
+    READ_YOUR_WRITES_HEADER: str = os.getenv("READ_YOUR_WRITES_HEADER", "X-Read-Your-Writes")
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-here-change-in-production")
     ALGORITHM: str = os.getenv("ALGORITHM", "HS256")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+    REFRESH_TOKEN_EXPIRE_DAYS: int = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+    # Сколько секунд после ротации повтор старого refresh-токена считается гонкой
+    # параллельных запросов (409), а не утечкой (отзыв всей цепочки)
+    REFRESH_REUSE_GRACE_SECONDS: int = int(os.getenv("REFRESH_REUSE_GRACE_SECONDS", "30"))
+    # Параметры Argon2; при их смене хеши обновляются при следующем входе
+    ARGON2_TIME_COST: int = int(os.getenv("ARGON2_TIME_COST", "2"))
+    ARGON2_MEMORY_COST: int = int(os.getenv("ARGON2_MEMORY_COST", "102400"))  # KiB
+    ARGON2_PARALLELISM: int = int(os.getenv("ARGON2_PARALLELISM", "8"))
+    # Пул процессов для хеширования: 0 воркеров - считать в пуле потоков
+    HASH_WORKERS: int = int(os.getenv("HASH_WORKERS", "2"))
+    HASH_MAX_CONCURRENCY: int = int(os.getenv("HASH_MAX_CONCURRENCY", "2"))
+    HASH_MAX_QUEUE: int = int(os.getenv("HASH_MAX_QUEUE", "200"))
+    # Кэш пользователей, проверенных по токену: запросы внутри TTL обходятся без базы
+    PRINCIPAL_CACHE_TTL: int = int(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+    PRINCIPAL_CACHE_SIZE: int = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+    # Пул соединений (для SQLite используется только при файловой базе)
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_TIMEOUT: int = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+    # Настройки SQLite, применяются при каждом подключении
+    SQLITE_WAL: bool = os.getenv("SQLITE_WAL", "true").lower() in ("1", "true", "yes")
+    SQLITE_SYNCHRONOUS: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_BUSY_TIMEOUT_MS: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_MMAP_SIZE: int = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    SQLITE_CACHE_SIZE_KB: int = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+    ANSWER_KEY_CACHE_SIZE: int = int(os.getenv("ANSWER_KEY_CACHE_SIZE", "256"))
+    TEST_PAYLOAD_CACHE_SIZE: int = int(os.getenv("TEST_PAYLOAD_CACHE_SIZE", "256"))
+    # Импорт вопросов: строк в одной транзакции
+    IMPORT_BATCH_SIZE: int = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+    # Фоновые задачи импорта. Файлы храним вне uploads/ - он раздается как статика
+    IMPORT_WORKERS: int = int(os.getenv("IMPORT_WORKERS", "2"))
+    IMPORT_UPLOAD_DIR: str = os.getenv("IMPORT_UPLOAD_DIR", "import_uploads")
+    # Процессов для параллельного разбора листов Excel (импорт всех листов)
+    IMPORT_SHEET_WORKERS: int = int(os.getenv("IMPORT_SHEET_WORKERS", "4"))
+    # Фоновый пересчет статистики: 0 воркеров - обработка прямо в запросе
+    STATS_WORKERS: int = int(os.getenv("STATS_WORKERS", "2"))
+    STATS_POLL_INTERVAL: float = float(os.getenv("STATS_POLL_INTERVAL", "2"))
+    STATS_MAX_ATTEMPTS: int = int(os.getenv("STATS_MAX_ATTEMPTS", "5"))
 
 settings = Settings()
\ No newline at end of file
@@ -1,14 +1,15 @@
-from sqlalchemy.orm import joinedload, Session
+from sqlalchemy.orm import joinedload, selectinload, Session
 
 from typing import List, Optional
+from datetime import datetime
 import random
-from . import models, schemas
+from . import models, schemas, answer_keys, question_import
 from .auth import get_password_hash
-from sqlalchemy import select  # ← Добавляем импорт
+from sqlalchemy import select, func  # ← Добавляем импорт
 
 # User CRUD
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = get_password_hash(user.password)
+def create_user(db: Session, user: schemas.UserCreate, password_hash: str = None):
+    hashed_password = password_hash or get_password_hash(user.password)
     db_user = models.User(
         username=user.username,
         email=user.email,
@@ -44,7 +45,13 @@ def create_question(db: Session, question: schemas.QuestionCreate, author_id: in
         allow_latex=getattr(question, 'allow_latex', False),  # ← И ЭТУ
         blackbox_description=getattr(question, 'blackbox_description', None),  # ← И ЭТУ
         answer_requirements=getattr(question, 'answer_requirements', None),  # ← И ЭТУ
-        is_active=True
+        is_active=True,
+        fingerprint=question_import.question_fingerprint(
+            question.question_text,
+            question.answer_type_id,
+            [(option.option_text, option.is_correct) for option in question.answer_options or []],
+            question.correct_answer
+        )
     )
     db.add(db_question)
     db.commit()
@@ -99,8 +106,12 @@ def create_test(db: Session, test: schemas.TestCreate, author_id: int):
     )
     db.add(db_access)
     
-    # Add questions to test
+    # Add questions to test (повтор вопроса в списке - одна связь, см. uq_test_questions_test_question)
+    added = set()
     for test_question in test.questions:
+        if test_question.question_id in added:
+            continue
+        added.add(test_question.question_id)
         db_test_question = models.TestQuestion(
             test_id=db_test.id,
             question_id=test_question.question_id,
@@ -171,6 +182,16 @@ def get_test(db: Session, test_id: int):
         test.questions
     return test
 
+def get_test_with_questions(db: Session, test_id: int):
+    """Загрузить тест со всеми вопросами, типами и вариантами за 3 запроса"""
+    return db.query(models.Test).options(
+        selectinload(models.Test.questions).joinedload(models.TestQuestion.question).options(
+            joinedload(models.Question.type),
+            joinedload(models.Question.answer_type),
+            selectinload(models.Question.answer_options)
+        )
+    ).filter(models.Test.id == test_id).first()
+
 # Group CRUD
 def create_study_group(db: Session, group: schemas.StudyGroupCreate, created_by: int):
     import secrets
@@ -211,11 +232,17 @@ def get_study_group_by_invite_code(db: Session, invite_code: str):
     return db.query(models.StudyGroup).filter(models.StudyGroup.invite_code == invite_code).first()
 
 # Test Session CRUD
-def create_test_session(db: Session, session: schemas.TestSessionCreate, user_id: int):
+def create_test_session(
+    db: Session,
+    session: schemas.TestSessionCreate,
+    user_id: int,
+    test: Optional[models.Test] = None
+):
     print(f"🎯 Создание сессии для теста {session.test_id}, пользователь {user_id}")
     
-    # Get test to calculate max score
-    test = get_test(db, session.test_id)
+    # Get test to calculate max score (если вызывающий код его еще не загрузил)
+    if test is None:
+        test = get_test_with_questions(db, session.test_id)
     if not test:
         print(f"❌ Тест {session.test_id} не найден при создании сессии")
         return None
@@ -239,101 +266,127 @@ def create_test_session(db: Session, session: schemas.TestSessionCreate, user_id
     print(f"✅ Сессия создана с ID: {db_session.id}")
     return db_session
 
+def apply_score_delta(session: models.TestSession, delta: int):
+    """Изменить баллы сессии на delta одним атомарным UPDATE при flush.
+
+    max_score фиксируется при создании сессии, поэтому процент считается
+    от него без чтения вопросов теста.
+    """
+    if not delta:
+        return
+    
+    new_score = func.coalesce(models.TestSession.score, 0) + delta
+    session.score = new_score
+    if session.max_score and session.max_score > 0:
+        session.percentage = new_score * 100.0 / session.max_score
+    else:
+        session.percentage = 0
+
+def recalculate_session_scores(db: Session, test_id: Optional[int] = None, dry_run: bool = False):
+    """Проверить score/percentage сессий по ответам и исправить расхождения.
+
+    max_score не трогаем: он зафиксирован при создании сессии, а вопросы
+    теста с тех пор могли поменяться (как и в indexes.rescore_sessions).
+    Предназначено для офлайн-запуска (см. app/maintenance.py).
+    Возвращает список исправленных сессий.
+    """
+    answer_totals = select(
+        models.UserAnswer.session_id,
+        func.coalesce(func.sum(models.UserAnswer.points_earned), 0).label("score")
+    ).group_by(models.UserAnswer.session_id).subquery()
+    
+    query = db.query(
+        models.TestSession,
+        func.coalesce(answer_totals.c.score, 0)
+    ).outerjoin(
+        answer_totals, answer_totals.c.session_id == models.TestSession.id
+    )
+    
+    if test_id:
+        query = query.filter(models.TestSession.test_id == test_id)
+    
+    repaired = []
+    for session, score in query.yield_per(1000):
+        score = int(score)
+        max_score = session.max_score or 0
+        percentage = round(score / max_score * 100, 2) if max_score > 0 else 0
+        if session.score == score and abs((session.percentage or 0) - percentage) < 0.01:
+            continue
+        
+        repaired.append({
+            "session_id": session.id,
+            "score": [session.score, score],
+            "percentage": [session.percentage, percentage]
+        })
+        
+        if not dry_run:
+            session.score = score
+            session.percentage = percentage
+    
+    if not dry_run:
+        db.commit()
+    
+    return repaired
+
 # В crud.py добавьте отладочную информацию в функцию add_user_answer:
-def add_user_answer(db: Session, answer: schemas.UserAnswerCreate, session_id: int, test_id: int):
+def add_user_answer(
+    db: Session,
+    answer: schemas.UserAnswerCreate,
+    session_id: int,
+    test_id: int,
+    session: Optional[models.TestSession] = None
+):
     try:
         print(f"🎯 [add_user_answer] Начало сохранения ответа")
         print(f"📊 Данные ответа: {answer.dict()}")
         
-        # 1. Получаем сессию
-        session = db.query(models.TestSession).filter(
-            models.TestSession.id == session_id
-        ).first()
+        # 1. Получаем сессию (если вызывающий код ее еще не загрузил)
+        if session is None:
+            session = db.query(models.TestSession).filter(
+                models.TestSession.id == session_id
+            ).first()
         
         if not session:
             print(f"❌ Сессия {session_id} не найдена")
             return None
         
-        # 2. Получаем вопрос
-        question = db.query(models.Question).filter(
-            models.Question.id == answer.question_id
-        ).first()
-        
-        if not question:
-            print(f"❌ Вопрос {answer.question_id} не найден")
-            return None
+        test_id = test_id or session.test_id
+        version = session.test.updated_at if test_id == session.test_id else None
         
-        # 3. Находим связь вопроса с тестом (получаем баллы за этот вопрос)
-        test_question = db.query(models.TestQuestion).filter(
-            models.TestQuestion.test_id == test_id,
-            models.TestQuestion.question_id == answer.question_id
-        ).first()
+        # 2. Берем ключ вопроса из скомпилированного ключа теста
+        key_entry = answer_keys.get_answer_key(db, test_id, version).get(answer.question_id)
         
-        points_per_question = 1  # значение по умолчанию
+        if key_entry is None:
+            print(f"⚠️ Вопрос {answer.question_id} не входит в тест {test_id}, используем значение по умолчанию: 1 балл")
+            key_entry = answer_keys.compile_question_entry(db, answer.question_id)
         
-        if test_question:
-            points_per_question = test_question.points or question.points or 1
-            print(f"✅ Баллы за вопрос из TestQuestion: {points_per_question}")
-        else:
-            print(f"⚠️ TestQuestion не найден, используем значение по умолчанию: 1 балл")
-        
-        # 4. Проверяем правильность ответа
-        is_correct = False
-        points_earned = 0
-        
-        # Проверка для текстовых ответов
-        if question.answer_type_id == 1 and answer.answer_text and question.correct_answer:
-            is_correct = (answer.answer_text.strip().lower() == question.correct_answer.strip().lower())
-            print(f"📝 Текстовый ответ: '{answer.answer_text}' vs '{question.correct_answer}' = {is_correct}")
-        
-        # Проверка для выбора вариантов
-        elif question.answer_type_id in [2, 3] and answer.selected_options:
-            try:
-                import json
-                selected_ids = json.loads(answer.selected_options)
-                print(f"🔢 Выбранные ID: {selected_ids}")
-                
-                # Получаем правильные варианты
-                correct_options = db.query(models.AnswerOption).filter(
-                    models.AnswerOption.question_id == question.id,
-                    models.AnswerOption.is_correct == True
-                ).all()
-                
-                correct_ids = [opt.id for opt in correct_options]
-                print(f"✅ Правильные ID: {correct_ids}")
-                
-                if question.answer_type_id == 2:  # single choice
-                    is_correct = (len(selected_ids) == 1 and selected_ids[0] in correct_ids)
-                elif question.answer_type_id == 3:  # multiple choice
-                    is_correct = (set(selected_ids) == set(correct_ids))
-                
-                print(f"🎯 Проверка выбора: {is_correct}")
-            except Exception as e:
-                print(f"❌ Ошибка проверки вариантов: {e}")
-                is_correct = False
+        if key_entry is None:
+            print(f"❌ Вопрос {answer.question_id} не найден")
+            return None
         
-        # 5. Рассчитываем баллы
-        if is_correct:
-            points_earned = points_per_question
-            print(f"✅ Правильный ответ! Баллы: {points_earned}")
-        else:
-            points_earned = 0
-            print(f"❌ Неправильный ответ! Баллы: 0")
+        # 3. Проверяем правильность ответа и рассчитываем баллы
+        is_correct, points_earned = answer_keys.grade_answer(
+            key_entry, answer.answer_text, answer.selected_options
+        )
+        print(f"🎯 Проверка ответа: {is_correct}, баллы: {points_earned}")
         
-        # 6. Создаем или обновляем ответ
+        # 4. Создаем или обновляем ответ
         existing_answer = db.query(models.UserAnswer).filter(
             models.UserAnswer.session_id == session_id,
             models.UserAnswer.question_id == answer.question_id
         ).first()
         
+        previous_points = 0
+        
         if existing_answer:
             # Обновляем существующий ответ
+            previous_points = existing_answer.points_earned or 0
             existing_answer.answer_text = answer.answer_text
             existing_answer.selected_options = answer.selected_options
             existing_answer.time_spent = answer.time_spent
             existing_answer.is_correct = is_correct
             existing_answer.points_earned = points_earned
-            existing_answer.updated_at = datetime.utcnow()
+            existing_answer.answered_at = datetime.utcnow()
             print(f"🔄 Обновлен существующий ответ ID: {existing_answer.id}")
         else:
             # Создаем новый ответ
@@ -349,30 +402,9 @@ def add_user_answer(db: Session, answer: schemas.UserAnswerCreate, session_id: i
             db.add(db_answer)
             print(f"➕ Создан новый ответ для вопроса {answer.question_id}")
         
-        # 7. Обновляем сессию
-        # Пересчитываем общие баллы для сессии
-        all_answers = db.query(models.UserAnswer).filter(
-            models.UserAnswer.session_id == session_id
-        ).all()
-        
-        total_points = sum(a.points_earned for a in all_answers if a.points_earned)
-        
-        # Получаем максимальные баллы за тест
-        test_questions = db.query(models.TestQuestion).filter(
-            models.TestQuestion.test_id == test_id
-        ).all()
-        
-        max_points = sum(tq.points for tq in test_questions if tq.points)
-        
-        session.score = total_points
-        session.max_score = max_points
-        
-        if max_points > 0:
-            session.percentage = (total_points / max_points) * 100
-        else:
-            session.percentage = 0
-        
-        print(f"📈 Сессия обновлена: {total_points}/{max_points} ({session.percentage}%)")
+        # 5. Обновляем сессию: прибавляем разницу баллов вместо полного пересчета
+        apply_score_delta(session, points_earned - previous_points)
+        print(f"📈 Баллы сессии изменены на {points_earned - previous_points}")
         
         db.commit()
         
@@ -390,7 +422,99 @@ def add_user_answer(db: Session, answer: schemas.UserAnswerCreate, session_id: i
         traceback.print_exc()
         return None
 
-from sqlalchemy import func
+def add_user_answers_batch(db: Session, answers: List[schemas.UserAnswerCreate], session: models.TestSession):
+    """Проверить и сохранить пакет ответов одной транзакцией.
+
+    Все ответы проверяются по одному ключу теста, существующие ответы
+    загружаются одним запросом, вставка и обновление выполняются пачкой.
+    ValueError - некорректный пакет; IntegrityError - параллельный запрос
+    успел вставить ответ на тот же вопрос (транзакция уже откачена).
+    """
+    if not answers:
+        raise ValueError("Пакет ответов пуст")
+    
+    key = answer_keys.get_answer_key(db, session.test_id, session.test.updated_at)
+    question_ids = {answer.question_id for answer in answers}
+    # Вопросы вне теста проверяем по ключам, собранным одним запросом на весь пакет
+    outside_keys = answer_keys.compile_question_entries(db, question_ids - set(key))
+    
+    existing = {
+        row.question_id: row
+        for row in db.query(
+            models.UserAnswer.id,
+            models.UserAnswer.question_id,
+            models.UserAnswer.points_earned
+        ).filter(
+            models.UserAnswer.session_id == session.id,
+            models.UserAnswer.question_id.in_(question_ids)
+        ).all()
+    }
+    
+    now = datetime.utcnow()
+    pending = {}  # question_id -> строка для вставки/обновления (последний ответ побеждает)
+    results = []
+    
+    for answer in answers:
+        key_entry = key.get(answer.question_id) or outside_keys.get(answer.question_id)
+        
+        if key_entry is None:
+            results.append({
+                "question_id": answer.question_id,
+                "status": "error",
+                "error": "Вопрос не найден"
+            })
+            continue
+        
+        is_correct, points_earned = answer_keys.grade_answer(
+            key_entry, answer.answer_text, answer.selected_options
+        )
+        
+        pending[answer.question_id] = {
+            "session_id": session.id,
+            "question_id": answer.question_id,
+            "answer_text": answer.answer_text,
+            "selected_options": answer.selected_options,
+            "time_spent": answer.time_spent,
+            "is_correct": is_correct,
+            "points_earned": points_earned,
+            "answered_at": now
+        }
+        results.append({
+            "question_id": answer.question_id,
+            "status": "updated" if answer.question_id in existing else "created",
+            "is_correct": is_correct,
+            "points_earned": points_earned
+        })
+    
+    inserts = []
+    updates = []
+    delta = 0
+    
+    for question_id, row in pending.items():
+        previous = existing.get(question_id)
+        if previous:
+            delta += row["points_earned"] - (previous.points_earned or 0)
+            updates.append({"id": previous.id, **row})
+        else:
+            delta += row["points_earned"]
+            inserts.append(row)
+    
+    try:
+        if inserts:
+            db.bulk_insert_mappings(models.UserAnswer, inserts)
+        if updates:
+            db.bulk_update_mappings(models.UserAnswer, updates)
+        
+        apply_score_delta(session, delta)
+        db.commit()
+        db.refresh(session)
+    except Exception as e:
+        db.rollback()
+        print(f"🔥 Ошибка пакетного сохранения ответов: {str(e)}")
+        raise
+    
+    print(f"📦 Пакет ответов сессии {session.id}: вставлено {len(inserts)}, обновлено {len(updates)}")
+    return results
 
 def get_user_groups_with_stats(db: Session, user_id: int):
     # Этот запрос вернет группы, где пользователь владелец или участник
@@ -1,20 +1,189 @@
-from sqlalchemy import create_engine
+import threading
+import time
+
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from .config import settings
 
-engine = create_engine(
-    settings.DATABASE_URL, 
-    connect_args={"check_same_thread": False}
-)
+
+class PoolMetrics:
+    """Счетчики пула соединений для мониторинга"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.waits = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.waits += 1
+            self.total_wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def on_checkout(self, *args):
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+    def on_checkin(self, *args):
+        with self._lock:
+            self.checked_out = max(self.checked_out - 1, 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "waits": self.waits,
+                "average_wait_ms": round(self.total_wait_seconds / self.waits * 1000, 3) if self.waits else 0,
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 3)
+            }
+
+
+class MeasuredQueuePool(QueuePool):
+    """QueuePool, который замеряет время ожидания свободного соединения.
+
+    Ожиданием считается только checkout, когда свободных соединений нет и
+    лимит overflow исчерпан; обычная выдача из пула в waits не попадает.
+    """
+
+    metrics: PoolMetrics = None
+
+    def _must_wait(self) -> bool:
+        if self.checkedin() > 0:
+            return False
+        return self._max_overflow > -1 and self.overflow() >= self._max_overflow
+
+    def _do_get(self):
+        if self.metrics is None or not self._must_wait():
+            return super()._do_get()
+
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.metrics.record_wait(time.perf_counter() - started)
+
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def _is_sqlite_memory(url: str) -> bool:
+    return _is_sqlite(url) and (":memory:" in url or url.rstrip("/") in ("sqlite:", "sqlite:/"))
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        if settings.SQLITE_WAL:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+        # Отрицательное значение - размер в KiB, а не в страницах
+        cursor.execute(f"PRAGMA cache_size=-{int(settings.SQLITE_CACHE_SIZE_KB)}")
+    finally:
+        cursor.close()
+
+
+def create_db_engine(url: str = settings.DATABASE_URL):
+    """Создать engine с настройками пула и (для SQLite) PRAGMA при подключении"""
+    kwargs = {}
+
+    if _is_sqlite(url):
+        kwargs["connect_args"] = {
+            "check_same_thread": False,
+            "timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000
+        }
+
+    metrics = PoolMetrics()
+
+    if not _is_sqlite_memory(url):
+        pool_class = type("MeasuredQueuePool", (MeasuredQueuePool,), {"metrics": metrics})
+        kwargs.update(
+            poolclass=pool_class,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            pool_pre_ping=settings.DB_POOL_PRE_PING
+        )
+
+    db_engine = create_engine(url, **kwargs)
+    db_engine.pool_metrics = metrics
+
+    event.listen(db_engine, "checkout", metrics.on_checkout)
+    event.listen(db_engine, "checkin", metrics.on_checkin)
+
+    if _is_sqlite(url):
+        event.listen(db_engine, "connect", _set_sqlite_pragmas)
+
+    return db_engine
+
+
+def get_pool_status(db_engine=None) -> dict:
+    """Состояние пула и накопленные метрики ожидания"""
+    db_engine = db_engine or engine
+    return {
+        "pool": db_engine.pool.status(),
+        **db_engine.pool_metrics.snapshot()
+    }
+
+
+engine = create_db_engine()
+
+# Без DATABASE_READ_URL реплики нет, и чтение идет через тот же engine
+read_engine = create_db_engine(settings.DATABASE_READ_URL) if settings.DATABASE_READ_URL else engine
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 
 Base = declarative_base()
 
+
+def upsert_insert(db):
+    """insert() с поддержкой ON CONFLICT для диалекта базы сессии (PostgreSQL или SQLite)"""
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert
+    return sqlite.insert
+
+
+def has_read_replica() -> bool:
+    return read_engine is not engine
+
+
+def wants_primary(request: Request) -> bool:
+    """Клиент просит read-your-writes: читать с основной базы, а не с реплики"""
+    value = request.headers.get(settings.READ_YOUR_WRITES_HEADER, "")
+    return value.lower() in ("1", "true", "yes")
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def get_read_db(request: Request):
+    """Сессия только для чтения: реплика, либо основная база по запросу клиента"""
+    if has_read_replica() and not wants_primary(request):
+        db = ReadSessionLocal()
+    else:
+        db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
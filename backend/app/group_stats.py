@@ -0,0 +1,470 @@
+import json
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, select
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import upsert_insert
+
+
+def load_group_attempts(db: Session, group_id: int) -> Dict[Tuple[int, int], list]:
+    """Загрузить все попытки участников группы по всем назначениям одним запросом.
+
+    Возвращает словарь (user_id, assignment_id) -> список сессий,
+    отсортированный от лучшей попытки к худшей.
+    """
+    member_ids = select(models.GroupMember.user_id).where(
+        models.GroupMember.group_id == group_id,
+        models.GroupMember.is_active == True
+    )
+    assignment_ids = select(models.TestAssignment.id).where(
+        models.TestAssignment.group_id == group_id,
+        models.TestAssignment.is_active == True
+    )
+
+    rows = db.query(
+        models.TestSession.id,
+        models.TestSession.user_id,
+        models.TestSession.test_id,
+        models.TestSession.assignment_id,
+        models.TestSession.score,
+        models.TestSession.max_score,
+        models.TestSession.percentage,
+        models.TestSession.is_completed,
+        models.TestSession.finished_at,
+        models.TestSession.time_spent,
+        models.TestSession.attempt_number
+    ).filter(
+        models.TestSession.user_id.in_(member_ids),
+        models.TestSession.assignment_id.in_(assignment_ids)
+    ).order_by(
+        models.TestSession.user_id,
+        models.TestSession.assignment_id,
+        models.TestSession.percentage.desc(),
+        models.TestSession.id
+    ).all()
+
+    attempts = defaultdict(list)
+    for row in rows:
+        attempts[(row.user_id, row.assignment_id)].append(row)
+
+    return attempts
+
+
+def load_member_bests(db: Session, group_id: int) -> Dict[Tuple[int, int], models.MemberAssignmentBest]:
+    """Загрузить лучшие завершенные попытки по назначениям группы одним запросом.
+
+    Только активные участники и активные назначения - те же, что попадают
+    в список участников. Возвращает словарь (user_id, assignment_id) -> строка.
+    """
+    rows = db.query(models.MemberAssignmentBest).join(
+        models.TestAssignment,
+        models.TestAssignment.id == models.MemberAssignmentBest.assignment_id
+    ).join(
+        models.GroupMember,
+        and_(
+            models.GroupMember.group_id == models.TestAssignment.group_id,
+            models.GroupMember.user_id == models.MemberAssignmentBest.user_id
+        )
+    ).filter(
+        models.TestAssignment.group_id == group_id,
+        models.TestAssignment.is_active == True,
+        models.GroupMember.is_active == True
+    ).all()
+
+    return {(row.user_id, row.assignment_id): row for row in rows}
+
+
+def load_assignment_summaries(db: Session, group_id: int) -> Dict[int, models.AssignmentSummary]:
+    """Загрузить материализованные сводки по всем назначениям группы"""
+    summaries = db.query(models.AssignmentSummary).join(
+        models.TestAssignment,
+        models.TestAssignment.id == models.AssignmentSummary.assignment_id
+    ).filter(
+        models.TestAssignment.group_id == group_id,
+        models.TestAssignment.is_active == True
+    ).all()
+
+    return {summary.assignment_id: summary for summary in summaries}
+
+
+# ========== МАТЕРИАЛИЗОВАННАЯ СТАТИСТИКА НАЗНАЧЕНИЙ ==========
+#
+# Сводка назначения считается по лучшим попыткам его активных участников
+# (ровно те строки, что отдает load_member_bests), поэтому агрегаты и
+# список участников всегда сходятся. Гистограмма хранит точные проценты.
+
+def _histogram_key(percentage) -> str:
+    return repr(float(percentage or 0))
+
+
+def _lock_summary(db: Session, assignment_id: int) -> models.AssignmentSummary:
+    """Создать сводку назначения при необходимости и заблокировать ее строку.
+
+    Все изменения сводки и лучших попыток назначения идут под этой
+    блокировкой, поэтому параллельные завершения не теряют обновления.
+    """
+    table = models.AssignmentSummary.__table__
+    db.execute(upsert_insert(db)(table).values(
+        assignment_id=assignment_id,
+        completed_count=0,
+        score_sum=0,
+        histogram="{}"
+    ).on_conflict_do_nothing(index_elements=[table.c.assignment_id]))
+
+    return db.query(models.AssignmentSummary).filter(
+        models.AssignmentSummary.assignment_id == assignment_id
+    ).populate_existing().with_for_update().one()
+
+
+def _apply_to_summary(summary: models.AssignmentSummary, old_percentage, new_percentage) -> None:
+    """Заменить в сводке лучшую попытку участника (None - попытки нет)"""
+    histogram = json.loads(summary.histogram)
+
+    if old_percentage is not None:
+        key = _histogram_key(old_percentage)
+        histogram[key] -= 1
+        if not histogram[key]:
+            del histogram[key]
+        summary.completed_count -= 1
+        summary.score_sum -= old_percentage or 0
+
+    if new_percentage is not None:
+        key = _histogram_key(new_percentage)
+        histogram[key] = histogram.get(key, 0) + 1
+        summary.completed_count += 1
+        summary.score_sum += new_percentage or 0
+
+    summary.histogram = json.dumps(histogram, sort_keys=True)
+
+
+def _is_active_member(db: Session, assignment_id: int, user_id: int) -> bool:
+    return db.query(models.GroupMember.id).join(
+        models.TestAssignment,
+        models.TestAssignment.group_id == models.GroupMember.group_id
+    ).filter(
+        models.TestAssignment.id == assignment_id,
+        models.GroupMember.user_id == user_id,
+        models.GroupMember.is_active == True
+    ).first() is not None
+
+
+def record_completed_session(db: Session, session: models.TestSession) -> None:
+    """Учесть завершенную сессию в лучших попытках и сводке назначения (без commit).
+
+    Вызывается в транзакции завершения сессии, поэтому статистика группы
+    не отстает от самих сессий. Полного пересчета нет: сводка меняется
+    на разницу между прежней и новой лучшей попыткой участника.
+    """
+    if not session.assignment_id or not session.is_completed:
+        return
+
+    percentage = session.percentage or 0
+    summary = _lock_summary(db, session.assignment_id)
+
+    best = db.query(models.MemberAssignmentBest).filter(
+        models.MemberAssignmentBest.assignment_id == session.assignment_id,
+        models.MemberAssignmentBest.user_id == session.user_id
+    ).populate_existing().first()
+
+    if best and best.session_id != session.id and (best.percentage or 0) >= percentage:
+        return
+
+    old_percentage = best.percentage if best else None
+    if not best:
+        best = models.MemberAssignmentBest(
+            assignment_id=session.assignment_id,
+            user_id=session.user_id
+        )
+        db.add(best)
+
+    best.session_id = session.id
+    best.score = session.score
+    best.max_score = session.max_score
+    best.percentage = percentage
+    best.finished_at = session.finished_at
+
+    if _is_active_member(db, session.assignment_id, session.user_id):
+        _apply_to_summary(summary, old_percentage, percentage)
+
+
+def record_member_joined(db: Session, group_id: int, user_id: int) -> None:
+    """Добавить в сводки назначений группы уже имеющиеся лучшие попытки нового участника (без commit)"""
+    bests = db.query(models.MemberAssignmentBest).join(
+        models.TestAssignment,
+        models.TestAssignment.id == models.MemberAssignmentBest.assignment_id
+    ).filter(
+        models.TestAssignment.group_id == group_id,
+        models.MemberAssignmentBest.user_id == user_id
+    ).all()
+
+    for best in bests:
+        summary = _lock_summary(db, best.assignment_id)
+        _apply_to_summary(summary, None, best.percentage)
+
+
+def summarize_histogram(summary: Optional[models.AssignmentSummary], passing_score: int) -> dict:
+    """Агрегаты назначения из гистограммы точных процентов.
+
+    Работает за число различных процентов, а не участников.
+    """
+    histogram = []
+    n = 0
+    if summary is not None:
+        histogram = sorted((float(key), count) for key, count in json.loads(summary.histogram).items())
+        n = summary.completed_count or 0
+
+    def count_where(condition) -> int:
+        return sum(count for percentage, count in histogram if condition(percentage))
+
+    def value_at(position: int) -> float:
+        seen = 0
+        for percentage, count in histogram:
+            seen += count
+            if seen > position:
+                return percentage
+        return 0
+
+    result = {
+        "completed_count": n,
+        "passed_count": count_where(lambda score: score >= passing_score),
+        "failed_count": 0,
+        "average_score": 0,
+        "median_score": 0,
+        "max_score": 0,
+        "min_score": 100,
+        "scores_distribution": {
+            "excellent": count_where(lambda score: score >= 90),           # 90-100%
+            "good": count_where(lambda score: 70 <= score < 90),           # 70-89%
+            "satisfactory": count_where(lambda score: 50 <= score < 70),   # 50-69%
+            "poor": count_where(lambda score: score < 50)                  # 0-49%
+        }
+    }
+    result["failed_count"] = n - result["passed_count"]
+
+    if n > 0:
+        result["average_score"] = round(summary.score_sum / n, 1)
+        result["min_score"] = value_at(0)
+        result["max_score"] = value_at(n - 1)
+
+        if n % 2 == 1:
+            result["median_score"] = value_at(n // 2)
+        else:
+            result["median_score"] = round((value_at(n // 2 - 1) + value_at(n // 2)) / 2, 1)
+
+    return result
+
+
+def _passing_score(assignment) -> int:
+    return assignment.passing_score or assignment.test_passing_score or 0
+
+
+def build_members_stats(
+    members,
+    assignments,
+    attempts,
+    bests: Dict[Tuple[int, int], models.MemberAssignmentBest]
+) -> List[dict]:
+    """Собрать статистику по участникам.
+
+    Лучшая попытка - строка MemberAssignmentBest, как и в статистике по тестам;
+    attempts дают список всех попыток и номер/время лучшей.
+    """
+    members_stats = []
+
+    for member in members:
+        user_stats = {
+            "user_id": member.user_id,
+            "username": member.username,
+            "first_name": member.first_name,
+            "last_name": member.last_name,
+            "avatar_url": member.avatar_url,
+            "role": member.role,
+            "joined_at": member.joined_at.isoformat() if member.joined_at else None,
+            "completed_tests": 0,
+            "total_tests": len(assignments),
+            "total_score": 0,
+            "total_max_score": 0,
+            "average_score": 0,
+            "best_score": 0,
+            "worst_score": 100,
+            "passed_tests": 0,
+            "failed_tests": 0,
+            "total_time_spent": 0,
+            "average_time_per_test": 0,
+            "test_scores": [],
+            "activity_timeline": []
+        }
+
+        total_percentage = 0
+        completed_count = 0
+
+        for assignment in assignments:
+            sessions = attempts.get((member.user_id, assignment.assignment_id), [])
+            best = bests.get((member.user_id, assignment.assignment_id))
+            if not sessions and best is None:
+                continue
+
+            # Сессия лучшей попытки - для номера попытки и затраченного времени
+            best_session = next((session for session in sessions if best and session.id == best.session_id), None)
+
+            passing_score = _passing_score(assignment)
+            is_passed = best is not None and best.percentage >= passing_score
+
+            test_score_info = {
+                "test_id": assignment.test_id,
+                "assignment_id": assignment.assignment_id,
+                "test_title": assignment.test_title,
+                "test_description": assignment.test_description,
+                "start_date": assignment.start_date.isoformat() if assignment.start_date else None,
+                "end_date": assignment.end_date.isoformat() if assignment.end_date else None,
+                "time_limit": assignment.time_limit or assignment.test_time_limit,
+                "max_attempts": assignment.max_attempts or assignment.test_max_attempts,
+                "passing_score": passing_score,
+
+                # Статистика по лучшей попытке
+                "best_score": best.score if best else 0,
+                "best_max_score": best.max_score if best else 0,
+                "best_percentage": best.percentage if best else 0,
+                "best_attempt_number": best_session.attempt_number if best_session else None,
+                "best_finished_at": best.finished_at.isoformat() if best and best.finished_at else None,
+                "best_time_spent": best_session.time_spent if best_session else None,
+                "is_passed": is_passed,
+
+                # Общая статистика по всем попыткам
+                "total_attempts": len(sessions),
+                "attempts": [
+                    {
+                        "session_id": session.id,
+                        "score": session.score,
+                        "max_score": session.max_score,
+                        "percentage": session.percentage,
+                        "is_completed": session.is_completed,
+                        "finished_at": session.finished_at.isoformat() if session.finished_at else None,
+                        "time_spent": session.time_spent,
+                        "attempt_number": session.attempt_number
+                    }
+                    for session in sessions
+                ]
+            }
+
+            user_stats["test_scores"].append(test_score_info)
+
+            if best is None:
+                continue
+
+            user_stats["completed_tests"] += 1
+            user_stats["total_score"] += best.score or 0
+            user_stats["total_max_score"] += best.max_score or 0
+            total_percentage += best.percentage
+            completed_count += 1
+
+            if best_session and best_session.time_spent:
+                user_stats["total_time_spent"] += best_session.time_spent
+
+            if best.percentage > user_stats["best_score"]:
+                user_stats["best_score"] = best.percentage
+            if best.percentage < user_stats["worst_score"]:
+                user_stats["worst_score"] = best.percentage
+
+            if is_passed:
+                user_stats["passed_tests"] += 1
+            else:
+                user_stats["failed_tests"] += 1
+
+            if best.finished_at:
+                user_stats["activity_timeline"].append({
+                    "date": best.finished_at.isoformat(),
+                    "test_id": assignment.test_id,
+                    "test_title": assignment.test_title,
+                    "score": best.score,
+                    "max_score": best.max_score,
+                    "percentage": best.percentage,
+                    "is_passed": is_passed,
+                    "attempt_number": best_session.attempt_number if best_session else None
+                })
+
+        # Рассчитываем средние значения
+        if completed_count > 0:
+            user_stats["average_score"] = round(total_percentage / completed_count, 1)
+
+            if user_stats["total_time_spent"] > 0:
+                user_stats["average_time_per_test"] = round(user_stats["total_time_spent"] / completed_count)
+
+        user_stats["activity_timeline"].sort(key=lambda x: x["date"], reverse=True)
+
+        members_stats.append(user_stats)
+
+    # Сортируем участников по среднему баллу (по убыванию)
+    members_stats.sort(key=lambda x: x["average_score"], reverse=True)
+
+    return members_stats
+
+
+def build_test_statistics(
+    members,
+    assignments,
+    attempts,
+    bests: Dict[Tuple[int, int], models.MemberAssignmentBest],
+    summaries: Dict[int, models.AssignmentSummary]
+) -> List[dict]:
+    """Собрать статистику по тестам (с медианой).
+
+    Агрегаты берутся из материализованной сводки назначения, участники - из
+    лучших попыток (MemberAssignmentBest) активных участников: сводка ведется
+    по тем же строкам. attempts нужен только чтобы отметить участников с
+    незавершенными попытками.
+    """
+    test_statistics = []
+
+    for assignment in assignments:
+        test_stat = {
+            "test_id": assignment.test_id,
+            "assignment_id": assignment.assignment_id,
+            "test_title": assignment.test_title,
+            "start_date": assignment.start_date.isoformat() if assignment.start_date else None,
+            "end_date": assignment.end_date.isoformat() if assignment.end_date else None,
+            "passing_score": _passing_score(assignment),
+            "total_participants": len(members),
+            "participated_count": 0,
+            "completed_count": 0,
+            "passed_count": 0,
+            "failed_count": 0,
+            "average_score": 0,
+            "median_score": 0,
+            "max_score": 0,
+            "min_score": 100,
+            "scores_distribution": {},
+            "participants": []
+        }
+
+        for member in members:
+            best = bests.get((member.user_id, assignment.assignment_id))
+            has_attempt = best is not None or bool(attempts.get((member.user_id, assignment.assignment_id)))
+
+            participant_info = {
+                "user_id": member.user_id,
+                "username": member.username,
+                "first_name": member.first_name,
+                "last_name": member.last_name,
+                "has_attempt": has_attempt,
+                "is_completed": best is not None,
+                "percentage": best.percentage if best else 0,
+                "score": best.score if best else 0,
+                "max_score": best.max_score if best else 0,
+                "is_passed": best is not None and best.percentage >= test_stat["passing_score"],
+                "finished_at": best.finished_at.isoformat() if best and best.finished_at else None
+            }
+
+            if has_attempt:
+                test_stat["participated_count"] += 1
+
+            test_stat["participants"].append(participant_info)
+
+        summary = summaries.get(assignment.assignment_id)
+        test_stat.update(summarize_histogram(summary, test_stat["passing_score"]))
+        test_statistics.append(test_stat)
+
+    return test_statistics
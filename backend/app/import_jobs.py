@@ -0,0 +1,421 @@
+"""Фоновые задачи импорта вопросов.
+
+Запрос только сохраняет файл и создает ImportJob; разбор и запись выполняет
+пул воркеров. После каждой записанной пачки в задаче сохраняются счетчики и
+номер последней строки (checkpoint_row). Если воркер упал, задача через
+STALE_LOCK_TIMEOUT снова забирается и продолжается со следующей строки.
+Повтор уже записанной строки безопасен: вопрос найдется по отпечатку.
+
+Пока задача выполняется, heartbeat-поток продлевает locked_at независимо от
+записи пачек (медленный лист или большая пачка не делают задачу «зависшей»).
+Каждая запись идет только если locked_by все еще токен этого воркера: если
+задачу забрал другой воркер, пачка откатывается и выполнение прекращается.
+"""
+import json
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from . import models, answer_keys, test_payloads, question_import
+from .config import settings
+from .database import SessionLocal
+from .utils import file_importer
+
+SUPPORTED_EXTENSIONS = ('.csv', '.xlsx', '.xls')
+# Сколько ошибок хранить в задаче
+MAX_STORED_ERRORS = 100
+# Через сколько считать задачу "running" зависшей (воркер упал)
+STALE_LOCK_TIMEOUT = timedelta(minutes=5)
+# Как часто продлевать locked_at выполняющейся задачи (сильно меньше STALE_LOCK_TIMEOUT)
+HEARTBEAT_INTERVAL = 30
+POLL_INTERVAL = 5
+
+
+def create_job(
+    db: Session,
+    filename: str,
+    file_obj: BinaryIO,
+    author_id: int,
+    test_id: Optional[int] = None,
+    category_id: Optional[int] = None,
+    all_sheets: bool = False
+) -> models.ImportJob:
+    """Сохранить загруженный файл на диск и поставить задачу в очередь"""
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension not in SUPPORTED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="Неподдерживаемый формат файла")
+
+    os.makedirs(settings.IMPORT_UPLOAD_DIR, exist_ok=True)
+    file_path = os.path.join(settings.IMPORT_UPLOAD_DIR, f"{uuid.uuid4()}{extension}")
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(file_obj, buffer)
+
+    job = models.ImportJob(
+        author_id=author_id,
+        test_id=test_id,
+        category_id=category_id,
+        all_sheets=all_sheets,
+        filename=filename,
+        file_path=file_path,
+        status='queued',
+        attempts=0
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def claim_job(db: Session, job_id: int) -> Optional[str]:
+    """Атомарно забрать задачу: queued или зависшую running -> running.
+
+    Возвращает токен блокировки (None - задачу уже забрали).
+    """
+    now = datetime.utcnow()
+    lock_token = uuid.uuid4().hex
+    claimed = db.query(models.ImportJob).filter(
+        models.ImportJob.id == job_id,
+        or_(
+            models.ImportJob.status == 'queued',
+            and_(
+                models.ImportJob.status == 'running',
+                models.ImportJob.locked_at < now - STALE_LOCK_TIMEOUT
+            )
+        )
+    ).update({
+        "status": 'running',
+        "locked_at": now,
+        "locked_by": lock_token,
+        "attempts": models.ImportJob.attempts + 1
+    }, synchronize_session=False)
+    db.commit()
+    return lock_token if claimed else None
+
+
+def claim_jobs(db: Session, limit: int) -> List[Tuple[int, str]]:
+    """Забрать до limit задач из очереди, включая брошенные упавшими воркерами"""
+    if limit <= 0:
+        return []
+
+    candidates = db.query(models.ImportJob.id).filter(
+        or_(
+            models.ImportJob.status == 'queued',
+            and_(
+                models.ImportJob.status == 'running',
+                models.ImportJob.locked_at < datetime.utcnow() - STALE_LOCK_TIMEOUT
+            )
+        )
+    ).order_by(models.ImportJob.id).limit(limit).all()
+
+    claimed = []
+    for (job_id,) in candidates:
+        lock_token = claim_job(db, job_id)
+        if lock_token:
+            claimed.append((job_id, lock_token))
+    return claimed
+
+
+def touch_lock(db: Session, job_id: int, lock_token: str, release: bool = False) -> bool:
+    """Продлить (release=True - снять) блокировку, если задача все еще наша.
+
+    Выполняется в текущей транзакции: False - задачу забрал другой воркер.
+    """
+    values = {"locked_at": None, "locked_by": None} if release else {"locked_at": datetime.utcnow()}
+    updated = db.query(models.ImportJob).filter(
+        models.ImportJob.id == job_id,
+        models.ImportJob.locked_by == lock_token
+    ).update(values, synchronize_session=False)
+    return bool(updated)
+
+
+def _guard_lock(db: Session, job_id: int, lock_token: str, release: bool = False) -> None:
+    """Перед коммитом: блокировка не наша - запись прерывается (см. WriteAborted)"""
+    if not touch_lock(db, job_id, lock_token, release):
+        raise question_import.WriteAborted(f"задачу импорта {job_id} забрал другой воркер")
+
+
+class _Heartbeat:
+    """Поток, продлевающий locked_at задачи, пока она выполняется"""
+
+    def __init__(self, job_id: int, lock_token: str, interval: float = HEARTBEAT_INTERVAL):
+        self.job_id = job_id
+        self.lock_token = lock_token
+        self.interval = interval
+        # Установлен - задачу забрал другой воркер, пора остановиться
+        self.lost = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"import-heartbeat-{job_id}", daemon=True)
+
+    def __enter__(self) -> "_Heartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            db = SessionLocal()
+            try:
+                alive = touch_lock(db, self.job_id, self.lock_token)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                print(f"⚠️ Heartbeat импорта {self.job_id}: {e}")
+                continue
+            finally:
+                db.close()
+
+            if not alive:
+                print(f"⚠️ Импорт {self.job_id}: задачу забрал другой воркер, останавливаемся")
+                self.lost.set()
+                return
+
+
+def _stoppable(records: Iterator[dict], should_stop: Callable[[], bool]) -> Iterator[dict]:
+    for record in records:
+        if should_stop():
+            return
+        yield record
+
+
+def _finish_file(job: models.ImportJob) -> None:
+    try:
+        os.remove(job.file_path)
+    except OSError:
+        pass
+
+
+def run_job(job_id: int, lock_token: str, should_stop: Callable[[], bool] = lambda: False) -> None:
+    """Выполнить (или продолжить с контрольной точки) уже забранную задачу.
+
+    lock_token - токен из claim_job; без него задача ничего не записывает.
+    should_stop() == True - дописать текущую пачку и вернуть задачу в очередь.
+    """
+    db = SessionLocal()
+    try:
+        job = db.query(models.ImportJob).filter(models.ImportJob.id == job_id).first()
+        if not job or job.status != 'running' or job.locked_by != lock_token:
+            return
+
+        # Что уже записано до перезапуска
+        checkpoint_row = job.checkpoint_row or 0
+        base_rows = job.rows_processed or 0
+        base_imported = job.imported_count or 0
+        base_new = job.new_count or 0
+        base_reused = job.reused_count or 0
+        base_errors = json.loads(job.errors) if job.errors else []
+        if job.started_at is None:
+            job.started_at = datetime.utcnow()
+            _guard_lock(db, job_id, lock_token)
+            db.commit()
+
+        if checkpoint_row:
+            print(f"🔄 Импорт {job_id}: продолжаем после строки {checkpoint_row}")
+
+        stats = question_import.ImportStats()
+        writer = question_import.BulkQuestionWriter(
+            db,
+            author_id=job.author_id,
+            test_id=job.test_id,
+            start_sort_order=question_import.next_sort_order(db, job.test_id) if job.test_id else 0,
+            before_commit=lambda: _guard_lock(db, job_id, lock_token)
+        )
+
+        def save_progress(last_row: Optional[int] = None, release: bool = False) -> None:
+            job.rows_processed = base_rows + stats.total_rows
+            if last_row is not None:
+                job.checkpoint_row = last_row
+            job.imported_count = base_imported + writer.imported_count
+            job.new_count = base_new + writer.new_count
+            job.reused_count = base_reused + writer.reused_count
+            job.failed_count = job.rows_processed - job.imported_count
+            job.errors = json.dumps(
+                (base_errors + stats.errors + writer.errors)[:MAX_STORED_ERRORS], ensure_ascii=False
+            )
+            _guard_lock(db, job_id, lock_token, release)
+            db.commit()
+
+        writer.on_flush = save_progress
+
+        with _Heartbeat(job_id, lock_token) as heartbeat:
+            stopping = lambda: should_stop() or heartbeat.lost.is_set()
+            try:
+                with open(job.file_path, "rb") as file_obj:
+                    records = (
+                        record for record in _stoppable(
+                            file_importer.iter_question_records(job.filename, file_obj, all_sheets=job.all_sheets),
+                            stopping
+                        )
+                        if record['row_number'] > checkpoint_row
+                    )
+                    question_import.import_records(
+                        db, records, writer, stats,
+                        category_id=None if job.test_id else (job.category_id or 1)
+                    )
+            except question_import.WriteAborted:
+                raise
+            except Exception as e:
+                db.rollback()
+                detail = e.detail if isinstance(e, HTTPException) else str(e)
+                print(f"❌ Ошибка фонового импорта {job_id}: {detail}")
+                job.status = 'failed'
+                job.last_error = str(detail)[:1000]
+                job.finished_at = datetime.utcnow()
+                save_progress(release=True)
+                _finish_file(job)
+                return
+
+            # Все пройденные строки записаны (writer.finish), двигаем точку до конца прохода
+            if stopping():
+                job.status = 'queued'
+                save_progress(stats.last_row or None, release=True)
+                print(f"⏸️ Импорт {job_id} остановлен на строке {job.checkpoint_row}, продолжится после перезапуска")
+                return
+
+            job.status = 'done'
+            job.finished_at = datetime.utcnow()
+            save_progress(stats.last_row or None, release=True)
+
+        _finish_file(job)
+
+        if job.test_id:
+            answer_keys.invalidate_test(job.test_id)
+            test_payloads.invalidate_test(job.test_id)
+
+        print(f"✅ Импорт {job_id} завершен: {job.imported_count} из {job.rows_processed} "
+              f"(новых {job.new_count}, из банка {job.reused_count})")
+    except question_import.WriteAborted as e:
+        db.rollback()
+        print(f"⚠️ Импорт {job_id} прерван без записи: {e}")
+    finally:
+        db.close()
+
+
+def process_job(job_id: int) -> None:
+    """Забрать и выполнить задачу (без пула воркеров - фоном после ответа)"""
+    db = SessionLocal()
+    try:
+        lock_token = claim_job(db, job_id)
+    finally:
+        db.close()
+    if lock_token:
+        run_job(job_id, lock_token)
+
+
+def job_status(job: models.ImportJob) -> dict:
+    """Прогресс задачи для опроса клиентом"""
+    elapsed = None
+    rows_per_second = None
+    if job.started_at:
+        started_at = job.started_at.replace(tzinfo=None)
+        finished_at = job.finished_at.replace(tzinfo=None) if job.finished_at else datetime.utcnow()
+        elapsed = max((finished_at - started_at).total_seconds(), 0)
+        if elapsed > 0:
+            rows_per_second = round(job.rows_processed / elapsed, 1)
+
+    return {
+        "id": job.id,
+        "status": job.status,
+        "filename": job.filename,
+        "test_id": job.test_id,
+        "all_sheets": job.all_sheets,
+        "rows_processed": job.rows_processed,
+        "imported_count": job.imported_count,
+        "new_count": job.new_count,
+        "reused_count": job.reused_count,
+        "failed_count": job.failed_count,
+        "errors": json.loads(job.errors) if job.errors else [],
+        "last_error": job.last_error,
+        "attempts": job.attempts,
+        "elapsed_seconds": round(elapsed, 1) if elapsed is not None else None,
+        "rows_per_second": rows_per_second,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at
+    }
+
+
+class ImportJobPool:
+    """Диспетчер очереди задач импорта и пул воркеров внутри процесса"""
+
+    def __init__(self, workers: int, poll_interval: float = POLL_INTERVAL):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._executor = None
+        self._thread = None
+        self._active = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.workers <= 0 or self.is_running:
+            return
+        self._stopping.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="import-worker")
+        self._thread = threading.Thread(target=self._run, name="import-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        if self._executor is not None:
+            # Воркеры дописывают текущую пачку и возвращают задачи в очередь
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def notify(self) -> None:
+        """Разбудить диспетчер после создания задачи"""
+        self._wakeup.set()
+
+    def _run_job(self, job_id: int, lock_token: str) -> None:
+        try:
+            run_job(job_id, lock_token, should_stop=self._stopping.is_set)
+        except Exception as e:
+            print(f"❌ Воркер импорта, задача {job_id}: {e}")
+        finally:
+            with self._lock:
+                self._active -= 1
+            self._wakeup.set()
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                with self._lock:
+                    free = self.workers - self._active
+
+                db = SessionLocal()
+                try:
+                    claimed = claim_jobs(db, free)
+                finally:
+                    db.close()
+
+                for job_id, lock_token in claimed:
+                    with self._lock:
+                        self._active += 1
+                    self._executor.submit(self._run_job, job_id, lock_token)
+            except Exception as e:
+                print(f"❌ Ошибка диспетчера импорта: {e}")
+
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+
+pool = ImportJobPool(settings.IMPORT_WORKERS)
@@ -0,0 +1,211 @@
+"""Составные индексы под частые фильтры.
+
+Индексы объявлены в моделях (__table_args__). В существующей базе их создает
+миграция 0003 (см. app.migrations) через create_hot_indexes по замороженным
+определениям из app.schema_history.
+"""
+from sqlalchemy import column, delete, func, inspect, select, table, text, update
+
+from . import models
+
+# (модель, имя индекса) - порядок важен только для вывода
+HOT_INDEXES = [
+    (models.TestSession, "ix_test_sessions_user_test_assignment"),
+    (models.UserAnswer, "uq_user_answers_session_question"),
+    (models.TestQuestion, "uq_test_questions_test_question"),
+    (models.GroupMember, "ix_group_members_group_user_active"),
+    (models.TestAccess, "ix_test_access_test_user"),
+    (models.UserStatistics, "uq_user_statistics_user_category"),
+    (models.AnswerOption, "ix_answer_options_question_correct"),
+]
+
+
+def get_index(model, name: str):
+    for index in model.__table__.indexes:
+        if index.name == name:
+            return index
+    raise KeyError(name)
+
+
+def dedupe_user_answers(connection) -> int:
+    """Оставить по одному (последнему) ответу на вопрос в сессии.
+
+    Без этого уникальный индекс не создастся на базе, где повторный ответ
+    добавлялся новой строкой. Баллы затронутых сессий пересчитываются по
+    оставшимся ответам до удаления дублей: если миграция прервется, повторный
+    запуск найдет те же сессии и посчитает их так же.
+    """
+    session_ids = [row.session_id for row in connection.execute(text(
+        "SELECT DISTINCT session_id FROM user_answers"
+        " GROUP BY session_id, question_id HAVING COUNT(*) > 1"
+    ))]
+    if not session_ids:
+        return 0
+
+    rescore_sessions(connection, session_ids)
+
+    result = connection.execute(text(
+        "DELETE FROM user_answers WHERE id NOT IN ("
+        " SELECT MAX(id) FROM user_answers GROUP BY session_id, question_id"
+        ")"
+    ))
+    return result.rowcount or 0
+
+
+def dedupe_test_questions(connection) -> int:
+    """Оставить одну (первую) связь вопроса с тестом.
+
+    Дубли появлялись при повторном импорте в тест и при повторах в списке
+    вопросов запроса. Первая связь хранит исходные sort_order и points.
+    """
+    result = connection.execute(text(
+        "DELETE FROM test_questions WHERE id NOT IN ("
+        " SELECT MIN(id) FROM test_questions GROUP BY test_id, question_id"
+        ")"
+    ))
+    return result.rowcount or 0
+
+
+def merge_duplicate_user_statistics(connection) -> int:
+    """Слить строки user_statistics с одинаковыми (user_id, category_id).
+
+    Без этого уникальный индекс не создастся на базе, где статистика
+    создавалась гонкой параллельных завершений. Счетчики складываются,
+    best_score и last_activity берутся максимальные, average_score
+    пересчитывается из сложенных счетчиков. Остается строка с меньшим id.
+    Возвращает число слитых пар пользователь/категория.
+    """
+    stats = table(
+        "user_statistics",
+        column("id"), column("user_id"), column("category_id"), column("tests_completed"),
+        column("questions_answered"), column("correct_answers"), column("total_points"),
+        column("average_score"), column("best_score"), column("last_activity"),
+    )
+    duplicates = connection.execute(
+        select(stats.c.user_id, stats.c.category_id)
+        .group_by(stats.c.user_id, stats.c.category_id)
+        .having(func.count() > 1)
+    ).all()
+
+    for user_id, category_id in duplicates:
+        rows = connection.execute(
+            select(stats).where(stats.c.user_id == user_id, stats.c.category_id == category_id).order_by(stats.c.id)
+        ).all()
+        keeper, others = rows[0], rows[1:]
+
+        questions_answered = sum(row.questions_answered or 0 for row in rows)
+        correct_answers = sum(row.correct_answers or 0 for row in rows)
+        activities = [row.last_activity for row in rows if row.last_activity is not None]
+        connection.execute(update(stats).where(stats.c.id == keeper.id).values(
+            tests_completed=sum(row.tests_completed or 0 for row in rows),
+            questions_answered=questions_answered,
+            correct_answers=correct_answers,
+            total_points=sum(row.total_points or 0 for row in rows),
+            average_score=(correct_answers / questions_answered) * 100 if questions_answered > 0 else 0,
+            best_score=max(row.best_score or 0 for row in rows),
+            last_activity=max(activities) if activities else None
+        ))
+        connection.execute(delete(stats).where(stats.c.id.in_([row.id for row in others])))
+
+    return len(duplicates)
+
+
+def rescore_sessions(connection, session_ids: list) -> list:
+    """Пересчитать score/percentage сессий по последним ответам на каждый вопрос.
+
+    max_score не трогаем: он зависит от теста, а не от ответов.
+    Возвращает список изменений и печатает отчет.
+    """
+    changes = []
+    for session_id in session_ids:
+        session = connection.execute(
+            text("SELECT score, max_score FROM test_sessions WHERE id = :session_id"),
+            {"session_id": session_id}
+        ).first()
+        if session is None:
+            continue
+
+        score = connection.execute(text(
+            "SELECT COALESCE(SUM(points_earned), 0) FROM user_answers WHERE id IN ("
+            " SELECT MAX(id) FROM user_answers WHERE session_id = :session_id GROUP BY question_id"
+            ")"
+        ), {"session_id": session_id}).scalar()
+        score = int(score or 0)
+        max_score = session.max_score or 0
+        percentage = round(score / max_score * 100, 2) if max_score > 0 else 0
+
+        connection.execute(
+            text("UPDATE test_sessions SET score = :score, percentage = :percentage WHERE id = :session_id"),
+            {"score": score, "percentage": percentage, "session_id": session_id}
+        )
+        changes.append({"session_id": session_id, "score": [session.score, score]})
+        print(f"🧮 Сессия {session_id}: score {session.score} -> {score}")
+
+    print(f"🧮 Пересчитано сессий после удаления дублей: {len(changes)}")
+    return changes
+
+
+def live_hot_indexes() -> list:
+    """Индексы из HOT_INDEXES в том виде, как они объявлены в моделях сейчас"""
+    return [get_index(model, name) for model, name in HOT_INDEXES]
+
+
+def create_hot_indexes(connection, online: bool = False, hot_indexes: list = None) -> list:
+    """Создать недостающие индексы, вернуть имена созданных.
+
+    hot_indexes - список объектов Index; по умолчанию текущие из моделей,
+    миграции передают свои замороженные определения (app.schema_history).
+    online=True на PostgreSQL строит индексы через CREATE INDEX CONCURRENTLY,
+    не блокируя запись; соединение должно быть в режиме AUTOCOMMIT.
+    """
+    if hot_indexes is None:
+        hot_indexes = live_hot_indexes()
+
+    created = []
+    for index in hot_indexes:
+        if index_exists(connection, index.table.name, index.name):
+            continue
+
+        if index.unique and index.table.name == "user_answers":
+            removed = dedupe_user_answers(connection)
+            if removed:
+                print(f"🧹 Удалено дублирующихся ответов: {removed}")
+
+        if index.unique and index.table.name == "test_questions":
+            removed = dedupe_test_questions(connection)
+            if removed:
+                print(f"🧹 Удалено дублирующихся вопросов в тестах: {removed}")
+
+        if index.unique and index.table.name == "user_statistics":
+            merged = merge_duplicate_user_statistics(connection)
+            if merged:
+                print(f"🧹 Объединено дублирующихся строк статистики: {merged} пар пользователь/категория")
+
+        create_index(connection, index, online)
+        created.append(index.name)
+        print(f"✅ Создан индекс {index.name}")
+
+    return created
+
+
+def create_index(connection, index, online: bool = False) -> None:
+    if online and connection.dialect.name == "postgresql":
+        columns = ", ".join(column.name for column in index.columns)
+        unique = "UNIQUE " if index.unique else ""
+        connection.execute(text(
+            f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {index.name} "
+            f"ON {index.table.name} ({columns})"
+        ))
+    else:
+        index.create(bind=connection)
+
+
+def drop_hot_indexes(connection) -> None:
+    """Удалить индексы (используется бенчмарком для замера «до»)"""
+    for model, name in HOT_INDEXES:
+        if index_exists(connection, model.__tablename__, name):
+            get_index(model, name).drop(bind=connection)
+
+
+def index_exists(connection, table_name: str, name: str) -> bool:
+    return any(index["name"] == name for index in inspect(connection).get_indexes(table_name))
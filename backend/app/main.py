@@ -1,11 +1,13 @@
 import os
+import random
 import shutil
 import uuid
 from fastapi import UploadFile, File
 from fastapi.staticfiles import StaticFiles
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, BackgroundTasks, status
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session, joinedload
 from typing import List, Optional, Dict, Any 
 import json
 from datetime import datetime, timedelta
@@ -14,11 +16,11 @@ import pandas as pd
 from fastapi import UploadFile, File, HTTPException
 from typing import List, Optional, Dict, Any
 import io
-from . import models, schemas, crud, auth
-from .database import SessionLocal, engine, get_db
+from . import models, schemas, crud, auth, group_stats, answer_keys, test_payloads, stats_pipeline, migrations, passwords, refresh_tokens, question_import, import_jobs
+from .database import SessionLocal, engine, read_engine, get_db, get_read_db, get_pool_status, has_read_replica
 from sqlalchemy import func
-# Создаем таблицы
-models.Base.metadata.create_all(bind=engine)
+from sqlalchemy.exc import IntegrityError
+# Схема создается и обновляется миграциями: python -m app.maintenance migrate
 
 # Простая схема для назначения тестов (добавьте в этот файл)
 class TestAssignmentRequest(BaseModel):
@@ -33,6 +35,25 @@ app = FastAPI(
     version="1.0.0"
 )
 
+@app.on_event("startup")
+def check_schema_migrations():
+    # Только чтение: DDL при старте не выполняем
+    pending = migrations.pending_migrations(engine)
+    if pending:
+        print(f"⚠️ Не применено миграций: {len(pending)}. Запустите: python -m app.maintenance migrate")
+
+@app.on_event("startup")
+def start_background_workers():
+    stats_pipeline.pipeline.start()
+    import_jobs.pool.start()
+
+@app.on_event("shutdown")
+def stop_background_workers():
+    stats_pipeline.pipeline.stop()
+    import_jobs.pool.stop()
+    passwords.hashing_pool.shutdown()
+    file_importer.shutdown_sheet_pool()
+
 # Создадим папки для загрузок если их нет
 os.makedirs("uploads/images", exist_ok=True)
 os.makedirs("uploads/videos", exist_ok=True)
@@ -86,40 +107,116 @@ def read_root():
 def health_check():
     return {"status": "healthy"}
 
+@app.get("/health/db")
+def database_health_check():
+    """Метрики пула соединений для мониторинга"""
+    result = {"status": "healthy", "database": get_pool_status()}
+    if has_read_replica():
+        result["read_replica"] = get_pool_status(read_engine)
+    return result
+
+@app.get("/health/hashing")
+def hashing_health_check():
+    """Очередь и нагрузка пула хеширования паролей"""
+    return {"status": "healthy", "hashing": passwords.hashing_pool.status()}
+
 # Роуты аутентификации
+def hashing_overloaded():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Сервер перегружен, повторите попытку позже",
+        headers={"Retry-After": "1"},
+    )
+
+# register и login асинхронные ради пула хеширования; запросы к базе в них
+# выполняются через run_in_threadpool, чтобы не блокировать event loop
 @app.post("/auth/register", response_model=schemas.UserResponse)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_username(db, username=user.username)
+async def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
+    db_user = await run_in_threadpool(crud.get_user_by_username, db, username=user.username)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Пользователь с таким именем уже зарегистрирован"
         )
-    return crud.create_user(db=db, user=user)
+    try:
+        password_hash = await passwords.hash_password_async(user.password)
+    except passwords.HashingOverloaded:
+        raise hashing_overloaded()
+    return await run_in_threadpool(crud.create_user, db=db, user=user, password_hash=password_hash)
 
 @app.post("/auth/login", response_model=schemas.Token)
-def login(user_data: schemas.UserLogin, db: Session = Depends(get_db)):
-    user = auth.authenticate_user(db, user_data.username, user_data.password)
+async def login(user_data: schemas.UserLogin, db: Session = Depends(get_db)):
+    try:
+        user = await auth.authenticate_user(db, user_data.username, user_data.password)
+    except passwords.HashingOverloaded:
+        raise hashing_overloaded()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверное имя пользователя или пароль",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = auth.create_access_token(data={"sub": user.username})
-    return {"access_token": access_token, "token_type": "bearer"}
+    access_token = auth.create_access_token(data=auth.build_token_claims(user))
+    refresh_token = await run_in_threadpool(refresh_tokens.start_refresh_session, db, user.id)
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+@app.post("/auth/refresh", response_model=schemas.Token)
+def refresh_access_token(data: schemas.RefreshTokenRequest, db: Session = Depends(get_db)):
+    """Обменять refresh-токен на новую пару токенов (без проверки пароля)"""
+    try:
+        result = refresh_tokens.rotate_refresh_token(db, data.refresh_token)
+    except refresh_tokens.RefreshTokenConflict:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Refresh-токен уже обновлен параллельным запросом, используйте новый"
+        )
+    if not result:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Refresh-токен недействителен",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    user, refresh_token = result
+    access_token = auth.create_access_token(data=auth.build_token_claims(user))
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+@app.post("/auth/logout")
+def logout(data: schemas.RefreshTokenRequest, db: Session = Depends(get_db)):
+    """Выход на этом устройстве: отзыв цепочки refresh-токена"""
+    refresh_tokens.revoke_refresh_token(db, data.refresh_token)
+    return {"message": "Выход выполнен"}
+
+@app.post("/auth/logout-all")
+def logout_all(
+    db: Session = Depends(get_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
+):
+    """Выход на всех устройствах: отзыв всех refresh-токенов и выданных access-токенов"""
+    revoked = refresh_tokens.revoke_user_tokens(db, current_user.id, "logout_all")
+    user = db.query(models.User).filter(models.User.id == current_user.id).first()
+    # Новая версия токенов делает недействительными уже выданные access-токены
+    user.token_version = (user.token_version or 0) + 1
+    db.commit()
+    return {"message": "Выход выполнен на всех устройствах", "revoked": revoked}
 
 @app.get("/auth/me", response_model=schemas.UserResponse)
-def get_current_user(current_user: models.User = Depends(auth.get_current_active_user)):
-    return current_user
+def get_current_user(
+    db: Session = Depends(get_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
+):
+    # В токене только данные для проверки прав, профиль читаем из базы
+    user = db.query(models.User).filter(models.User.id == current_user.id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    return user
 
 # Роуты пользователей
 @app.get("/users/", response_model=List[schemas.UserResponse])
 def get_users(
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    db: Session = Depends(get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     if current_user.role_id != 3:  # Only admin can see all users
         raise HTTPException(status_code=403, detail="Недостаточно прав")
@@ -131,7 +228,7 @@ def get_users(
 def create_question(
     question: schemas.QuestionCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     return crud.create_question(db=db, question=question, author_id=current_user.id)
 
@@ -140,8 +237,8 @@ def get_questions(
     skip: int = 0,
     limit: int = 100,
     category_id: int = None,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    db: Session = Depends(get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     query = db.query(models.Question).filter(models.Question.is_active == True)
     
@@ -154,8 +251,8 @@ def get_questions(
 @app.get("/questions/{question_id}", response_model=schemas.QuestionResponse)
 def get_question(
     question_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    db: Session = Depends(get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     question = crud.get_question(db, question_id=question_id)
     if question is None:
@@ -167,7 +264,7 @@ def get_question(
 def create_test(
     test: schemas.TestCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     return crud.create_test(db=db, test=test, author_id=current_user.id)
 
@@ -175,8 +272,8 @@ def create_test(
 def get_tests(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    db: Session = Depends(get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     tests = crud.get_tests_for_user(db, user_id=current_user.id, skip=skip, limit=limit)
     return tests
@@ -187,12 +284,13 @@ def get_tests(
 def get_test(
     test_id: int,
     assignment_id: Optional[int] = None,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    db: Session = Depends(get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     print(f"🎯 GET /tests/{test_id} - пользователь: {current_user.id}, assignment: {assignment_id}")
     
-    test = crud.get_test(db, test_id=test_id)
+    # Тест, вопросы, типы и варианты ответов загружаются за фиксированное число запросов
+    test = crud.get_test_with_questions(db, test_id=test_id)
     if test is None:
         raise HTTPException(status_code=404, detail="Тест не найден")
     
@@ -217,16 +315,6 @@ def get_test(
             if group_member:
                 print(f"✅ Доступ разрешен через группу {assignment.group_id}")
                 
-                # Загружаем данные
-                for test_question in test.questions:
-                    if test_question.question:
-                        test_question.question.answer_type = db.query(models.AnswerType).filter(
-                            models.AnswerType.id == test_question.question.answer_type_id
-                        ).first()
-                        test_question.question.type = db.query(models.QuestionType).filter(
-                            models.QuestionType.id == test_question.question.type_id
-                        ).first()
-                
                 return test
     
     # ДОПОЛНИТЕЛЬНО: Ищем назначения теста в группах пользователя
@@ -251,16 +339,6 @@ def get_test(
         if assignments:
             print(f"✅ Найдено {len(assignments)} назначений в группах пользователя")
             
-            # Загружаем данные
-            for test_question in test.questions:
-                if test_question.question:
-                    test_question.question.answer_type = db.query(models.AnswerType).filter(
-                        models.AnswerType.id == test_question.question.answer_type_id
-                    ).first()
-                    test_question.question.type = db.query(models.QuestionType).filter(
-                        models.QuestionType.id == test_question.question.type_id
-                    ).first()
-            
             return test
     
     # Старая проверка доступа
@@ -268,16 +346,6 @@ def get_test(
     if not user_access and not test.is_public and test.author_id != current_user.id:
         raise HTTPException(status_code=403, detail="Нет доступа к этому тесту")
     
-    # Загружаем данные
-    for test_question in test.questions:
-        if test_question.question:
-            test_question.question.answer_type = db.query(models.AnswerType).filter(
-                models.AnswerType.id == test_question.question.answer_type_id
-            ).first()
-            test_question.question.type = db.query(models.QuestionType).filter(
-                models.QuestionType.id == test_question.question.type_id
-            ).first()
-    
     return test
 # Роуты загрузки файлов
 @app.post("/upload/image")
@@ -356,10 +424,10 @@ async def upload_audio(file: UploadFile = File(...)):
 def start_test_session(
     session_data: schemas.TestSessionCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     # Check if user has remaining attempts
-    test = crud.get_test(db, session_data.test_id)
+    test = crud.get_test_with_questions(db, session_data.test_id)
     if not test:
         raise HTTPException(status_code=404, detail="Тест не найден")
     
@@ -380,7 +448,8 @@ def start_test_session(
     session = crud.create_test_session(
         db=db, 
         session=session_data, 
-        user_id=current_user.id
+        user_id=current_user.id,
+        test=test
     )
     
     if not session:
@@ -394,7 +463,7 @@ def submit_answer(
     session_id: int,
     answer: schemas.UserAnswerCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     print("=" * 50)
     print("🎯 ПОЛУЧЕН ОТВЕТ ОТ ПОЛЬЗОВАТЕЛЯ")
@@ -403,8 +472,8 @@ def submit_answer(
     print(f"📦 Данные ответа: {answer.dict()}")
     print("=" * 50)
     
-    # Verify session belongs to user
-    session = db.query(models.TestSession).filter(
+    # Verify session belongs to user (тест - ради версии ключа ответов)
+    session = db.query(models.TestSession).options(joinedload(models.TestSession.test)).filter(
         models.TestSession.id == session_id,
         models.TestSession.user_id == current_user.id
     ).first()
@@ -424,7 +493,8 @@ def submit_answer(
         db=db, 
         answer=answer, 
         session_id=session_id,
-        test_id=answer.test_id  # Передаем test_id
+        test_id=answer.test_id,  # Передаем test_id
+        session=session
     )
     
     if not user_answer:
@@ -434,13 +504,55 @@ def submit_answer(
     print(f"✅ Ответ сохранен в БД, ID: {user_answer.id}")
     return user_answer
 
+@app.post("/test-sessions/{session_id}/answers/batch", response_model=schemas.UserAnswerBatchResponse)
+def submit_answers_batch(
+    session_id: int,
+    batch: schemas.UserAnswerBatchCreate,
+    db: Session = Depends(get_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
+):
+    """Сохранить сразу несколько ответов одной транзакцией"""
+    session = db.query(models.TestSession).options(joinedload(models.TestSession.test)).filter(
+        models.TestSession.id == session_id,
+        models.TestSession.user_id == current_user.id
+    ).first()
+    
+    if not session:
+        raise HTTPException(status_code=404, detail="Сессия тестирования не найдена")
+    
+    if session.is_completed:
+        raise HTTPException(status_code=400, detail="Тест уже завершен")
+    
+    try:
+        try:
+            results = crud.add_user_answers_batch(db, batch.answers, session)
+        except IntegrityError:
+            # Параллельный запрос вставил ответ на тот же вопрос: теперь это обновление
+            results = crud.add_user_answers_batch(db, batch.answers, session)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="Ответы этой сессии сохраняются параллельно, повторите запрос")
+    
+    failed_count = sum(1 for item in results if item["status"] == "error")
+    
+    return {
+        "session_id": session.id,
+        "saved_count": len(results) - failed_count,
+        "failed_count": failed_count,
+        "score": session.score,
+        "max_score": session.max_score,
+        "percentage": session.percentage,
+        "results": results
+    }
+
 # main.py - добавьте этот endpoint для завершения теста
 
 @app.post("/test-sessions/{session_id}/complete")
 def complete_test_session(
     session_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     """Завершить сессию тестирования"""
     print(f"🏁 Завершение сессии {session_id}")
@@ -493,11 +605,15 @@ def complete_test_session(
         time_spent = (session.finished_at - session.started_at).total_seconds()
         session.time_spent = int(time_spent)
     
+    # Сводка назначения обновляется сразу, в транзакции завершения сессии;
+    # статистика пользователя пересчитывается в фоне по событию из той же транзакции
+    group_stats.record_completed_session(db, session)
+    stats_pipeline.enqueue_session_completed(db, session)
+    
     db.commit()
     db.refresh(session)
     
-    # Обновляем статистику пользователя
-    update_user_statistics(db, current_user.id, session.test_id, session)
+    stats_pipeline.dispatch(db, session)
     
     print(f"✅ Сессия {session_id} завершена, баллы: {session.score}/{session.max_score} ({session.percentage}%)")
     
@@ -515,7 +631,7 @@ def complete_test_session(
 async def finish_test_session(
     session_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     """Завершить сессию тестирования - АЛЬТЕРНАТИВНЫЙ"""
     try:
@@ -543,8 +659,13 @@ async def finish_test_session(
         if session.max_score > 0:
             session.percentage = int((session.score / session.max_score) * 100)
         
+        group_stats.record_completed_session(db, session)
+        stats_pipeline.enqueue_session_completed(db, session)
+        
         db.commit()
         
+        stats_pipeline.dispatch(db, session)
+        
         return {
             "message": "Тест завершен",
             "score": session.score,
@@ -557,102 +678,11 @@ async def finish_test_session(
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
-def update_user_statistics(db: Session, user_id: int, test_id: int, session):
-    """Обновить статистику пользователя после завершения теста"""
-    try:
-        print(f"📈 Обновление статистики для пользователя {user_id}, тест {test_id}")
-        
-        # Находим все категории вопросов в тесте
-        test_questions = db.query(
-            models.TestQuestion.question_id,
-            models.TestQuestion.points
-        ).filter(models.TestQuestion.test_id == test_id).all()
-        
-        category_stats = {}
-        
-        for tq in test_questions:
-            question = db.query(models.Question).filter(
-                models.Question.id == tq.question_id
-            ).first()
-            
-            if question and question.category_id:
-                category_id = question.category_id
-                
-                if category_id not in category_stats:
-                    category_stats[category_id] = {
-                        'questions_count': 0,
-                        'questions_answered': 0,
-                        'correct_answers': 0,
-                        'total_points': 0
-                    }
-                
-                # Находим ответ пользователя на этот вопрос
-                answer = db.query(models.UserAnswer).filter(
-                    models.UserAnswer.question_id == question.id,
-                    models.UserAnswer.session_id == session.id
-                ).first()
-                
-                category_stats[category_id]['questions_count'] += 1
-                
-                if answer:
-                    category_stats[category_id]['questions_answered'] += 1
-                    
-                    if answer.is_correct:
-                        category_stats[category_id]['correct_answers'] += 1
-                        category_stats[category_id]['total_points'] += answer.points_earned
-        
-        # Обновляем статистику для каждой категории
-        for category_id, stats in category_stats.items():
-            user_stat = db.query(models.UserStatistics).filter(
-                models.UserStatistics.user_id == user_id,
-                models.UserStatistics.category_id == category_id
-            ).first()
-            
-            if not user_stat:
-                user_stat = models.UserStatistics(
-                    user_id=user_id,
-                    category_id=category_id,
-                    tests_completed=0,
-                    questions_answered=0,
-                    correct_answers=0,
-                    total_points=0,
-                    average_score=0,
-                    best_score=0,
-                    last_activity=datetime.utcnow()
-                )
-                db.add(user_stat)
-            
-            # Обновляем счетчики
-            user_stat.tests_completed += 1
-            user_stat.questions_answered += stats['questions_answered']
-            user_stat.correct_answers += stats['correct_answers']
-            user_stat.total_points += stats['total_points']
-            
-            # Пересчитываем средний балл
-            if user_stat.questions_answered > 0:
-                user_stat.average_score = (user_stat.correct_answers / user_stat.questions_answered) * 100
-            
-            # Обновляем лучший результат
-            if session.percentage > user_stat.best_score:
-                user_stat.best_score = session.percentage
-            
-            user_stat.last_activity = datetime.utcnow()
-            
-            print(f"📊 Статистика категории {category_id} обновлена: {user_stat.tests_completed} тестов")
-        
-        db.commit()
-        
-    except Exception as e:
-        print(f"❌ Ошибка обновления статистики: {e}")
-        import traceback
-        traceback.print_exc()
-        db.rollback()
-
 @app.get("/test-sessions/{session_id}", response_model=schemas.TestSessionResponse)
 def get_test_session(
     session_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     session = db.query(models.TestSession).filter(
         models.TestSession.id == session_id,
@@ -669,7 +699,7 @@ def get_test_session(
 def create_study_group(
     group: schemas.StudyGroupCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     """Создать группу (может любой пользователь)"""
     return crud.create_study_group(db=db, group=group, created_by=current_user.id)
@@ -678,8 +708,8 @@ def create_study_group(
 def get_study_groups(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    db: Session = Depends(get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     try:
         groups = db.query(models.StudyGroup).filter(
@@ -727,7 +757,7 @@ def join_group(
     group_id: int,
     password: Optional[str] = None,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     """Вступить в группу"""
     group = db.query(models.StudyGroup).filter(
@@ -788,6 +818,7 @@ def join_group(
         role=role
     )
     db.add(db_member)
+    group_stats.record_member_joined(db, group_id, current_user.id)
     db.commit()
     db.refresh(db_member)
     
@@ -801,8 +832,8 @@ def join_group(
 @app.get("/groups/find/{invite_code}")
 def find_group_by_code(
     invite_code: str,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    db: Session = Depends(get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     """Найти группу по коду (для скрытых групп)"""
     group = db.query(models.StudyGroup).filter(
@@ -818,8 +849,8 @@ def find_group_by_code(
 # Роуты статистики
 @app.get("/statistics/")
 def get_user_statistics(
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    db: Session = Depends(get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     statistics = db.query(models.UserStatistics).filter(
         models.UserStatistics.user_id == current_user.id
@@ -847,7 +878,7 @@ def grant_access_to_test(
     test_id: int,
     access_data: schemas.TestAccessCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     # Проверяем, что тест существует
     test = crud.get_test(db, test_id=test_id)
@@ -878,8 +909,8 @@ def grant_access_to_test(
 @app.get("/tests/{test_id}/access", response_model=List[schemas.TestAccessResponse])
 def get_test_access_list(
     test_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    db: Session = Depends(get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     # Проверяем права доступа
     user_access = crud.get_user_test_access(db, test_id, current_user.id)
@@ -897,7 +928,7 @@ def revoke_test_access(
     test_id: int,
     user_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     # Проверяем права доступа
     user_access = crud.get_user_test_access(db, test_id, current_user.id)
@@ -924,8 +955,8 @@ def revoke_test_access(
 @app.get("/groups/{group_id}", response_model=schemas.StudyGroupResponse)
 def get_group_details(
     group_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    db: Session = Depends(get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     """Получить детальную информацию о группе"""
     group = db.query(models.StudyGroup).filter(
@@ -946,8 +977,8 @@ def get_group_members(
     group_id: int,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    db: Session = Depends(get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     """Получить участников группы"""
     # Проверяем, что пользователь состоит в группе
@@ -1001,8 +1032,8 @@ def get_group_members(
 def get_my_groups(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    db: Session = Depends(get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     """Получить группы текущего пользователя"""
     # 1. Находим группы где пользователь участник
@@ -1033,8 +1064,8 @@ def get_my_groups(
 @app.get("/groups/{group_id}/tests")
 def get_group_tests(
     group_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    db: Session = Depends(get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     """Получить тесты, назначенные группе"""
     # Проверяем, что пользователь состоит в группе
@@ -1109,7 +1140,7 @@ def get_group_tests(
 def create_test_assignment(
     assignment: TestAssignmentRequest,  # Используем нашу схему
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     """Назначить тест группе"""
     try:
@@ -1204,8 +1235,8 @@ def create_test_assignment(
 @app.get("/tests/{test_id}/assignments")
 def get_test_assignments_by_test(
     test_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    db: Session = Depends(get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     """Получить назначения теста (только для создателя/админа)"""
     # Проверяем права
@@ -1247,7 +1278,7 @@ def get_test_assignments_by_test(
 def delete_test_assignment(
     assignment_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     """Удалить назначение теста"""
     assignment = db.query(models.TestAssignment).filter(
@@ -1282,8 +1313,8 @@ def delete_test_assignment(
 def get_all_test_assignments(
     group_id: Optional[int] = None,
     test_id: Optional[int] = None,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    db: Session = Depends(get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     """Получить все назначения тестов"""
     query = db.query(models.TestAssignment).filter(
@@ -1317,11 +1348,18 @@ def get_all_test_assignments(
 @app.get("/tests/{test_id}/full")
 def get_test_full(
     test_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    request: Request,
+    db: Session = Depends(get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
-    """Получить полную информацию о тесте с вопросами"""
-    test = crud.get_test(db, test_id=test_id)
+    """Получить полную информацию о тесте с вопросами.
+
+    Ключи ответов (correct_answer, explanation, is_correct) видят только
+    автор и администратор, остальным они не отдаются. Сериализованный ответ
+    кэшируется по версии теста, клиент может прислать If-None-Match и
+    получить 304 без тела.
+    """
+    test = db.query(models.Test).filter(models.Test.id == test_id).first()
     if test is None:
         raise HTTPException(status_code=404, detail="Тест не найден")
     
@@ -1330,89 +1368,176 @@ def get_test_full(
     if not user_access and not test.is_public and test.author_id != current_user.id:
         raise HTTPException(status_code=403, detail="Нет доступа к этому тесту")
     
-    # Принудительно загружаем все связанные данные
-    test_data = {
-        "id": test.id,
-        "title": test.title,
-        "description": test.description,
-        "author_id": test.author_id,
-        "time_limit": test.time_limit,
-        "max_attempts": test.max_attempts,
-        "show_results": test.show_results,
-        "shuffle_questions": test.shuffle_questions,
-        "shuffle_answers": test.shuffle_answers,
-        "passing_score": test.passing_score,
-        "is_public": test.is_public,
-        "is_active": test.is_active,
-        "created_at": test.created_at,
-        "updated_at": test.updated_at,
-        "questions": []
-    }
+    can_view_answers = test.author_id == current_user.id or current_user.role_id == 3
+    kind = "full" if can_view_answers else "full_hidden"
     
-    # Загружаем вопросы с полной информацией
-    for tq in test.questions:
-        question = tq.question
-        if question:
-            # Безопасно получаем данные о типе вопроса
-            type_data = None
-            if question.type:
-                type_data = {
-                    "id": question.type.id,
-                    "name": question.type.name,
-                    "description": question.type.description
-                }
-            
-            # Безопасно получаем данные о типе ответа
-            answer_type_data = None
-            if question.answer_type:
-                answer_type_data = {
-                    "id": question.answer_type.id,
-                    "name": question.answer_type.name,
-                    "description": question.answer_type.description
-                }
-            
-            question_data = {
-                "id": question.id,
-                "question_text": question.question_text,
-                "type": type_data,
-                "answer_type": answer_type_data,
-                "answer_type_id": question.answer_type_id,  # Важно!
-                "category_id": question.category_id,
-                "difficulty": question.difficulty,
-                "explanation": question.explanation or "",
-                "time_limit": question.time_limit or 60,
-                "points": tq.points or question.points or 1,
-                "media_url": question.media_url or "",
-                "sources": question.sources or "",
-                "allow_latex": question.allow_latex or False,
-                "blackbox_description": question.blackbox_description or "",
-                "correct_answer": question.correct_answer or "",
-                "answer_requirements": question.answer_requirements or "",
-                "answer_options": [],
-                "test_question_id": tq.id
-            }
-            
-            # Загружаем варианты ответов
-            if question.answer_options:
-                for option in question.answer_options:
-                    option_data = {
-                        "id": option.id,
-                        "option_text": option.option_text,
-                        "is_correct": option.is_correct,
-                        "sort_order": option.sort_order
-                    }
-                    question_data["answer_options"].append(option_data)
-            
-            test_data["questions"].append(question_data)
+    version = test_payloads.get_test_version(db, test_id)
+    etag = test_payloads.make_etag(kind, version)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    
+    if test_payloads.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    def build():
+        payload = test_payloads.build_full_payload(crud.get_test_with_questions(db, test_id=test_id))
+        if not can_view_answers:
+            payload = test_payloads.hide_answer_keys(payload)
+        return test_payloads.serialize(payload)
     
-    return test_data
+    body = test_payloads.get_or_build(kind, test_id, version, build)
+    
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/tests/{test_id}/student")
+def get_test_for_student(
+    test_id: int,
+    request: Request,
+    session_id: Optional[int] = None,
+    shuffle: bool = True,
+    db: Session = Depends(get_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
+):
+    """Получить тест для прохождения: без правильных ответов и пояснений.
+
+    Если у теста включены shuffle_questions / shuffle_answers, порядок
+    перемешивается на сервере (отключается параметром shuffle=false).
+    С session_id порядок детерминирован для сессии и одинаков при перезагрузке.
+    """
+    test = db.query(models.Test).filter(models.Test.id == test_id).first()
+    if test is None:
+        raise HTTPException(status_code=404, detail="Тест не найден")
+    
+    user_access = crud.get_user_test_access(db, test_id, current_user.id)
+    if not user_access and not test.is_public and test.author_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Нет доступа к этому тесту")
+    
+    if session_id is not None:
+        session = db.query(models.TestSession.id).filter(
+            models.TestSession.id == session_id,
+            models.TestSession.test_id == test_id,
+            models.TestSession.user_id == current_user.id
+        ).first()
+        if not session:
+            raise HTTPException(status_code=404, detail="Сессия тестирования не найдена")
+    
+    version = test_payloads.get_test_version(db, test_id)
+    compiled = test_payloads.get_or_build(
+        "student",
+        test_id,
+        version,
+        lambda: test_payloads.compile_student_payload(crud.get_test_with_questions(db, test_id=test_id))
+    )
+    
+    is_shuffled = shuffle and (compiled["shuffle_questions"] or compiled["shuffle_answers"])
+    if is_shuffled and session_id is None:
+        body = test_payloads.render_student_payload(compiled, random.Random())
+        return Response(content=body, media_type="application/json", headers={"Cache-Control": "no-store"})
+    
+    etag_kind = f"student:{session_id}" if is_shuffled else "student"
+    etag = test_payloads.make_etag(etag_kind, version)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if test_payloads.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    rng = test_payloads.session_rng(session_id) if is_shuffled else None
+    body = test_payloads.render_student_payload(compiled, rng)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/test-sessions/{session_id}/order")
+def get_test_session_order(
+    session_id: int,
+    db: Session = Depends(get_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
+):
+    """Порядок вопросов и вариантов, выданный в сессии (для проверки и разбора)"""
+    session = db.query(models.TestSession).filter(
+        models.TestSession.id == session_id
+    ).first()
+    
+    if not session:
+        raise HTTPException(status_code=404, detail="Сессия тестирования не найдена")
+    
+    if session.user_id != current_user.id and current_user.role_id != 3:
+        test = db.query(models.Test.author_id).filter(models.Test.id == session.test_id).first()
+        if not test or test.author_id != current_user.id:
+            raise HTTPException(status_code=403, detail="Нет доступа к этой сессии")
+    
+    version = test_payloads.get_test_version(db, session.test_id)
+    compiled = test_payloads.get_or_build(
+        "student",
+        session.test_id,
+        version,
+        lambda: test_payloads.compile_student_payload(crud.get_test_with_questions(db, test_id=session.test_id))
+    )
+    
+    return {
+        "session_id": session.id,
+        "test_id": session.test_id,
+        "questions": test_payloads.session_order(compiled, session.id)
+    }
+
+@app.get("/test-sessions/{session_id}/review")
+def get_test_session_review(
+    session_id: int,
+    db: Session = Depends(get_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
+):
+    """Тест с ключами ответов, которые тестируемому уже можно показать.
+
+    Зависит от show_results теста: immediately - по отвеченным вопросам,
+    after_completion - после завершения, after_deadline - после завершения
+    и окончания назначения, never - ничего. Остальные ключи вырезаются.
+    """
+    session = db.query(models.TestSession).filter(
+        models.TestSession.id == session_id,
+        models.TestSession.user_id == current_user.id
+    ).first()
+
+    if not session:
+        raise HTTPException(status_code=404, detail="Сессия тестирования не найдена")
+
+    test = db.query(models.Test).filter(models.Test.id == session.test_id).first()
+    show_results = test.show_results or 'after_completion'
+
+    if show_results == 'never':
+        raise HTTPException(status_code=403, detail="Результаты этого теста не показываются")
+
+    version = test_payloads.get_test_version(db, session.test_id)
+    body = test_payloads.get_or_build(
+        "full",
+        session.test_id,
+        version,
+        lambda: test_payloads.serialize(
+            test_payloads.build_full_payload(crud.get_test_with_questions(db, test_id=session.test_id))
+        )
+    )
+    payload = json.loads(body)
+
+    revealed = set()
+    if session.is_completed:
+        deadline_pending = show_results == 'after_deadline' and session.assignment_id and db.query(
+            models.TestAssignment.id
+        ).filter(
+            models.TestAssignment.id == session.assignment_id,
+            models.TestAssignment.end_date > func.now()
+        ).first() is not None
+        if not deadline_pending:
+            revealed = {question["id"] for question in payload["questions"]}
+    elif show_results == 'immediately':
+        revealed = {
+            row.question_id for row in db.query(models.UserAnswer.question_id).filter(
+                models.UserAnswer.session_id == session_id
+            )
+        }
+
+    return test_payloads.hide_answer_keys(payload, revealed)
 
 @app.put("/questions/{question_id}")
 def update_question(
     question_id: int,
     question_data: schemas.QuestionCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     """Обновить вопрос"""
     # Получаем вопрос
@@ -1443,6 +1568,12 @@ def update_question(
     db_question.blackbox_description = question_data.blackbox_description
     db_question.correct_answer = question_data.correct_answer
     db_question.answer_requirements = question_data.answer_requirements
+    db_question.fingerprint = question_import.question_fingerprint(
+        question_data.question_text,
+        question_data.answer_type_id,
+        [(option.option_text, option.is_correct) for option in question_data.answer_options or []],
+        question_data.correct_answer
+    )
     db_question.updated_at = datetime.utcnow()
     
     # Удаляем старые варианты ответов
@@ -1461,9 +1592,16 @@ def update_question(
             )
             db.add(db_option)
     
+    answer_keys.mark_question_changed(db, question_id)
     db.commit()
     db.refresh(db_question)
     
+    answer_keys.invalidate_question(question_id)
+    for (test_id,) in db.query(models.TestQuestion.test_id).filter(
+        models.TestQuestion.question_id == question_id
+    ).distinct().all():
+        test_payloads.invalidate_test(test_id)
+    
     return db_question
 
 @app.put("/tests/{test_id}")
@@ -1471,7 +1609,7 @@ def update_test(
     test_id: int,
     test: schemas.TestCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     """Обновить тест"""
     # Получаем тест
@@ -1504,8 +1642,12 @@ def update_test(
         models.TestQuestion.test_id == test_id
     ).delete()
     
-    # Добавляем новые вопросы
+    # Добавляем новые вопросы (повтор в списке - одна связь)
+    added = set()
     for test_question in test.questions:
+        if test_question.question_id in added:
+            continue
+        added.add(test_question.question_id)
         db_test_question = models.TestQuestion(
             test_id=test_id,
             question_id=test_question.question_id,
@@ -1517,470 +1659,122 @@ def update_test(
     db.commit()
     db.refresh(db_test)
     
+    answer_keys.invalidate_test(test_id)
+    test_payloads.invalidate_test(test_id)
+    
     return db_test
 
 from .utils.file_importer import QuestionFileImporter
+from .utils import file_importer
 from typing import List
 import json
 
 @app.post("/questions/import-file")
-async def import_questions_from_file(
+def import_questions_from_file(
     file: UploadFile = File(...),
     category_id: int = None,
+    all_sheets: bool = False,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     """
     Импорт вопросов из файла с сохранением в базу
     """
     try:
-        # Используем ту же логику чтения файла
-        file_extension = file.filename.lower()
-        
-        if file_extension.endswith(('.xlsx', '.xls')):
-            contents = await file.read()
-            df = pd.read_excel(io.BytesIO(contents))
-        elif file_extension.endswith('.csv'):
-            contents = await file.read()
-            for encoding in ['utf-8', 'cp1251', 'windows-1251', 'latin1']:
-                try:
-                    df = pd.read_csv(io.BytesIO(contents), encoding=encoding, sep=None, engine='python')
-                    break
-                except:
-                    continue
-            else:
-                raise HTTPException(status_code=400, detail="Не удалось прочитать файл CSV")
-        else:
-            raise HTTPException(status_code=400, detail="Неподдерживаемый формат файла")
-        
-        # Нормализуем колонки
-        df.columns = df.columns.astype(str).str.strip().str.lower()
-        
-        column_mapping = {
-            'вопрос': 'question',
-            'тип вопроса': 'type',
-            'тип': 'type',
-            'варианты': 'options',
-            'правильный ответ': 'correct_answer',
-            'правильные варианты': 'correct_options',
-            'категория': 'category',
-            'сложность': 'difficulty',
-            'баллы': 'points',
-            'объяснение': 'explanation',
-        }
-        
-        df = df.rename(columns=lambda x: column_mapping.get(x, x))
-        
-        imported_count = 0
-        errors = []
-        imported_questions = []
-        
-        for idx, row in df.iterrows():
-            try:
-                question_text = str(row.get('question', '')).strip()
-                if not question_text:
-                    errors.append(f"Строка {idx + 2}: Пустой текст вопроса")
-                    continue
-                
-                question_type = str(row.get('type', 'text')).strip().lower()
-                
-                # Преобразуем тип вопроса в type_id и answer_type_id
-                type_map = {
-                    'text': (1, 1),
-                    'single_choice': (1, 2),
-                    'multiple_choice': (1, 3),
-                    'blackbox': (2, 1)
-                }
-                
-                if question_type not in type_map:
-                    errors.append(f"Строка {idx + 2}: Неподдерживаемый тип вопроса '{question_type}'")
-                    continue
-                
-                type_id, answer_type_id = type_map[question_type]
-                
-                # Парсим варианты ответов
-                answer_options = []
-                if pd.notna(row.get('options')):
-                    options_str = str(row.get('options'))
-                    if ';' in options_str:
-                        options = [opt.strip() for opt in options_str.split(';') if opt.strip()]
-                    elif ',' in options_str:
-                        options = [opt.strip() for opt in options_str.split(',') if opt.strip()]
-                    else:
-                        options = [options_str.strip()]
-                    
-                    # Для single_choice/multiple_choice определяем правильные варианты
-                    correct_options = []
-                    if pd.notna(row.get('correct_options')):
-                        correct_opts_str = str(row.get('correct_options'))
-                        if ';' in correct_opts_str:
-                            correct_options = [opt.strip() for opt in correct_opts_str.split(';') if opt.strip()]
-                        elif ',' in correct_opts_str:
-                            correct_options = [opt.strip() for opt in correct_opts_str.split(',') if opt.strip()]
-                        else:
-                            correct_options = [correct_opts_str.strip()]
-                    
-                    # Если есть correct_answer, добавляем его как правильный вариант
-                    correct_answer = str(row.get('correct_answer', '')).strip() if pd.notna(row.get('correct_answer')) else ''
-                    
-                    for i, option in enumerate(options):
-                        is_correct = False
-                        if correct_answer and option == correct_answer:
-                            is_correct = True
-                        elif correct_options and option in correct_options:
-                            is_correct = True
-                        
-                        answer_options.append({
-                            'option_text': option,
-                            'is_correct': is_correct,
-                            'sort_order': i
-                        })
-                
-                # Создаем вопрос в базе данных
-                question_data = {
-                    'question_text': question_text,
-                    'type_id': type_id,
-                    'answer_type_id': answer_type_id,
-                    'category_id': category_id or 1,
-                    'difficulty': int(row.get('difficulty', 1)),
-                    'explanation': str(row.get('explanation', '')).strip() if pd.notna(row.get('explanation')) else '',
-                    'time_limit': 60,
-                    'points': int(row.get('points', 1)),
-                    'correct_answer': str(row.get('correct_answer', '')).strip() if pd.notna(row.get('correct_answer')) else '',
-                    'sources': 'Импортировано из файла',
-                    'allow_latex': False,
-                    'blackbox_description': str(row.get('blackbox_description', '')).strip() if pd.notna(row.get('blackbox_description')) else '',
-                    'answer_requirements': '',
-                    'is_active': True
-                }
-                
-                # Создаем вопрос через CRUD
-                question_schema = schemas.QuestionCreate(**question_data)
-                created_question = crud.create_question(
-                    db=db,
-                    question=question_schema,
-                    author_id=current_user.id
-                )
-                
-                if created_question:
-                    imported_count += 1
-                    imported_questions.append({
-                        'question_text': question_text,
-                        'question_type': question_type,
-                        'difficulty': int(row.get('difficulty', 1)),
-                        'points': int(row.get('points', 1))
-                    })
-                
-            except Exception as e:
-                errors.append(f"Строка {idx + 2}: {str(e)}")
+        stats = question_import.ImportStats()
+        writer = question_import.BulkQuestionWriter(db, author_id=current_user.id)
+        
+        # Файл читается потоково, порциями - без загрузки целиком в память,
+        # а вопросы пишутся пачками по IMPORT_BATCH_SIZE строк
+        question_import.import_records(
+            db,
+            file_importer.iter_question_records(file.filename, file.file, all_sheets=all_sheets),
+            writer,
+            stats,
+            category_id=category_id or 1
+        )
+        errors = stats.errors + writer.errors
         
         return {
-            "imported_count": imported_count,
-            "failed_count": len(df) - imported_count,
-            "questions": imported_questions,
+            "imported_count": writer.imported_count,
+            "new_count": writer.new_count,
+            "reused_count": writer.reused_count,
+            "failed_count": stats.total_rows - writer.imported_count,
+            "questions": [{**item['summary'], 'reused': item['reused']} for item in writer.imported],
             "errors": errors
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
+        db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка импорта: {str(e)}")
 
 @app.post("/questions/import-preview")
-async def preview_imported_questions(
+def preview_imported_questions(
     file: UploadFile = File(...),
+    all_sheets: bool = False,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     """
     Предпросмотр вопросов из файла без сохранения в базу
     Поддерживает Excel и CSV
     """
     try:
-        file_extension = file.filename.lower()
-        
-        if file_extension.endswith(('.xlsx', '.xls')):
-            contents = await file.read()
-            df = pd.read_excel(io.BytesIO(contents))
-            
-        elif file_extension.endswith('.csv'):
-            contents = await file.read()
-            for encoding in ['utf-8', 'cp1251', 'windows-1251', 'latin1']:
-                try:
-                    df = pd.read_csv(io.BytesIO(contents), encoding=encoding, sep=None, engine='python')
-                    break
-                except:
-                    continue
-            else:
-                raise HTTPException(status_code=400, detail="Не удалось прочитать файл CSV")
-        else:
-            raise HTTPException(status_code=400, detail="Неподдерживаемый формат файла")
-        
-        # Нормализуем названия колонок
-        df.columns = df.columns.astype(str).str.strip().str.lower()
-        
-        # Расширенный маппинг русских названий колонок
-        column_mapping = {
-            # Вопрос
-            'вопрос': 'question',
-            'текст вопроса': 'question',
-            'question': 'question',
-            
-            # Тип вопроса
-            'тип вопроса': 'question_type',
-            'question_type': 'question_type',
-            'тип вопроса type': 'question_type',
-            'qtype': 'question_type',
-            'тип вопроса question_type': 'question_type',
-            
-            # Тип ответа (ВАЖНО! Этого не было)
-            'тип ответа': 'answer_type',
-            'answer_type': 'answer_type',
-            'тип ответа answer_type': 'answer_type',
-            'тип ответа type': 'answer_type',
-            
-            # Варианты
-            'варианты': 'options',
-            'варианты ответов': 'options',
-            'options': 'options',
-            'choices': 'options',
-            
-            # Правильные ответы
-            'правильный ответ': 'correct_answer',
-            'correct_answer': 'correct_answer',
-            'answer': 'correct_answer',
-            
-            # Правильные варианты
-            'правильные варианты': 'correct_options',
-            'correct_options': 'correct_options',
-            'правильные варианты ответов': 'correct_options',
-            'correct choices': 'correct_options',
-            
-            # Категория
-            'категория': 'category',
-            'category': 'category',
-            'тема': 'category',
-            'topic': 'category',
-            
-            # Сложность и баллы
-            'сложность': 'difficulty',
-            'difficulty': 'difficulty',
-            'баллы': 'points',
-            'points': 'points',
-            'score': 'points',
-            
-            # Объяснение
-            'объяснение': 'explanation',
-            'explanation': 'explanation',
-            'пояснение': 'explanation',
-            'comment': 'explanation',
-            
-            # Дополнительные поля
-            'описание черного ящика': 'blackbox_description',
-            'blackbox_description': 'blackbox_description',
-            'описание': 'blackbox_description',
-            'description': 'blackbox_description',
-            
-            'media_url': 'media_url',
-            'ссылка': 'media_url',
-            'url': 'media_url',
-            'url медиа': 'media_url'
-        }
-        
-        df = df.rename(columns=lambda x: column_mapping.get(x, x))
-        
-        # Определяем типы вопросов и ответов если их нет
-        def determine_answer_type(row):
-            """Определяем тип ответа по данным строки"""
-            if 'answer_type' in row and pd.notna(row['answer_type']):
-                answer_type = str(row['answer_type']).strip().lower()
-                if answer_type in ['text', 'single_choice', 'multiple_choice']:
-                    return answer_type
-            
-            # Определяем по наличию полей
-            options = []
-            if 'options' in row and pd.notna(row['options']):
-                options_str = str(row['options'])
-                if ';' in options_str:
-                    options = [opt.strip() for opt in options_str.split(';') if opt.strip()]
-                elif ',' in options_str:
-                    options = [opt.strip() for opt in options_str.split(',') if opt.strip()]
-                else:
-                    options = [options_str.strip()]
-            
-            correct_options = []
-            if 'correct_options' in row and pd.notna(row['correct_options']):
-                correct_opts_str = str(row['correct_options'])
-                if ';' in correct_opts_str:
-                    correct_options = [opt.strip() for opt in correct_opts_str.split(';') if opt.strip()]
-                elif ',' in correct_opts_str:
-                    correct_options = [opt.strip() for opt in correct_opts_str.split(',') if opt.strip()]
-                else:
-                    correct_options = [correct_opts_str.strip()]
-            
-            # Если есть correct_options и их больше 1 - это multiple_choice
-            if len(correct_options) > 1:
-                return 'multiple_choice'
-            # Если есть options - это single_choice
-            elif len(options) > 0:
-                return 'single_choice'
-            # Иначе - text
-            else:
-                return 'text'
-        
-        def determine_question_type(row):
-            """Определяем тип вопроса по данным строки"""
-            if 'question_type' in row and pd.notna(row['question_type']):
-                q_type = str(row['question_type']).strip().lower()
-                if q_type in ['text', 'blackbox', 'image', 'video', 'audio', 'code']:
-                    return q_type
-            return 'text'
-        
-        # Валидируем вопросы
         preview_data = []
         validation_errors = []
+        question_types = {}
+        answer_types = {}
+        total_questions = 0
+        valid_count = 0
         
-        for idx, row in df.iterrows():
+        # Читаем файл потоково; в ответ попадают только первые 50 вопросов,
+        # а статистика считается по всему файлу
+        for record in file_importer.iter_question_records(file.filename, file.file, all_sheets=all_sheets):
+            total_questions += 1
             try:
-                row_num = idx + 2
-                
-                # Определяем типы
-                question_type = determine_question_type(row)
-                answer_type = determine_answer_type(row)
-                
-                # Парсим options
-                options = []
-                if 'options' in row and pd.notna(row['options']):
-                    options_str = str(row['options'])
-                    if ';' in options_str:
-                        options = [opt.strip() for opt in options_str.split(';') if opt.strip()]
-                    elif ',' in options_str:
-                        options = [opt.strip() for opt in options_str.split(',') if opt.strip()]
-                    else:
-                        options = [options_str.strip()]
-                
-                # Парсим correct_options
-                correct_options = []
-                if 'correct_options' in row and pd.notna(row['correct_options']):
-                    correct_opts_str = str(row['correct_options'])
-                    if ';' in correct_opts_str:
-                        correct_options = [opt.strip() for opt in correct_opts_str.split(';') if opt.strip()]
-                    elif ',' in correct_opts_str:
-                        correct_options = [opt.strip() for opt in correct_opts_str.split(',') if opt.strip()]
-                    else:
-                        correct_options = [correct_opts_str.strip()]
-                
-                question_data = {
-                    'row_number': row_num,
-                    'question_text': str(row.get('question', '')).strip(),
-                    'question_type': question_type,
-                    'answer_type': answer_type,  # ← ЭТО ОЧЕНЬ ВАЖНО!
-                    'options': options,
-                    'correct_answer': str(row.get('correct_answer', '')).strip() if pd.notna(row.get('correct_answer')) else '',
-                    'correct_options': correct_options,
-                    'category': str(row.get('category', 'Общие знания')).strip(),
-                    'difficulty': int(float(row.get('difficulty', 1))),
-                    'points': int(float(row.get('points', 1))),
-                    'explanation': str(row.get('explanation', '')).strip() if pd.notna(row.get('explanation')) else '',
-                    'blackbox_description': str(row.get('blackbox_description', '')).strip() if pd.notna(row.get('blackbox_description')) else '',
-                    'media_url': str(row.get('media_url', '')).strip() if pd.notna(row.get('media_url')) else '',
-                    'is_valid': True,
-                    'errors': []
-                }
-                
-                # ВАЛИДАЦИЯ
-                # 1. Проверка текста вопроса
-                if not question_data['question_text']:
-                    question_data['errors'].append("Текст вопроса обязателен")
-                    question_data['is_valid'] = False
-                
-                # 2. Проверка типов вопроса
-                valid_question_types = ['text', 'blackbox', 'image', 'video', 'audio', 'code']
-                if question_data['question_type'] not in valid_question_types:
-                    question_data['errors'].append(f"Неподдерживаемый тип вопроса: {question_data['question_type']}")
-                    question_data['is_valid'] = False
-                
-                # 3. Проверка типов ответа
-                valid_answer_types = ['text', 'single_choice', 'multiple_choice']
-                if question_data['answer_type'] not in valid_answer_types:
-                    question_data['errors'].append(f"Неподдерживаемый тип ответа: {question_data['answer_type']}")
-                    question_data['is_valid'] = False
-                
-                # 4. Проверка для вопросов с выбором
-                if question_data['answer_type'] in ['single_choice', 'multiple_choice']:
-                    if not question_data['options']:
-                        question_data['errors'].append(f"Для типа ответа '{question_data['answer_type']}' нужны варианты ответов")
-                        question_data['is_valid'] = False
-                    
-                    if question_data['answer_type'] == 'single_choice' and not question_data['correct_answer']:
-                        question_data['errors'].append("Для single_choice нужен правильный ответ (correct_answer)")
-                        question_data['is_valid'] = False
-                    
-                    if question_data['answer_type'] == 'multiple_choice' and not question_data['correct_options']:
-                        question_data['errors'].append("Для multiple_choice нужны правильные варианты (correct_options)")
-                        question_data['is_valid'] = False
-                
-                # 5. Проверка для текстовых вопросов
-                elif question_data['answer_type'] == 'text' and question_data['question_type'] not in ['image', 'video', 'audio']:
-                    if not question_data['correct_answer']:
-                        question_data['errors'].append("Для текстового вопроса нужен правильный ответ")
-                        question_data['is_valid'] = False
-                
-                # 6. Проверка сложности
-                if question_data['difficulty'] < 1 or question_data['difficulty'] > 5:
-                    question_data['errors'].append("Сложность должна быть от 1 до 5")
-                    question_data['is_valid'] = False
+                errors = file_importer.validate_record(record)
                 
-                # 7. Проверка баллов
-                if question_data['points'] <= 0:
-                    question_data['errors'].append("Баллы должны быть положительными")
-                    question_data['is_valid'] = False
+                q_type = record['question_type']
+                a_type = record['answer_type']
+                question_types[q_type] = question_types.get(q_type, 0) + 1
+                answer_types[a_type] = answer_types.get(a_type, 0) + 1
+                if not errors:
+                    valid_count += 1
                 
-                # 8. Проверка для blackbox
-                if question_data['question_type'] == 'blackbox' and not question_data['blackbox_description']:
-                    question_data['errors'].append("Для blackbox нужно описание черного ящика")
-                    question_data['is_valid'] = False
-                
-                # 9. Проверка для media типов
-                if question_data['question_type'] in ['image', 'video', 'audio'] and not question_data['media_url']:
-                    question_data['errors'].append(f"Для типа вопроса '{question_data['question_type']}' нужен URL медиафайла")
-                    question_data['is_valid'] = False
-                
-                preview_data.append(question_data)
+                if len(preview_data) < 50:
+                    question_data = {key: value for key, value in record.items() if key != 'errors'}
+                    question_data['category'] = record['category'] or file_importer.DEFAULT_CATEGORY
+                    question_data['is_valid'] = not errors
+                    question_data['errors'] = errors
+                    preview_data.append(question_data)
                 
             except Exception as e:
-                validation_errors.append(f"Строка {idx + 2}: Ошибка обработки - {str(e)}")
-        
-        # Статистика
-        question_types = {}
-        answer_types = {}
-        valid_count = 0
-        
-        for q in preview_data:
-            q_type = q['question_type']
-            a_type = q['answer_type']
-            question_types[q_type] = question_types.get(q_type, 0) + 1
-            answer_types[a_type] = answer_types.get(a_type, 0) + 1
-            if q['is_valid']:
-                valid_count += 1
+                validation_errors.append(f"{file_importer.row_label(record)}: Ошибка обработки - {str(e)}")
         
         return {
-            "total_questions": len(df),
+            "total_questions": total_questions,
             "valid_questions": valid_count,
             "preview_count": len(preview_data),
             "question_types": question_types,
-            "answer_types": answer_types,  # ← Добавляем статистику по типам ответов
-            "preview": preview_data[:50],  # Ограничиваем предпросмотр
+            "answer_types": answer_types,
+            "preview": preview_data,
             "validation_errors": validation_errors[:10]
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Ошибка обработки файла: {str(e)}")
-# main.py - добавьте этот endpoint
+
 @app.post("/tests/{test_id}/import-questions")
-async def import_questions_to_test(
+def import_questions_to_test(
     test_id: int,
     file: UploadFile = File(...),
+    all_sheets: bool = False,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     """
     Импорт вопросов из файла и добавление их в тест
@@ -1999,358 +1793,117 @@ async def import_questions_to_test(
         if test.author_id != current_user.id and current_user.role_id != 3:
             raise HTTPException(status_code=403, detail="Нет прав для редактирования этого теста")
         
-        # Читаем файл
-        file_extension = file.filename.lower()
-        
-        if file_extension.endswith(('.xlsx', '.xls')):
-            contents = await file.read()
-            df = pd.read_excel(io.BytesIO(contents), dtype=str)  # Читаем как текст
-            df = df.fillna('')  # Заменяем NaN на пустые строки
-        elif file_extension.endswith('.csv'):
-            contents = await file.read()
-            # Пробуем разные разделители и кодировки
-            for sep in [';', ',', '\t']:
-                for encoding in ['utf-8', 'cp1251', 'windows-1251']:
-                    try:
-                        df = pd.read_csv(
-                            io.BytesIO(contents), 
-                            sep=sep, 
-                            encoding=encoding, 
-                            engine='python',
-                            dtype=str  # Читаем как текст
-                        )
-                        df = df.fillna('')  # Заменяем NaN на пустые строки
-                        break
-                    except:
-                        continue
-                else:
-                    continue
-                break
-            else:
-                raise HTTPException(status_code=400, detail="Не удалось прочитать CSV файл")
-        else:
-            raise HTTPException(status_code=400, detail="Неподдерживаемый формат файла")
-        
-        # Нормализуем названия колонок
-        df.columns = df.columns.astype(str).str.strip().str.lower()
-        
-        print("📊 Колонки в импорт-тест файле:", list(df.columns))
-        
-        # Расширенный маппинг - ВАЖНО: добавляем question_type и answer_type
-        column_mapping = {
-            'вопрос': 'question',
-            'question': 'question',
-            'текст': 'question',
-            
-            # Тип вопроса
-            'тип вопроса': 'question_type',
-            'question_type': 'question_type',
-            'тип_вопроса': 'question_type',
-            'qtype': 'question_type',
-            
-            # Тип ответа
-            'тип ответа': 'answer_type',
-            'answer_type': 'answer_type',
-            'тип_ответа': 'answer_type',
-            
-            # Общее поле type (может быть как question_type, так и answer_type)
-            'тип': 'type',
-            'type': 'type',
-            
-            'варианты': 'options',
-            'options': 'options',
-            'варианты ответов': 'options',
-            'choices': 'options',
-            
-            'правильный ответ': 'correct_answer',
-            'correct_answer': 'correct_answer',
-            'ответ': 'correct_answer',
-            
-            'правильные варианты': 'correct_options',
-            'correct_options': 'correct_options',
-            'correct choices': 'correct_options',
-            
-            'категория': 'category',
-            'category': 'category',
-            'тема': 'category',
-            
-            'сложность': 'difficulty',
-            'difficulty': 'difficulty',
-            
-            'баллы': 'points',
-            'points': 'points',
-            'score': 'points',
-            
-            'объяснение': 'explanation',
-            'explanation': 'explanation',
-            'комментарий': 'explanation',
-            
-            'описание черного ящика': 'blackbox_description',
-            'blackbox_description': 'blackbox_description',
-            'описание': 'blackbox_description',
-        }
-        
-        df = df.rename(columns=lambda x: column_mapping.get(x, x))
-        
-        print("📊 Колонки после переименования:", list(df.columns))
-        
-        # Функция для определения типов
-        def determine_question_type(row):
-            """Определяем тип вопроса"""
-            # Если есть явное поле question_type
-            if 'question_type' in row and row['question_type'] and str(row['question_type']).strip():
-                q_type = str(row['question_type']).strip().lower()
-                if q_type in ['text', 'blackbox']:
-                    return q_type
-            
-            # Если есть общее поле type и оно похоже на тип вопроса
-            if 'type' in row and row['type'] and str(row['type']).strip():
-                type_val = str(row['type']).strip().lower()
-                if type_val in ['text', 'blackbox']:
-                    return type_val
-                # Если это не тип вопроса, проверяем, не тип ли это ответа
-                elif type_val in ['single_choice', 'multiple_choice']:
-                    # Это тип ответа, значит вопрос текстовый
-                    return 'text'
-            
-            # Определяем по наличию blackbox_description
-            if 'blackbox_description' in row and row['blackbox_description'] and str(row['blackbox_description']).strip():
-                return 'blackbox'
-            
-            return 'text'
+        stats = question_import.ImportStats()
+        writer = question_import.BulkQuestionWriter(
+            db,
+            author_id=current_user.id,
+            test_id=test_id,
+            start_sort_order=question_import.next_sort_order(db, test_id)
+        )
         
-        def determine_answer_type(row):
-            """Определяем тип ответа"""
-            # Если есть явное поле answer_type
-            if 'answer_type' in row and row['answer_type'] and str(row['answer_type']).strip():
-                a_type = str(row['answer_type']).strip().lower()
-                if a_type in ['text', 'single_choice', 'multiple_choice']:
-                    return a_type
-            
-            # Если есть общее поле type и оно похоже на тип ответа
-            if 'type' in row and row['type'] and str(row['type']).strip():
-                type_val = str(row['type']).strip().lower()
-                if type_val in ['text', 'single_choice', 'multiple_choice']:
-                    return type_val
-            
-            # Определяем по наличию полей
-            options = []
-            if 'options' in row and row['options'] and str(row['options']).strip():
-                options_str = str(row['options'])
-                for sep in [';', ',', '|']:
-                    if sep in options_str:
-                        options = [opt.strip() for opt in options_str.split(sep) if opt.strip()]
-                        break
-                if not options:
-                    options = [options_str.strip()]
-            
-            correct_options = []
-            if 'correct_options' in row and row['correct_options'] and str(row['correct_options']).strip():
-                correct_opts_str = str(row['correct_options'])
-                for sep in [';', ',', '|']:
-                    if sep in correct_opts_str:
-                        correct_options = [opt.strip() for opt in correct_opts_str.split(sep) if opt.strip()]
-                        break
-                if not correct_options:
-                    correct_options = [correct_opts_str.strip()]
-            
-            # Логика определения
-            if len(correct_options) > 1:
-                return 'multiple_choice'
-            elif len(options) > 0:
-                return 'single_choice'
-            else:
-                return 'text'
+        # Категория берется из строки файла; вопрос, варианты и связь с тестом уходят в пачку
+        question_import.import_records(
+            db,
+            file_importer.iter_question_records(file.filename, file.file, all_sheets=all_sheets),
+            writer,
+            stats
+        )
+        errors = stats.errors + writer.errors
+        total_rows = stats.total_rows
+        imported_count = writer.imported_count
+        question_ids = writer.question_ids
         
-        imported_count = 0
-        errors = []
-        question_ids = []
+        print(f"✅ Импорт в тест {test_id}: {imported_count} из {total_rows} "
+              f"(новых {writer.new_count}, из банка {writer.reused_count})")
         
-        # Получаем максимальный sort_order в тесте
-        max_sort_order = db.query(func.max(models.TestQuestion.sort_order)).filter(
-            models.TestQuestion.test_id == test_id
-        ).scalar() or 0
-        
-        for idx, row in df.iterrows():
-            try:
-                row_num = idx + 2
-                question_text = str(row.get('question', '')).strip()
-                
-                if not question_text:
-                    errors.append(f"Строка {row_num}: Пустой текст вопроса")
-                    continue
-                
-                # Определяем типы
-                question_type = determine_question_type(row)
-                answer_type = determine_answer_type(row)
-                
-                print(f"📝 Строка {row_num}: question_type='{question_type}', answer_type='{answer_type}'")
-                
-                # Маппинг типов вопросов
-                question_type_mapping = {
-                    'text': 1,
-                    'blackbox': 2
-                }
-                
-                # Маппинг типов ответов
-                answer_type_mapping = {
-                    'text': 1,
-                    'single_choice': 2,
-                    'multiple_choice': 3
-                }
-                
-                if question_type not in question_type_mapping:
-                    errors.append(f"Строка {row_num}: Неподдерживаемый тип вопроса '{question_type}'")
-                    continue
-                
-                if answer_type not in answer_type_mapping:
-                    errors.append(f"Строка {row_num}: Неподдерживаемый тип ответа '{answer_type}'")
-                    continue
-                
-                type_id = question_type_mapping[question_type]
-                answer_type_id = answer_type_mapping[answer_type]
-                
-                # Получаем или создаем категорию
-                category_name = str(row.get('category', 'Общие знания')).strip()
-                category = db.query(models.Category).filter(
-                    func.lower(models.Category.name) == func.lower(category_name)
-                ).first()
-                
-                if not category:
-                    # Создаем новую категорию
-                    category = models.Category(
-                        name=category_name,
-                        description=f"Автоматически создана при импорте",
-                        color='#CCCCCC',
-                        icon='category'
-                    )
-                    db.add(category)
-                    db.commit()
-                    db.refresh(category)
-                
-                # Парсим варианты ответов
-                answer_options_data = []
-                if row.get('options') and str(row['options']).strip():
-                    options_str = str(row['options'])
-                    options = []
-                    for sep in [';', ',', '|']:
-                        if sep in options_str:
-                            options = [opt.strip() for opt in options_str.split(sep) if opt.strip()]
-                            break
-                    if not options:
-                        options = [options_str.strip()]
-                    
-                    # Получаем правильные варианты
-                    correct_options = []
-                    if row.get('correct_options') and str(row['correct_options']).strip():
-                        correct_opts_str = str(row['correct_options'])
-                        for sep in [';', ',', '|']:
-                            if sep in correct_opts_str:
-                                correct_options = [opt.strip() for opt in correct_opts_str.split(sep) if opt.strip()]
-                                break
-                        if not correct_options:
-                            correct_options = [correct_opts_str.strip()]
-                    
-                    # Получаем correct_answer
-                    correct_answer = ''
-                    if row.get('correct_answer') and str(row['correct_answer']).strip():
-                        correct_answer = str(row['correct_answer']).strip()
-                    
-                    # Создаем варианты ответов
-                    for i, option in enumerate(options):
-                        is_correct = False
-                        
-                        if answer_type == 'single_choice':
-                            # Для single_choice проверяем correct_answer
-                            if correct_answer and option == correct_answer:
-                                is_correct = True
-                            elif correct_options and option in correct_options:
-                                is_correct = True
-                        elif answer_type == 'multiple_choice':
-                            # Для multiple_choice проверяем correct_options
-                            if correct_options and option in correct_options:
-                                is_correct = True
-                        
-                        answer_options_data.append({
-                            'option_text': option,
-                            'is_correct': is_correct,
-                            'sort_order': i
-                        })
-                        
-                        print(f"  Вариант {i}: '{option}' - правильный: {is_correct}")
-                
-                # Подготавливаем данные вопроса
-                question_data = {
-                    'question_text': question_text,
-                    'type_id': type_id,
-                    'answer_type_id': answer_type_id,
-                    'category_id': category.id,
-                    'difficulty': int(float(str(row.get('difficulty', '1')).strip() or '1')),
-                    'explanation': str(row.get('explanation', '')).strip(),
-                    'time_limit': 60,
-                    'points': int(float(str(row.get('points', '1')).strip() or '1')),
-                    'correct_answer': str(row.get('correct_answer', '')).strip(),
-                    'sources': 'Импортировано из файла',
-                    'allow_latex': False,
-                    'blackbox_description': str(row.get('blackbox_description', '')).strip(),
-                    'answer_requirements': '',
-                    'is_active': True
-                }
-                
-                # Создаем вопрос
-                db_question = models.Question(
-                    **question_data,
-                    author_id=current_user.id
-                )
-                db.add(db_question)
-                db.commit()
-                db.refresh(db_question)
-                
-                print(f"✅ Вопрос создан: ID={db_question.id}")
-                
-                # Добавляем варианты ответов если есть
-                for opt_data in answer_options_data:
-                    db_option = models.AnswerOption(
-                        question_id=db_question.id,
-                        **opt_data
-                    )
-                    db.add(db_option)
-                
-                db.commit()
-                
-                # Добавляем вопрос в тест
-                max_sort_order += 1
-                db_test_question = models.TestQuestion(
-                    test_id=test_id,
-                    question_id=db_question.id,
-                    points=int(float(str(row.get('points', '1')).strip() or '1')),
-                    sort_order=max_sort_order
-                )
-                db.add(db_test_question)
-                db.commit()
-                
-                imported_count += 1
-                question_ids.append(db_question.id)
-                print(f"✅ Вопрос добавлен в тест: imported_count={imported_count}")
-                
-            except Exception as e:
-                db.rollback()
-                error_msg = f"Строка {idx + 2}: {str(e)}"
-                print(f"❌ Ошибка: {error_msg}")
-                errors.append(error_msg)
+        answer_keys.invalidate_test(test_id)
+        test_payloads.invalidate_test(test_id)
         
         return {
             "imported_count": imported_count,
-            "failed_count": len(df) - imported_count,
+            "new_count": writer.new_count,
+            "reused_count": writer.reused_count,
+            "failed_count": total_rows - imported_count,
             "question_ids": question_ids,
             "errors": errors[:10]
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         db.rollback()
         print(f"❌ Критическая ошибка импорта: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Ошибка импорта: {str(e)}")
 
+def dispatch_import_job(job_id: int, background_tasks: BackgroundTasks) -> None:
+    # Без пула воркеров задача выполняется фоном после ответа
+    if import_jobs.pool.is_running:
+        import_jobs.pool.notify()
+    else:
+        background_tasks.add_task(import_jobs.process_job, job_id)
+
+@app.post("/questions/import-jobs", status_code=status.HTTP_202_ACCEPTED)
+def create_question_import_job(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    category_id: int = None,
+    all_sheets: bool = False,
+    db: Session = Depends(get_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
+):
+    """
+    Фоновый импорт вопросов в банк: сразу возвращает id задачи,
+    прогресс - GET /import-jobs/{job_id}
+    """
+    job = import_jobs.create_job(
+        db, file.filename, file.file, current_user.id, category_id=category_id, all_sheets=all_sheets
+    )
+    dispatch_import_job(job.id, background_tasks)
+    return {"job_id": job.id, "status": job.status}
+
+@app.post("/tests/{test_id}/import-jobs", status_code=status.HTTP_202_ACCEPTED)
+def create_test_import_job(
+    test_id: int,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    all_sheets: bool = False,
+    db: Session = Depends(get_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
+):
+    """
+    Фоновый импорт вопросов из файла в тест
+    """
+    test = db.query(models.Test).filter(
+        models.Test.id == test_id,
+        models.Test.is_active == True
+    ).first()
+    
+    if not test:
+        raise HTTPException(status_code=404, detail="Тест не найден")
+    
+    if test.author_id != current_user.id and current_user.role_id != 3:
+        raise HTTPException(status_code=403, detail="Нет прав для редактирования этого теста")
+    
+    job = import_jobs.create_job(
+        db, file.filename, file.file, current_user.id, test_id=test_id, all_sheets=all_sheets
+    )
+    dispatch_import_job(job.id, background_tasks)
+    return {"job_id": job.id, "status": job.status}
+
+@app.get("/import-jobs/{job_id}")
+def get_import_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
+):
+    """Прогресс фонового импорта: обработано строк, ошибки, скорость"""
+    job = db.query(models.ImportJob).filter(models.ImportJob.id == job_id).first()
+    
+    if not job or (job.author_id != current_user.id and current_user.role_id != 3):
+        raise HTTPException(status_code=404, detail="Задача импорта не найдена")
+    
+    return import_jobs.job_status(job)
+
 # main.py - добавьте этот endpoint
 
 @app.get("/test-sessions/")
@@ -2358,8 +1911,8 @@ def get_test_sessions(
     test_id: Optional[int] = None,
     assignment_id: Optional[int] = None,
     user_id: Optional[int] = None,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    db: Session = Depends(get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     """Получить сессии тестирования"""
     
@@ -2416,7 +1969,7 @@ def debug_check_question(
     question_id: int,
     answer_text: Optional[str] = None,
     selected_options: Optional[str] = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Проверить правильность ответа на вопрос"""
     print(f"🔍 Проверка вопроса {question_id}")
@@ -2480,8 +2033,8 @@ def debug_check_question(
 @app.get("/groups/{group_id}/stats")
 def get_group_statistics(
     group_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    db: Session = Depends(get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_active_user)
 ):
     """Получить полную статистику группы - ДОСТУПНО ВСЕХ УЧАСТНИКАМ"""
     
@@ -2561,284 +2114,14 @@ def get_group_statistics(
     
     assignments = assignments_query.all()
     
-    # ========== 3. СОБИРАЕМ СТАТИСТИКУ ПО УЧАСТНИКАМ ==========
-    members_stats = []
-    
-    for member in members:
-        user_stats = {
-            "user_id": member.user_id,
-            "username": member.username,
-            "first_name": member.first_name,
-            "last_name": member.last_name,
-            "avatar_url": member.avatar_url,
-            "role": member.role,
-            "joined_at": member.joined_at.isoformat() if member.joined_at else None,
-            "completed_tests": 0,
-            "total_tests": len(assignments),
-            "total_score": 0,
-            "total_max_score": 0,
-            "average_score": 0,
-            "best_score": 0,
-            "worst_score": 100,
-            "passed_tests": 0,
-            "failed_tests": 0,
-            "total_time_spent": 0,
-            "average_time_per_test": 0,
-            "test_scores": [],
-            "activity_timeline": []
-        }
-        
-        total_percentage = 0
-        completed_count = 0
-        
-        # Для каждого назначения находим лучшую попытку пользователя
-        for assignment in assignments:
-            # Находим ВСЕ сессии пользователя для этого назначения
-            # Важно: проверяем и по assignment_id, и по test_id
-            sessions_query = db.query(
-                models.TestSession.id,
-                models.TestSession.score,
-                models.TestSession.max_score,
-                models.TestSession.percentage,
-                models.TestSession.is_completed,
-                models.TestSession.finished_at,
-                models.TestSession.time_spent,
-                models.TestSession.attempt_number
-            ).filter(
-                models.TestSession.user_id == member.user_id,
-                models.TestSession.test_id == assignment.test_id
-            )
-            
-            # Если есть assignment_id, фильтруем по нему
-            if assignment.assignment_id:
-                sessions_query = sessions_query.filter(
-                    models.TestSession.assignment_id == assignment.assignment_id
-                )
-            
-            sessions = sessions_query.order_by(
-                models.TestSession.percentage.desc()
-            ).all()
-            
-            if sessions:
-                # Берем лучшую попытку (самый высокий процент)
-                best_session = sessions[0]
-                
-                # Рассчитываем проходной балл
-                passing_score = assignment.passing_score or assignment.test_passing_score or 0
-                is_passed = best_session.percentage >= passing_score
-                
-                # Собираем информацию о тесте
-                test_score_info = {
-                    "test_id": assignment.test_id,
-                    "assignment_id": assignment.assignment_id,
-                    "test_title": assignment.test_title,
-                    "test_description": assignment.test_description,
-                    "start_date": assignment.start_date.isoformat() if assignment.start_date else None,
-                    "end_date": assignment.end_date.isoformat() if assignment.end_date else None,
-                    "time_limit": assignment.time_limit or assignment.test_time_limit,
-                    "max_attempts": assignment.max_attempts or assignment.test_max_attempts,
-                    "passing_score": passing_score,
-                    
-                    # Статистика по лучшей попытке
-                    "best_score": best_session.score,
-                    "best_max_score": best_session.max_score,
-                    "best_percentage": best_session.percentage,
-                    "best_attempt_number": best_session.attempt_number,
-                    "best_finished_at": best_session.finished_at.isoformat() if best_session.finished_at else None,
-                    "best_time_spent": best_session.time_spent,
-                    "is_passed": is_passed,
-                    
-                    # Общая статистика по всем попыткам
-                    "total_attempts": len(sessions),
-                    "attempts": []
-                }
-                
-                # Добавляем информацию о всех попытках
-                for session in sessions:
-                    test_score_info["attempts"].append({
-                        "session_id": session.id,
-                        "score": session.score,
-                        "max_score": session.max_score,
-                        "percentage": session.percentage,
-                        "is_completed": session.is_completed,
-                        "finished_at": session.finished_at.isoformat() if session.finished_at else None,
-                        "time_spent": session.time_spent,
-                        "attempt_number": session.attempt_number
-                    })
-                
-                user_stats["test_scores"].append(test_score_info)
-                
-                # Обновляем общую статистику
-                if best_session.is_completed:
-                    user_stats["completed_tests"] += 1
-                    user_stats["total_score"] += best_session.score
-                    user_stats["total_max_score"] += best_session.max_score
-                    total_percentage += best_session.percentage
-                    completed_count += 1
-                    
-                    if best_session.time_spent:
-                        user_stats["total_time_spent"] += best_session.time_spent
-                    
-                    # Обновляем лучший и худший результаты
-                    if best_session.percentage > user_stats["best_score"]:
-                        user_stats["best_score"] = best_session.percentage
-                    if best_session.percentage < user_stats["worst_score"]:
-                        user_stats["worst_score"] = best_session.percentage
-                    
-                    # Считаем пройденные/непройденные тесты
-                    if is_passed:
-                        user_stats["passed_tests"] += 1
-                    else:
-                        user_stats["failed_tests"] += 1
-                    
-                    # Добавляем в таймлайн активности
-                    if best_session.finished_at:
-                        user_stats["activity_timeline"].append({
-                            "date": best_session.finished_at.isoformat(),
-                            "test_id": assignment.test_id,
-                            "test_title": assignment.test_title,
-                            "score": best_session.score,
-                            "max_score": best_session.max_score,
-                            "percentage": best_session.percentage,
-                            "is_passed": is_passed,
-                            "attempt_number": best_session.attempt_number
-                        })
-        
-        # Рассчитываем средние значения
-        if completed_count > 0:
-            user_stats["average_score"] = round(total_percentage / completed_count, 1)
-            
-            if user_stats["total_time_spent"] > 0:
-                user_stats["average_time_per_test"] = round(user_stats["total_time_spent"] / completed_count)
-        
-        # Сортируем timeline по дате
-        user_stats["activity_timeline"].sort(key=lambda x: x["date"], reverse=True)
-        
-        members_stats.append(user_stats)
-    
-    # Сортируем участников по среднему баллу (по убыванию)
-    members_stats.sort(key=lambda x: x["average_score"], reverse=True)
+    # ========== 3. ЗАГРУЖАЕМ ПОПЫТКИ ВСЕХ УЧАСТНИКОВ ОДНИМ ЗАПРОСОМ ==========
+    attempts = group_stats.load_group_attempts(db, group_id)
+    bests = group_stats.load_member_bests(db, group_id)
+    summaries = group_stats.load_assignment_summaries(db, group_id)
     
-    # ========== 4. СТАТИСТИКА ПО ТЕСТАМ С МЕДИАНОЙ ==========
-    test_statistics = []
-    
-    for assignment in assignments:
-        test_stat = {
-            "test_id": assignment.test_id,
-            "assignment_id": assignment.assignment_id,
-            "test_title": assignment.test_title,
-            "start_date": assignment.start_date.isoformat() if assignment.start_date else None,
-            "end_date": assignment.end_date.isoformat() if assignment.end_date else None,
-            "passing_score": assignment.passing_score or assignment.test_passing_score or 0,
-            "total_participants": len(members),
-            "participated_count": 0,
-            "completed_count": 0,
-            "passed_count": 0,
-            "failed_count": 0,
-            "average_score": 0,
-            "median_score": 0,  # ← ДОБАВЛЯЕМ МЕДИАНУ
-            "max_score": 0,
-            "min_score": 100,
-            "scores_distribution": {
-                "excellent": 0,      # 90-100%
-                "good": 0,           # 70-89%
-                "satisfactory": 0,   # 50-69%
-                "poor": 0            # 0-49%
-            },
-            "participants": []
-        }
-        
-        scores = []
-        
-        # Собираем результаты всех участников
-        for member in members:
-            # Ищем лучшую сессию этого участника
-            # Проверяем и по assignment_id, и по test_id
-            sessions_query = db.query(
-                models.TestSession.percentage,
-                models.TestSession.score,
-                models.TestSession.max_score,
-                models.TestSession.is_completed,
-                models.TestSession.finished_at
-            ).filter(
-                models.TestSession.user_id == member.user_id,
-                models.TestSession.test_id == assignment.test_id
-            )
-            
-            # Если есть assignment_id, фильтруем по нему
-            if assignment.assignment_id:
-                sessions_query = sessions_query.filter(
-                    models.TestSession.assignment_id == assignment.assignment_id
-                )
-            
-            best_session = sessions_query.order_by(
-                models.TestSession.percentage.desc()
-            ).first()
-            
-            participant_info = {
-                "user_id": member.user_id,
-                "username": member.username,
-                "first_name": member.first_name,
-                "last_name": member.last_name,
-                "has_attempt": best_session is not None,
-                "is_completed": best_session.is_completed if best_session else False,
-                "percentage": best_session.percentage if best_session else 0,
-                "score": best_session.score if best_session else 0,
-                "max_score": best_session.max_score if best_session else 0,
-                "is_passed": False,
-                "finished_at": best_session.finished_at.isoformat() if best_session and best_session.finished_at else None
-            }
-            
-            if best_session:
-                test_stat["participated_count"] += 1
-                
-                if best_session.is_completed:
-                    test_stat["completed_count"] += 1
-                    scores.append(best_session.percentage)
-                    
-                    # Обновляем мин/макс
-                    if best_session.percentage > test_stat["max_score"]:
-                        test_stat["max_score"] = best_session.percentage
-                    if best_session.percentage < test_stat["min_score"]:
-                        test_stat["min_score"] = best_session.percentage
-                    
-                    # Распределение по категориям
-                    if best_session.percentage >= 90:
-                        test_stat["scores_distribution"]["excellent"] += 1
-                    elif best_session.percentage >= 70:
-                        test_stat["scores_distribution"]["good"] += 1
-                    elif best_session.percentage >= 50:
-                        test_stat["scores_distribution"]["satisfactory"] += 1
-                    else:
-                        test_stat["scores_distribution"]["poor"] += 1
-                    
-                    # Проверяем прохождение
-                    is_passed = best_session.percentage >= test_stat["passing_score"]
-                    participant_info["is_passed"] = is_passed
-                    
-                    if is_passed:
-                        test_stat["passed_count"] += 1
-                    else:
-                        test_stat["failed_count"] += 1
-            
-            test_stat["participants"].append(participant_info)
-        
-        # Рассчитываем средний балл и медиану
-        if scores:
-            # Среднее
-            test_stat["average_score"] = round(sum(scores) / len(scores), 1)
-            
-            # Медиана
-            sorted_scores = sorted(scores)
-            n = len(sorted_scores)
-            if n % 2 == 1:
-                # Нечетное количество: берем средний элемент
-                test_stat["median_score"] = sorted_scores[n // 2]
-            else:
-                # Четное количество: среднее двух центральных
-                test_stat["median_score"] = round((sorted_scores[n // 2 - 1] + sorted_scores[n // 2]) / 2, 1)
-        
-        test_statistics.append(test_stat)
+    # ========== 4. СТАТИСТИКА ПО УЧАСТНИКАМ И ПО ТЕСТАМ (С МЕДИАНОЙ) ==========
+    members_stats = group_stats.build_members_stats(members, assignments, attempts, bests)
+    test_statistics = group_stats.build_test_statistics(members, assignments, attempts, bests, summaries)
     
     # ========== 5. ОБЩАЯ СТАТИСТИКА ГРУППЫ ==========
     if members_stats:
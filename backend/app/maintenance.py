@@ -0,0 +1,82 @@
+"""Офлайн-обслуживание базы.
+
+Запуск из папки backend:
+    python -m app.maintenance recalc-scores [--test-id N] [--dry-run]
+    python -m app.maintenance migrate [--status]
+    python -m app.maintenance create-indexes
+    python -m app.maintenance purge-refresh-tokens [--days N]
+"""
+import argparse
+
+from . import crud, indexes, migrations, refresh_tokens
+from .database import SessionLocal, engine
+
+
+def recalc_scores(args):
+    db = SessionLocal()
+    try:
+        repaired = crud.recalculate_session_scores(db, test_id=args.test_id, dry_run=args.dry_run)
+    finally:
+        db.close()
+
+    for item in repaired:
+        print(f"Сессия {item['session_id']}: score {item['score'][0]} -> {item['score'][1]}, "
+              f"процент {item['percentage'][0]} -> {item['percentage'][1]}")
+
+    action = "найдено" if args.dry_run else "исправлено"
+    print(f"Расхождений {action}: {len(repaired)}")
+
+
+def migrate(args):
+    if args.status:
+        applied = migrations.applied_versions(engine)
+        for migration in migrations.MIGRATIONS:
+            mark = "✅" if migration.version in applied else "⏳"
+            print(f"{mark} {migration.version} {migration.name}")
+        return
+
+    applied = migrations.upgrade(engine)
+    print(f"Применено миграций: {len(applied)}")
+
+
+def create_indexes(args):
+    with engine.begin() as connection:
+        created = indexes.create_hot_indexes(connection)
+    print(f"Создано индексов: {len(created)}")
+
+
+def purge_refresh_tokens(args):
+    db = SessionLocal()
+    try:
+        deleted = refresh_tokens.purge_expired(db, older_than_days=args.days)
+    finally:
+        db.close()
+    print(f"Удалено refresh-токенов: {deleted}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обслуживание платформы тестирования")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    recalc = subparsers.add_parser("recalc-scores", help="Пересчитать баллы сессий и исправить расхождения")
+    recalc.add_argument("--test-id", type=int, default=None)
+    recalc.add_argument("--dry-run", action="store_true")
+    recalc.set_defaults(func=recalc_scores)
+
+    migrate_parser = subparsers.add_parser("migrate", help="Применить миграции схемы")
+    migrate_parser.add_argument("--status", action="store_true", help="Только показать состояние миграций")
+    migrate_parser.set_defaults(func=migrate)
+
+    create = subparsers.add_parser("create-indexes", help="Создать составные индексы в существующей базе")
+    create.set_defaults(func=create_indexes)
+
+    purge = subparsers.add_parser("purge-refresh-tokens", help="Удалить истекшие и отозванные refresh-токены")
+    purge.add_argument("--days", type=int, default=7, help="Сколько дней хранить отозванные токены")
+    purge.set_defaults(func=purge_refresh_tokens)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""Версионные миграции схемы.
+
+Приложение при старте DDL не выполняет: схема обновляется отдельным шагом
+    python -m app.maintenance migrate
+Примененные версии хранятся в таблице schema_migrations. Новую миграцию
+добавляют в конец MIGRATIONS, уже примененные не меняют.
+
+Миграции не читают текущие models.py: таблицы и индексы берутся из
+замороженных определений app.schema_history, данные правятся через
+table()/column() с нужными колонками.
+"""
+import hashlib
+import json
+import re
+from datetime import datetime
+from typing import Callable, List, NamedTuple, Optional
+
+from sqlalchemy import (
+    Column, DateTime, MetaData, String, Table, bindparam, column, delete, insert, inspect, select, table,
+    text, update,
+)
+
+from . import indexes, schema_history
+
+
+class Migration(NamedTuple):
+    version: str
+    name: str
+    upgrade: Callable
+    # False - миграция сама управляет транзакциями (например, CREATE INDEX CONCURRENTLY)
+    transactional: bool = True
+
+
+_metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    _metadata,
+    Column("version", String(20), primary_key=True),
+    Column("name", String(200), nullable=False),
+    Column("applied_at", DateTime(timezone=True), nullable=False),
+)
+
+
+def _create_tables(*table_names: str) -> Callable:
+    def upgrade(connection):
+        tables = [schema_history.metadata.tables[name] for name in table_names]
+        schema_history.metadata.create_all(bind=connection, tables=tables, checkfirst=True)
+    return upgrade
+
+
+def _add_column(table_name: str, column_name: str, ddl: str) -> Callable:
+    def upgrade(connection):
+        columns = {column["name"] for column in inspect(connection).get_columns(table_name)}
+        if column_name not in columns:
+            connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {ddl}"))
+    return upgrade
+
+
+def _fingerprint_0007(question_text, answer_type_id, options, correct_answer) -> str:
+    """Копия question_import.question_fingerprint на момент миграции 0007"""
+    def normalize(value):
+        return re.sub(r"\s+", " ", (value or "").strip().lower())
+
+    content = {
+        "text": normalize(question_text),
+        "answer_type_id": answer_type_id,
+        "options": sorted([normalize(text), bool(is_correct)] for text, is_correct in options),
+        "correct_answer": normalize(correct_answer)
+    }
+    return hashlib.sha256(
+        json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
+
+
+def _backfill_question_fingerprints(connection, batch_size: int = 1000):
+    questions = table(
+        "questions",
+        column("id"), column("question_text"), column("answer_type_id"), column("correct_answer"),
+        column("fingerprint"),
+    )
+    options = table("answer_options", column("question_id"), column("option_text"), column("is_correct"))
+    last_id = 0
+
+    while True:
+        rows = connection.execute(
+            select(questions.c.id, questions.c.question_text, questions.c.answer_type_id, questions.c.correct_answer)
+            .where(questions.c.id > last_id, questions.c.fingerprint.is_(None))
+            .order_by(questions.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return
+
+        question_options = {row.id: [] for row in rows}
+        for option in connection.execute(
+            select(options.c.question_id, options.c.option_text, options.c.is_correct)
+            .where(options.c.question_id.in_(list(question_options.keys())))
+        ):
+            question_options[option.question_id].append((option.option_text, option.is_correct))
+
+        connection.execute(
+            update(questions).where(questions.c.id == bindparam("question_id")).values(fingerprint=bindparam("value")),
+            [
+                {
+                    "question_id": row.id,
+                    "value": _fingerprint_0007(
+                        row.question_text, row.answer_type_id, question_options[row.id], row.correct_answer
+                    )
+                }
+                for row in rows
+            ]
+        )
+        last_id = rows[-1].id
+
+
+def _create_fingerprint_index(connection):
+    index = schema_history.QUESTIONS_FINGERPRINT_INDEX
+    if not indexes.index_exists(connection, "questions", index.name):
+        indexes.create_index(connection, index, online=True)
+
+
+def _rebuild_assignment_statistics(connection, batch_size: int = 1000):
+    """Заполнить лучшие попытки и сводки назначений по уже завершенным сессиям.
+
+    Сводка ведется только по активным участникам группы назначения,
+    гистограмма хранит точные проценты (см. app.group_stats).
+    """
+    sessions = table(
+        "test_sessions",
+        column("id"), column("user_id"), column("assignment_id"), column("score"), column("max_score"),
+        column("percentage"), column("is_completed"), column("finished_at"),
+    )
+    bests = table(
+        "member_assignment_best",
+        column("assignment_id"), column("user_id"), column("session_id"), column("score"),
+        column("max_score"), column("percentage"), column("finished_at"),
+    )
+    summaries = table(
+        "assignment_summaries",
+        column("assignment_id"), column("completed_count"), column("score_sum"), column("histogram"),
+    )
+    assignments = table("test_assignments", column("id"), column("group_id"))
+    members = table("group_members", column("group_id"), column("user_id"), column("is_active"))
+
+    connection.execute(delete(bests))
+    connection.execute(delete(summaries))
+
+    active_members = set(connection.execute(
+        select(assignments.c.id, members.c.user_id)
+        .join(members, members.c.group_id == assignments.c.group_id)
+        .where(members.c.is_active == True)
+    ).all())
+
+    rows = connection.execute(
+        select(sessions)
+        .where(sessions.c.assignment_id.isnot(None), sessions.c.is_completed == True)
+        .order_by(sessions.c.assignment_id, sessions.c.user_id, sessions.c.percentage.desc(), sessions.c.id)
+    )
+    batch = []
+    histograms = {}
+    last_key = None
+    for row in rows:
+        if (row.assignment_id, row.user_id) == last_key:
+            continue
+        last_key = (row.assignment_id, row.user_id)
+        percentage = row.percentage or 0
+        batch.append({
+            "assignment_id": row.assignment_id,
+            "user_id": row.user_id,
+            "session_id": row.id,
+            "score": row.score,
+            "max_score": row.max_score,
+            "percentage": percentage,
+            "finished_at": row.finished_at
+        })
+        if (row.assignment_id, row.user_id) in active_members:
+            histogram = histograms.setdefault(row.assignment_id, {})
+            key = repr(float(percentage))
+            histogram[key] = histogram.get(key, 0) + 1
+        if len(batch) >= batch_size:
+            connection.execute(insert(bests), batch)
+            batch = []
+    if batch:
+        connection.execute(insert(bests), batch)
+
+    if histograms:
+        connection.execute(insert(summaries), [
+            {
+                "assignment_id": assignment_id,
+                "completed_count": sum(histogram.values()),
+                "score_sum": sum(float(key) * count for key, count in histogram.items()),
+                "histogram": json.dumps(histogram, sort_keys=True)
+            }
+            for assignment_id, histogram in histograms.items()
+        ])
+
+
+def _create_statistics_tables(connection):
+    _create_tables("member_assignment_best", "assignment_summaries", "statistics_outbox")(connection)
+    _rebuild_assignment_statistics(connection)
+
+
+def _create_hot_indexes(connection):
+    indexes.create_hot_indexes(connection, online=True, hot_indexes=schema_history.HOT_INDEXES_0003)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration("0001", "initial schema", _create_tables(
+        "roles", "users", "test_access", "study_groups", "group_members", "categories",
+        "question_types", "answer_types", "questions", "answer_options", "tests",
+        "test_questions", "test_assignments", "test_sessions", "user_answers", "user_statistics",
+    )),
+    Migration("0002", "statistics aggregates and outbox", _create_statistics_tables),
+    Migration("0003", "composite indexes for hot filters", _create_hot_indexes, transactional=False),
+    Migration("0004", "user token version", _add_column(
+        "users", "token_version", "INTEGER NOT NULL DEFAULT 0"
+    )),
+    Migration("0005", "refresh tokens", _create_tables("refresh_tokens")),
+    Migration("0006", "question fingerprint", _add_column("questions", "fingerprint", "VARCHAR(64)")),
+    Migration("0007", "backfill question fingerprints", _backfill_question_fingerprints),
+    Migration("0008", "question fingerprint index", _create_fingerprint_index, transactional=False),
+    Migration("0009", "import jobs", _create_tables("import_jobs")),
+]
+
+
+def applied_versions(db_engine) -> set:
+    with db_engine.connect() as connection:
+        if not inspect(connection).has_table(schema_migrations.name):
+            return set()
+        return {row.version for row in connection.execute(schema_migrations.select())}
+
+
+def pending_migrations(db_engine, target: Optional[str] = None) -> List[Migration]:
+    applied = applied_versions(db_engine)
+    return [
+        migration for migration in MIGRATIONS
+        if migration.version not in applied and (target is None or migration.version <= target)
+    ]
+
+
+def _mark_applied(connection, migration: Migration) -> None:
+    connection.execute(schema_migrations.insert().values(
+        version=migration.version,
+        name=migration.name,
+        applied_at=datetime.utcnow()
+    ))
+
+
+def upgrade(db_engine, target: Optional[str] = None) -> List[Migration]:
+    """Применить непримененные миграции по порядку (до target включительно)"""
+    _metadata.create_all(bind=db_engine, checkfirst=True)
+
+    applied = []
+    for migration in pending_migrations(db_engine, target):
+        print(f"🔧 Миграция {migration.version}: {migration.name}")
+
+        if migration.transactional:
+            with db_engine.begin() as connection:
+                migration.upgrade(connection)
+                _mark_applied(connection, migration)
+        else:
+            with db_engine.connect() as connection:
+                migration.upgrade(connection.execution_options(isolation_level="AUTOCOMMIT"))
+            with db_engine.begin() as connection:
+                _mark_applied(connection, migration)
+
+        applied.append(migration)
+
+    return applied
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, Text, DateTime, ForeignKey, Float
+from sqlalchemy import Column, Integer, String, Boolean, Text, DateTime, ForeignKey, Float, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -28,6 +28,8 @@ class User(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     last_login = Column(DateTime(timezone=True))
     is_active = Column(Boolean, default=True)
+    # Увеличивается при смене роли, активности или пароля - старые токены перестают действовать
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
     
     role = relationship("Role", back_populates="users")
     created_tests = relationship("Test", back_populates="author")
@@ -40,6 +42,9 @@ class User(Base):
 
 class TestAccess(Base):
     __tablename__ = "test_access"
+    __table_args__ = (
+        Index("ix_test_access_test_user", "test_id", "user_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     test_id = Column(Integer, ForeignKey("tests.id"), nullable=False)
@@ -80,6 +85,9 @@ class StudyGroup(Base):
 
 class GroupMember(Base):
     __tablename__ = "group_members"
+    __table_args__ = (
+        Index("ix_group_members_group_user_active", "group_id", "user_id", "is_active"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     group_id = Column(Integer, ForeignKey("study_groups.id"), nullable=False)
@@ -129,6 +137,10 @@ class AnswerType(Base):
 
 class Question(Base):
     __tablename__ = "questions"
+    __table_args__ = (
+        # Импорт переиспользует вопросы только своего автора
+        Index("ix_questions_author_fingerprint", "author_id", "fingerprint"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     question_text = Column(Text, nullable=False)
@@ -147,6 +159,8 @@ class Question(Base):
     correct_answer = Column(Text)
     answer_requirements = Column(Text)
     is_active = Column(Boolean, default=True)
+    # SHA-256 нормализованного содержимого (см. question_import.question_fingerprint)
+    fingerprint = Column(String(64))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
@@ -154,12 +168,18 @@ class Question(Base):
     answer_type = relationship("AnswerType", lazy="joined")  # Добавляем lazy="joined" для автоматической загрузки
     category = relationship("Category", back_populates="questions")
     author = relationship("User")
-    answer_options = relationship("AnswerOption", back_populates="question", cascade="all, delete-orphan")
+    # Порядок задаем явно: без order_by SQLite отдает строки в порядке индекса
+    # (question_id, is_correct), и верный вариант всегда оказывается последним
+    answer_options = relationship("AnswerOption", back_populates="question", cascade="all, delete-orphan",
+                                  order_by="[AnswerOption.sort_order, AnswerOption.id]")
     test_questions = relationship("TestQuestion", back_populates="question")
     user_answers = relationship("UserAnswer", back_populates="question")
     
 class AnswerOption(Base):
     __tablename__ = "answer_options"
+    __table_args__ = (
+        Index("ix_answer_options_question_correct", "question_id", "is_correct"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     question_id = Column(Integer, ForeignKey("questions.id"), nullable=False)
@@ -188,13 +208,17 @@ class Test(Base):
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
     author = relationship("User", back_populates="created_tests")
-    questions = relationship("TestQuestion", back_populates="test")
+    questions = relationship("TestQuestion", back_populates="test",
+                             order_by="[TestQuestion.sort_order, TestQuestion.id]")
     assignments = relationship("TestAssignment", back_populates="test")
     sessions = relationship("TestSession", back_populates="test")
     access_rights = relationship("TestAccess", back_populates="test")
 
 class TestQuestion(Base):
     __tablename__ = "test_questions"
+    __table_args__ = (
+        Index("uq_test_questions_test_question", "test_id", "question_id", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     test_id = Column(Integer, ForeignKey("tests.id"), nullable=False)
@@ -228,6 +252,9 @@ class TestAssignment(Base):
 
 class TestSession(Base):
     __tablename__ = "test_sessions"
+    __table_args__ = (
+        Index("ix_test_sessions_user_test_assignment", "user_id", "test_id", "assignment_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -249,6 +276,10 @@ class TestSession(Base):
 
 class UserAnswer(Base):
     __tablename__ = "user_answers"
+    __table_args__ = (
+        # Один ответ на вопрос в сессии: повторный ответ заменяет предыдущий
+        Index("uq_user_answers_session_question", "session_id", "question_id", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(Integer, ForeignKey("test_sessions.id"), nullable=False)
@@ -265,6 +296,10 @@ class UserAnswer(Base):
 
 class UserStatistics(Base):
     __tablename__ = "user_statistics"
+    __table_args__ = (
+        # Одна строка на пару пользователь/категория (upsert в user_stats опирается на это)
+        Index("uq_user_statistics_user_category", "user_id", "category_id", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -280,4 +315,99 @@ class UserStatistics(Base):
     user = relationship("User")
     category = relationship("Category", back_populates="statistics")
 
+class MemberAssignmentBest(Base):
+    """Лучшая завершенная попытка участника по назначению (материализованная)"""
+    __tablename__ = "member_assignment_best"
+    __table_args__ = (
+        UniqueConstraint("assignment_id", "user_id", name="uq_member_assignment_best"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    assignment_id = Column(Integer, ForeignKey("test_assignments.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    session_id = Column(Integer, ForeignKey("test_sessions.id"), nullable=False)
+    score = Column(Integer, default=0)
+    max_score = Column(Integer, default=0)
+    percentage = Column(Float, default=0)
+    finished_at = Column(DateTime(timezone=True))
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class AssignmentSummary(Base):
+    """Сводка по лучшим попыткам активных участников назначения, обновляемая инкрементально"""
+    __tablename__ = "assignment_summaries"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    assignment_id = Column(Integer, ForeignKey("test_assignments.id"), unique=True, nullable=False)
+    completed_count = Column(Integer, default=0)
+    score_sum = Column(Float, default=0)
+    # JSON-объект {точный процент: сколько участников его получили}
+    histogram = Column(Text, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class StatisticsOutbox(Base):
+    """Очередь событий «сессия завершена» для фонового пересчета статистики.
+
+    session_id уникален: одно событие на сессию, поэтому повторная обработка
+    или повторное завершение не учитывают тест дважды.
+    """
+    __tablename__ = "statistics_outbox"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, ForeignKey("test_sessions.id"), unique=True, nullable=False)
+    event_type = Column(String(50), nullable=False, default='session_completed')
+    status = Column(String(20), nullable=False, default='pending', index=True)  # pending, processing, done, failed
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text)
+    available_at = Column(DateTime(timezone=True), server_default=func.now())
+    locked_at = Column(DateTime(timezone=True))
+    processed_at = Column(DateTime(timezone=True))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class RefreshToken(Base):
+    """Refresh-токен. Храним только SHA-256 от токена.
+
+    Токены одной цепочки ротации имеют общий family_id: повторное
+    предъявление уже использованного токена отзывает всю цепочку.
+    """
+    __tablename__ = "refresh_tokens"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    token_hash = Column(String(64), unique=True, nullable=False)
+    family_id = Column(String(32), nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    revoked_at = Column(DateTime(timezone=True))
+    revoked_reason = Column(String(20))  # rotated, reused, logout, logout_all
+
 
+class ImportJob(Base):
+    """Фоновый импорт вопросов из файла.
+
+    checkpoint_row - номер последней строки файла, записанной в базу: после
+    перезапуска воркер продолжает со следующей строки, а не с начала.
+    """
+    __tablename__ = "import_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    author_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    test_id = Column(Integer, ForeignKey("tests.id"))  # импорт в тест, иначе в банк вопросов
+    category_id = Column(Integer, ForeignKey("categories.id"))
+    all_sheets = Column(Boolean, nullable=False, default=False, server_default="0")  # все листы .xlsx
+    filename = Column(String(255), nullable=False)
+    file_path = Column(String(500), nullable=False)
+    status = Column(String(20), nullable=False, default='queued', index=True)  # queued, running, done, failed
+    rows_processed = Column(Integer, nullable=False, default=0)
+    checkpoint_row = Column(Integer, nullable=False, default=0)
+    imported_count = Column(Integer, nullable=False, default=0)
+    new_count = Column(Integer, nullable=False, default=0)
+    reused_count = Column(Integer, nullable=False, default=0)
+    failed_count = Column(Integer, nullable=False, default=0)
+    errors = Column(Text)  # JSON-массив первых ошибок
+    last_error = Column(Text)
+    attempts = Column(Integer, default=0)
+    locked_at = Column(DateTime(timezone=True))  # продлевается heartbeat'ом воркера
+    locked_by = Column(String(32))  # токен воркера, забравшего задачу
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,136 @@
+"""Хеширование паролей Argon2 в отдельном пуле процессов.
+
+Argon2 - долгая CPU-задача: в пуле процессов она не держит GIL и не занимает
+потоки, которые обслуживают остальные запросы. Модуль намеренно легкий
+(без FastAPI и базы), так как импортируется в процессах пула.
+"""
+import asyncio
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+from .config import settings
+
+
+class HashingOverloaded(Exception):
+    """Очередь на хеширование переполнена"""
+
+
+def build_context() -> CryptContext:
+    # Используем Argon2 вместо bcrypt - нет ограничений на длину пароля
+    return CryptContext(
+        schemes=["argon2"],
+        deprecated="auto",
+        argon2__time_cost=settings.ARGON2_TIME_COST,
+        argon2__memory_cost=settings.ARGON2_MEMORY_COST,
+        argon2__parallelism=settings.ARGON2_PARALLELISM
+    )
+
+
+pwd_context = build_context()
+
+
+# ========== ФУНКЦИИ, ВЫПОЛНЯЕМЫЕ В ПРОЦЕССАХ ПУЛА ==========
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_and_update(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    """Проверить пароль; если хеш с устаревшими параметрами - вернуть новый"""
+    return pwd_context.verify_and_update(password, password_hash)
+
+
+# ========== ПУЛ ==========
+
+class HashingPool:
+    """Пул процессов с ограничением одновременных задач и счетчиками очереди"""
+
+    def __init__(self, workers: int, max_concurrency: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_concurrency = max(max_concurrency, 1)
+        # asyncio.Semaphore привязывается к event loop при первом ожидании,
+        # поэтому у каждого loop свой (создается лениво, уходит вместе с loop)
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._executor = None
+        self._lock = threading.Lock()
+        # Счетчики меняются из разных потоков (несколько event loop'ов, status())
+        self._counters_lock = threading.Lock()
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _get_executor(self):
+        # При workers=0 считаем в стандартном пуле потоков (например, для отладки)
+        if self.workers <= 0:
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+            return semaphore
+
+    async def run(self, func, *args):
+        with self._counters_lock:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise HashingOverloaded()
+            self.waiting += 1
+
+        semaphore = self._semaphore()
+        try:
+            await semaphore.acquire()
+        finally:
+            with self._counters_lock:
+                self.waiting -= 1
+
+        with self._counters_lock:
+            self.running += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            with self._counters_lock:
+                self.running -= 1
+                self.completed += 1
+            semaphore.release()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def status(self) -> dict:
+        with self._counters_lock:
+            return {
+                "workers": self.workers,
+                "queue_depth": self.waiting,
+                "running": self.running,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "max_queue": self.max_queue
+            }
+
+
+hashing_pool = HashingPool(settings.HASH_WORKERS, settings.HASH_MAX_CONCURRENCY, settings.HASH_MAX_QUEUE)
+
+
+async def hash_password_async(password: str) -> str:
+    return await hashing_pool.run(hash_password, password)
+
+
+async def verify_and_update_async(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    return await hashing_pool.run(verify_and_update, password, password_hash)
@@ -0,0 +1,397 @@
+"""Пакетная запись импортируемых вопросов.
+
+Вопросы, их варианты и связи с тестом пишутся пачками по IMPORT_BATCH_SIZE
+строк: несколько INSERT и один commit на пачку вместо нескольких commit
+на каждый вопрос. Если пачка не записалась, она повторяется построчно,
+чтобы указать конкретные строки с ошибками.
+
+Вопрос, уже имеющийся в банке автора импорта (тот же отпечаток содержимого),
+повторно не создается: строка файла связывается с существующим вопросом.
+
+Категории из файла разрешаются CategoryResolver: все категории читаются
+одним запросом, недостающие создаются одним INSERT на пачку.
+
+import_records - общий проход по строкам файла для импорта в запросе
+и фоновых задач (import_jobs).
+"""
+import hashlib
+import json
+import re
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import func, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import answer_keys, models
+from .config import settings
+from .database import upsert_insert
+from .utils import file_importer
+
+
+def _normalize_text(value: Optional[str]) -> str:
+    return re.sub(r"\s+", " ", (value or "").strip().lower())
+
+
+def question_fingerprint(
+    question_text: str,
+    answer_type_id: int,
+    options: Iterable[Tuple[str, bool]],
+    correct_answer: Optional[str] = None
+) -> str:
+    """SHA-256 нормализованного содержимого вопроса.
+
+    Регистр, лишние пробелы и порядок вариантов не влияют на отпечаток;
+    правильность вариантов и правильный ответ - влияют.
+    """
+    content = {
+        "text": _normalize_text(question_text),
+        "answer_type_id": answer_type_id,
+        "options": sorted([_normalize_text(text), bool(is_correct)] for text, is_correct in options),
+        "correct_answer": _normalize_text(correct_answer)
+    }
+    return hashlib.sha256(
+        json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
+
+
+class CategoryResolver:
+    """Категории импорта по имени (без учета регистра) из памяти"""
+
+    def __init__(self, db: Session):
+        self.db = db
+        self._ids: Dict[str, int] = {}
+        self._load()
+
+    def _load(self) -> None:
+        for category_id, name in self.db.query(models.Category.id, models.Category.name).order_by(models.Category.id):
+            self._ids.setdefault(name.lower(), category_id)
+
+    def resolve(self, name: str) -> Optional[int]:
+        return self._ids.get(name.lower())
+
+    def ensure(self, names: Iterable[str]) -> None:
+        """Создать отсутствующие категории одним INSERT и зафиксировать"""
+        missing: Dict[str, str] = {}
+        for name in names:
+            if name.lower() not in self._ids:
+                missing.setdefault(name.lower(), name)
+        if not missing:
+            return
+
+        try:
+            self._insert(list(missing.values()))
+        except IntegrityError:
+            # Категорию успел создать параллельный импорт: перечитываем и повторяем
+            self.db.rollback()
+            self._load()
+            self._insert([name for key, name in missing.items() if key not in self._ids])
+
+    def _insert(self, names: List[str]) -> None:
+        if not names:
+            return
+        category_ids = self.db.execute(
+            insert(models.Category).returning(models.Category.id, sort_by_parameter_order=True),
+            [
+                {
+                    "name": name,
+                    "description": "Автоматически создана при импорте",
+                    "color": "#CCCCCC",
+                    "icon": "category"
+                }
+                for name in names
+            ]
+        ).scalars().all()
+        self.db.commit()
+        for name, category_id in zip(names, category_ids):
+            self._ids[name.lower()] = category_id
+        print(f"📁 Созданы категории при импорте: {', '.join(names)}")
+
+
+class WriteAborted(Exception):
+    """before_commit запретил запись: пачка откатывается, импорт прекращается"""
+
+
+class BulkQuestionWriter:
+    def __init__(
+        self,
+        db: Session,
+        author_id: int,
+        test_id: Optional[int] = None,
+        start_sort_order: int = 0,
+        batch_size: int = settings.IMPORT_BATCH_SIZE,
+        on_flush: Optional[Callable[[int], None]] = None,
+        before_commit: Optional[Callable[[], None]] = None,
+        category_resolver: Optional[CategoryResolver] = None
+    ):
+        self.db = db
+        self.author_id = author_id
+        self.test_id = test_id
+        self.sort_order = start_sort_order
+        self.batch_size = batch_size
+        # Вызывается после записи каждой пачки с номером последней строки в ней
+        self.on_flush = on_flush
+        # Вызывается перед коммитом пачки; WriteAborted откатывает пачку и прекращает импорт
+        self.before_commit = before_commit
+        # Разрешает category_id по имени категории из строки (см. add(category=...))
+        self.category_resolver = category_resolver
+        self._pending: List[dict] = []
+        # Успешно записанные строки: row_number, question_id, reused и данные для отчета
+        self.imported: List[dict] = []
+        self.errors: List[str] = []
+        # Отпечатки, уже разрешенные в этом импорте -> id вопроса
+        self._known: Dict[str, int] = {}
+        # Вопросы, уже входящие в тест (повторно не связываем)
+        self._linked = set()
+        if test_id is not None:
+            self._linked = {
+                question_id for (question_id,) in db.query(models.TestQuestion.question_id).filter(
+                    models.TestQuestion.test_id == test_id
+                ).all()
+            }
+
+    def add(self, row_number: int, fields: Dict[str, Any], options: List[Dict[str, Any]],
+            points: Optional[int] = None, summary: Optional[dict] = None,
+            category: Optional[str] = None, label: Optional[str] = None) -> None:
+        item = {
+            "row_number": row_number,
+            "label": label or f"Строка {row_number}",
+            "category": category,
+            "fields": fields,
+            "options": options,
+            "points": points if points is not None else fields.get("points", 1),
+            "summary": summary,
+            "fingerprint": question_fingerprint(
+                fields["question_text"],
+                fields["answer_type_id"],
+                [(option["option_text"], option["is_correct"]) for option in options],
+                fields.get("correct_answer")
+            )
+        }
+        if self.test_id is not None:
+            self.sort_order += 1
+            item["sort_order"] = self.sort_order
+
+        self._pending.append(item)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        try:
+            self._write(batch)
+            self._commit()
+            self._mark_imported(batch)
+        except WriteAborted:
+            self.db.rollback()
+            raise
+        except Exception as e:
+            self.db.rollback()
+            print(f"⚠️ Пачка из {len(batch)} строк не записалась ({e}), повторяем построчно")
+
+            for item in batch:
+                try:
+                    self._write([item])
+                    self._commit()
+                    self._mark_imported([item])
+                except WriteAborted:
+                    self.db.rollback()
+                    raise
+                except Exception as e:
+                    self.db.rollback()
+                    self.errors.append(f"{item['label']}: {str(e)}")
+
+        if self.on_flush is not None:
+            self.on_flush(batch[-1]["row_number"])
+
+    def _commit(self) -> None:
+        if self.before_commit is not None:
+            self.before_commit()
+        self.db.commit()
+
+    def _find_existing(self, fingerprints: List[str]) -> Dict[str, int]:
+        """Вопросы автора импорта с такими отпечатками, одним запросом.
+
+        Чужие вопросы не переиспользуем: автор не может их править, а
+        импорт не должен открывать доступ к чужому банку.
+        """
+        if not fingerprints:
+            return {}
+        return dict(self.db.query(
+            models.Question.fingerprint,
+            func.min(models.Question.id)
+        ).filter(
+            models.Question.author_id == self.author_id,
+            models.Question.fingerprint.in_(fingerprints),
+            models.Question.is_active == True
+        ).group_by(models.Question.fingerprint).all())
+
+    def _resolve_categories(self, batch: List[dict]) -> None:
+        named = [item for item in batch if item["category"]]
+        if not named:
+            return
+        self.category_resolver.ensure(item["category"] for item in named)
+        for item in named:
+            item["fields"]["category_id"] = self.category_resolver.resolve(item["category"])
+
+    def _write(self, batch: List[dict]) -> None:
+        if self.category_resolver is not None:
+            self._resolve_categories(batch)
+
+        known = dict(self._known)
+        known.update(self._find_existing(
+            list({item["fingerprint"] for item in batch} - set(known))
+        ))
+
+        # Новые вопросы; повтор внутри пачки ссылается на первое вхождение
+        new_items = []
+        first_by_fingerprint = {}
+        for item in batch:
+            fingerprint = item["fingerprint"]
+            item["reused"] = fingerprint in known or fingerprint in first_by_fingerprint
+            if not item["reused"]:
+                first_by_fingerprint[fingerprint] = item
+                new_items.append(item)
+
+        if new_items:
+            question_ids = self.db.execute(
+                insert(models.Question).returning(models.Question.id, sort_by_parameter_order=True),
+                [
+                    {**item["fields"], "author_id": self.author_id, "fingerprint": item["fingerprint"]}
+                    for item in new_items
+                ]
+            ).scalars().all()
+            for item, question_id in zip(new_items, question_ids):
+                known[item["fingerprint"]] = question_id
+
+        option_rows = []
+        test_question_rows = []
+        linked = set(self._linked)
+        for item in batch:
+            question_id = known[item["fingerprint"]]
+            item["question_id"] = question_id
+            if not item["reused"]:
+                option_rows.extend({**option, "question_id": question_id} for option in item["options"])
+            if self.test_id is not None and question_id not in linked:
+                linked.add(question_id)
+                test_question_rows.append({
+                    "test_id": self.test_id,
+                    "question_id": question_id,
+                    "points": item["points"],
+                    "sort_order": item["sort_order"]
+                })
+
+        if option_rows:
+            self.db.execute(insert(models.AnswerOption), option_rows)
+        if test_question_rows:
+            # Уникальный индекс (test_id, question_id): связь, добавленная
+            # параллельно (или прошлой попыткой задачи), не ломает пачку
+            self.db.execute(
+                upsert_insert(self.db)(models.TestQuestion.__table__).on_conflict_do_nothing(
+                    index_elements=["test_id", "question_id"]
+                ),
+                test_question_rows
+            )
+            answer_keys.mark_test_changed(self.db, self.test_id)
+
+    def _mark_imported(self, batch: List[dict]) -> None:
+        for item in batch:
+            self._known[item["fingerprint"]] = item["question_id"]
+            self._linked.add(item["question_id"])
+            self.imported.append({
+                "row_number": item["row_number"],
+                "question_id": item["question_id"],
+                "reused": item["reused"],
+                "summary": item["summary"]
+            })
+
+    def finish(self) -> None:
+        self.flush()
+
+    @property
+    def imported_count(self) -> int:
+        return len(self.imported)
+
+    @property
+    def new_count(self) -> int:
+        return sum(1 for item in self.imported if not item["reused"])
+
+    @property
+    def reused_count(self) -> int:
+        return sum(1 for item in self.imported if item["reused"])
+
+    @property
+    def question_ids(self) -> List[int]:
+        return list(dict.fromkeys(item["question_id"] for item in self.imported))
+
+
+class ImportStats:
+    """Счетчики прохода по файлу (строки с ошибками разбора сюда же)"""
+
+    def __init__(self):
+        self.total_rows = 0
+        # Номер последней пройденной строки файла
+        self.last_row = 0
+        self.errors: List[str] = []
+
+
+def import_records(
+    db: Session,
+    records: Iterator[Dict[str, Any]],
+    writer: BulkQuestionWriter,
+    stats: ImportStats,
+    category_id: Optional[int] = None
+) -> None:
+    """Передать нормализованные строки файла в writer.
+
+    category_id задан - все вопросы в эту категорию, иначе категория
+    берется из строки (и создается при отсутствии).
+    """
+    if category_id is None and writer.category_resolver is None:
+        writer.category_resolver = CategoryResolver(db)
+
+    for record in records:
+        stats.total_rows += 1
+        row_num = stats.last_row = record['row_number']
+        label = file_importer.row_label(record)
+        try:
+            row_errors = file_importer.import_errors(record)
+            if row_errors:
+                stats.errors.extend(f"{label}: {error}" for error in row_errors)
+                continue
+
+            writer.add(
+                row_num,
+                file_importer.question_fields(record, category_id),
+                file_importer.build_answer_options(record),
+                points=record['points'],
+                summary={
+                    'question_text': record['question_text'],
+                    'question_type': record['question_type'],
+                    'answer_type': record['answer_type'],
+                    'difficulty': record['difficulty'],
+                    'points': record['points']
+                },
+                category=None if category_id is not None else (record['category'] or file_importer.DEFAULT_CATEGORY),
+                label=label
+            )
+
+        except WriteAborted:
+            raise
+        except Exception as e:
+            db.rollback()
+            error_msg = f"{label}: {str(e)}"
+            print(f"❌ Ошибка: {error_msg}")
+            stats.errors.append(error_msg)
+
+    writer.finish()
+
+
+def next_sort_order(db: Session, test_id: int) -> int:
+    """Максимальный sort_order вопросов теста"""
+    return db.query(func.max(models.TestQuestion.sort_order)).filter(
+        models.TestQuestion.test_id == test_id
+    ).scalar() or 0
@@ -0,0 +1,126 @@
+"""Непрозрачные refresh-токены с ротацией.
+
+Токен - случайная строка; в базе хранится только его SHA-256 (токен и так
+высокоэнтропийный, медленный Argon2 здесь не нужен). Каждое обновление
+выдает новый токен и гасит предъявленный. Повторное предъявление погашенного
+токена означает утечку: отзывается вся цепочка (family). Исключение -
+повтор в течение REFRESH_REUSE_GRACE_SECONDS после ротации: так бывает, когда
+две вкладки обновляют токен одновременно, и такой запрос получает 409.
+"""
+import hashlib
+import secrets
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import settings
+
+
+class RefreshTokenConflict(Exception):
+    """Токен только что обменян параллельным запросом"""
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def issue_refresh_token(db: Session, user_id: int, family_id: Optional[str] = None) -> str:
+    """Создать refresh-токен (без commit), вернуть его открытое значение"""
+    token = secrets.token_urlsafe(48)
+    db.add(models.RefreshToken(
+        user_id=user_id,
+        token_hash=hash_token(token),
+        family_id=family_id or secrets.token_hex(16),
+        expires_at=datetime.utcnow() + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+    ))
+    return token
+
+
+def start_refresh_session(db: Session, user_id: int) -> str:
+    """Новая цепочка refresh-токенов при входе (с commit)"""
+    token = issue_refresh_token(db, user_id)
+    db.commit()
+    return token
+
+
+def revoke_family(db: Session, family_id: str, reason: str) -> int:
+    return db.query(models.RefreshToken).filter(
+        models.RefreshToken.family_id == family_id,
+        models.RefreshToken.revoked_at.is_(None)
+    ).update({"revoked_at": datetime.utcnow(), "revoked_reason": reason}, synchronize_session=False)
+
+
+def revoke_user_tokens(db: Session, user_id: int, reason: str) -> int:
+    return db.query(models.RefreshToken).filter(
+        models.RefreshToken.user_id == user_id,
+        models.RefreshToken.revoked_at.is_(None)
+    ).update({"revoked_at": datetime.utcnow(), "revoked_reason": reason}, synchronize_session=False)
+
+
+def rotate_refresh_token(db: Session, token: str) -> Optional[Tuple[models.User, str]]:
+    """Обменять refresh-токен на новый; вернуть (пользователь, новый токен) или None.
+
+    Фиксирует транзакцию сам: отзыв цепочки при повторном использовании
+    должен сохраниться, даже если клиент получит 401. Если токен обменян
+    параллельным запросом только что, бросает RefreshTokenConflict.
+    """
+    stored = db.query(models.RefreshToken).filter(
+        models.RefreshToken.token_hash == hash_token(token)
+    ).first()
+    if not stored:
+        return None
+
+    if stored.revoked_at is not None:
+        if stored.revoked_reason == "rotated":
+            grace = timedelta(seconds=settings.REFRESH_REUSE_GRACE_SECONDS)
+            if stored.revoked_at.replace(tzinfo=None) + grace >= datetime.utcnow():
+                raise RefreshTokenConflict()
+            print(f"🚨 Повторное использование refresh-токена, отзываем цепочку {stored.family_id}")
+            revoke_family(db, stored.family_id, "reused")
+            db.commit()
+        return None
+
+    if stored.expires_at.replace(tzinfo=None) < datetime.utcnow():
+        return None
+
+    user = db.query(models.User).filter(models.User.id == stored.user_id).first()
+    if not user or not user.is_active:
+        return None
+
+    # Гасим условно: из двух параллельных обновлений одним токеном пройдет одно
+    rotated = db.query(models.RefreshToken).filter(
+        models.RefreshToken.id == stored.id,
+        models.RefreshToken.revoked_at.is_(None)
+    ).update({"revoked_at": datetime.utcnow(), "revoked_reason": "rotated"}, synchronize_session=False)
+    if not rotated:
+        db.rollback()
+        raise RefreshTokenConflict()
+
+    new_token = issue_refresh_token(db, user.id, family_id=stored.family_id)
+    db.commit()
+    return user, new_token
+
+
+def revoke_refresh_token(db: Session, token: str, reason: str = "logout") -> bool:
+    """Отозвать цепочку, к которой относится токен (выход на одном устройстве)"""
+    stored = db.query(models.RefreshToken).filter(
+        models.RefreshToken.token_hash == hash_token(token)
+    ).first()
+    if not stored:
+        return False
+    revoke_family(db, stored.family_id, reason)
+    db.commit()
+    return True
+
+
+def purge_expired(db: Session, older_than_days: int = 7) -> int:
+    """Удалить истекшие и давно отозванные токены"""
+    threshold = datetime.utcnow() - timedelta(days=older_than_days)
+    deleted = db.query(models.RefreshToken).filter(
+        (models.RefreshToken.expires_at < datetime.utcnow()) |
+        (models.RefreshToken.revoked_at < threshold)
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
@@ -0,0 +1,344 @@
+"""Замороженные определения таблиц и индексов для миграций.
+
+Миграция должна создавать ту схему, которая была на момент ее написания,
+а не текущую из models.py: иначе 0001 на новой базе создаст колонки и
+индексы поздних миграций, и те будут вести себя иначе, чем на старых базах.
+Поэтому здесь таблицы описаны так, как они выглядели в своей миграции.
+Уже примененные определения не меняют: изменения схемы - новой миграцией.
+"""
+from sqlalchemy import (
+    Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, MetaData, String, Table, Text,
+    UniqueConstraint,
+)
+from sqlalchemy.sql import func
+
+metadata = MetaData()
+
+# ---------------------------------------------------------------- 0001 initial schema
+
+roles = Table(
+    "roles", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String(50), unique=True, nullable=False),
+    Column("description", String(255)),
+    Column("permissions", Text),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+users = Table(
+    "users", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("username", String(50), unique=True, nullable=False),
+    Column("email", String(100), unique=True),
+    Column("password_hash", String(255), nullable=False),
+    Column("role_id", Integer, ForeignKey("roles.id"), nullable=False),
+    Column("avatar_url", String(255)),
+    Column("first_name", String(100)),
+    Column("last_name", String(100)),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Column("last_login", DateTime(timezone=True)),
+    Column("is_active", Boolean),
+)
+
+test_access = Table(
+    "test_access", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("test_id", Integer, ForeignKey("tests.id"), nullable=False),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("access_level", String(20), nullable=False),
+    Column("granted_by", Integer, ForeignKey("users.id")),
+    Column("granted_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+study_groups = Table(
+    "study_groups", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String(100), nullable=False),
+    Column("description", Text),
+    Column("invite_code", String(20), unique=True, nullable=False),
+    Column("created_by", Integer, ForeignKey("users.id"), nullable=False),
+    Column("subject", String(100)),
+    Column("academic_year", String(20)),
+    Column("max_students", Integer),
+    Column("is_active", Boolean),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Column("is_public", Boolean),
+    Column("password", String(255)),
+    Column("require_approval", Boolean),
+)
+
+group_members = Table(
+    "group_members", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("group_id", Integer, ForeignKey("study_groups.id"), nullable=False),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("joined_at", DateTime(timezone=True), server_default=func.now()),
+    Column("role", String(20)),
+    Column("is_active", Boolean),
+)
+
+categories = Table(
+    "categories", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String(50), unique=True, nullable=False),
+    Column("description", String(255)),
+    Column("color", String(7)),
+    Column("icon", String(100)),
+    Column("parent_id", Integer, ForeignKey("categories.id")),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+question_types = Table(
+    "question_types", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String(50), unique=True, nullable=False),
+    Column("description", String(255)),
+    Column("template", Text),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+answer_types = Table(
+    "answer_types", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String(50), unique=True, nullable=False),
+    Column("description", String(255)),
+    Column("template", Text),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+questions = Table(
+    "questions", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("question_text", Text, nullable=False),
+    Column("type_id", Integer, ForeignKey("question_types.id"), nullable=False),
+    Column("answer_type_id", Integer, ForeignKey("answer_types.id"), nullable=False),
+    Column("category_id", Integer, ForeignKey("categories.id"), nullable=False),
+    Column("author_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("difficulty", Integer),
+    Column("explanation", Text),
+    Column("time_limit", Integer),
+    Column("points", Integer),
+    Column("media_url", Text),
+    Column("sources", Text),
+    Column("allow_latex", Boolean),
+    Column("blackbox_description", Text),
+    Column("correct_answer", Text),
+    Column("answer_requirements", Text),
+    Column("is_active", Boolean),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Column("updated_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+answer_options = Table(
+    "answer_options", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("question_id", Integer, ForeignKey("questions.id"), nullable=False),
+    Column("option_text", Text, nullable=False),
+    Column("is_correct", Boolean),
+    Column("sort_order", Integer),
+)
+
+tests = Table(
+    "tests", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("title", String(200), nullable=False),
+    Column("description", Text),
+    Column("author_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("time_limit", Integer),
+    Column("max_attempts", Integer),
+    Column("show_results", String(20)),
+    Column("shuffle_questions", Boolean),
+    Column("shuffle_answers", Boolean),
+    Column("passing_score", Integer),
+    Column("is_active", Boolean),
+    Column("is_public", Boolean),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Column("updated_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+test_questions = Table(
+    "test_questions", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("test_id", Integer, ForeignKey("tests.id"), nullable=False),
+    Column("question_id", Integer, ForeignKey("questions.id"), nullable=False),
+    Column("sort_order", Integer),
+    Column("points", Integer),
+)
+
+test_assignments = Table(
+    "test_assignments", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("test_id", Integer, ForeignKey("tests.id"), nullable=False),
+    Column("group_id", Integer, ForeignKey("study_groups.id")),
+    Column("assigned_by", Integer, ForeignKey("users.id"), nullable=False),
+    Column("start_date", DateTime(timezone=True)),
+    Column("end_date", DateTime(timezone=True)),
+    Column("time_limit", Integer),
+    Column("max_attempts", Integer),
+    Column("passing_score", Integer),
+    Column("settings", Text),
+    Column("is_active", Boolean),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+test_sessions = Table(
+    "test_sessions", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("test_id", Integer, ForeignKey("tests.id"), nullable=False),
+    Column("assignment_id", Integer, ForeignKey("test_assignments.id")),
+    Column("started_at", DateTime(timezone=True), server_default=func.now()),
+    Column("finished_at", DateTime(timezone=True)),
+    Column("time_spent", Integer),
+    Column("score", Integer),
+    Column("max_score", Integer),
+    Column("percentage", Integer),
+    Column("is_completed", Boolean),
+    Column("attempt_number", Integer),
+)
+
+user_answers = Table(
+    "user_answers", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("session_id", Integer, ForeignKey("test_sessions.id"), nullable=False),
+    Column("question_id", Integer, ForeignKey("questions.id"), nullable=False),
+    Column("answer_text", Text),
+    Column("selected_options", Text),
+    Column("is_correct", Boolean),
+    Column("points_earned", Integer),
+    Column("time_spent", Integer),
+    Column("answered_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+user_statistics = Table(
+    "user_statistics", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("category_id", Integer, ForeignKey("categories.id"), nullable=False),
+    Column("tests_completed", Integer),
+    Column("questions_answered", Integer),
+    Column("correct_answers", Integer),
+    Column("total_points", Integer),
+    Column("average_score", Float),
+    Column("best_score", Integer),
+    Column("last_activity", DateTime(timezone=True)),
+)
+
+# ---------------------------------------------------------------- 0002 statistics aggregates and outbox
+
+member_assignment_best = Table(
+    "member_assignment_best", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("assignment_id", Integer, ForeignKey("test_assignments.id"), nullable=False),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("session_id", Integer, ForeignKey("test_sessions.id"), nullable=False),
+    Column("score", Integer),
+    Column("max_score", Integer),
+    Column("percentage", Float),
+    Column("finished_at", DateTime(timezone=True)),
+    Column("updated_at", DateTime(timezone=True), server_default=func.now()),
+    UniqueConstraint("assignment_id", "user_id", name="uq_member_assignment_best"),
+)
+
+assignment_summaries = Table(
+    "assignment_summaries", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("assignment_id", Integer, ForeignKey("test_assignments.id"), unique=True, nullable=False),
+    Column("completed_count", Integer),
+    Column("score_sum", Float),
+    Column("histogram", Text, nullable=False),
+    Column("updated_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+statistics_outbox = Table(
+    "statistics_outbox", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("session_id", Integer, ForeignKey("test_sessions.id"), unique=True, nullable=False),
+    Column("event_type", String(50), nullable=False),
+    Column("status", String(20), nullable=False, index=True),
+    Column("attempts", Integer),
+    Column("last_error", Text),
+    Column("available_at", DateTime(timezone=True), server_default=func.now()),
+    Column("locked_at", DateTime(timezone=True)),
+    Column("processed_at", DateTime(timezone=True)),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+# ---------------------------------------------------------------- 0003 composite indexes for hot filters
+
+# Индексы создаются миграцией, а не вместе с таблицами (create_all их не видит)
+_hot_metadata = MetaData()
+
+
+def _columns_of(table: Table, *names: str) -> Table:
+    """Копия таблицы только с нужными колонками - чтобы индекс не попал в create_all"""
+    return Table(table.name, _hot_metadata, *[Column(name, table.c[name].type) for name in names])
+
+
+HOT_INDEXES_0003 = [
+    Index("ix_test_sessions_user_test_assignment",
+          *_columns_of(test_sessions, "user_id", "test_id", "assignment_id").c),
+    Index("uq_user_answers_session_question",
+          *_columns_of(user_answers, "session_id", "question_id").c, unique=True),
+    Index("uq_test_questions_test_question",
+          *_columns_of(test_questions, "test_id", "question_id").c, unique=True),
+    Index("ix_group_members_group_user_active",
+          *_columns_of(group_members, "group_id", "user_id", "is_active").c),
+    Index("ix_test_access_test_user",
+          *_columns_of(test_access, "test_id", "user_id").c),
+    Index("uq_user_statistics_user_category",
+          *_columns_of(user_statistics, "user_id", "category_id").c, unique=True),
+    Index("ix_answer_options_question_correct",
+          *_columns_of(answer_options, "question_id", "is_correct").c),
+]
+
+# ---------------------------------------------------------------- 0005 refresh tokens
+
+refresh_tokens = Table(
+    "refresh_tokens", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False, index=True),
+    Column("token_hash", String(64), unique=True, nullable=False),
+    Column("family_id", String(32), nullable=False, index=True),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Column("expires_at", DateTime(timezone=True), nullable=False),
+    Column("revoked_at", DateTime(timezone=True)),
+    Column("revoked_reason", String(20)),
+)
+
+# ---------------------------------------------------------------- 0008 question fingerprint index
+
+_questions_0008 = Table("questions", MetaData(), Column("author_id", Integer), Column("fingerprint", String(64)))
+
+QUESTIONS_FINGERPRINT_INDEX = Index(
+    "ix_questions_author_fingerprint",
+    _questions_0008.c.author_id, _questions_0008.c.fingerprint,
+)
+
+# ---------------------------------------------------------------- 0009 import jobs
+
+import_jobs = Table(
+    "import_jobs", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("author_id", Integer, ForeignKey("users.id"), nullable=False, index=True),
+    Column("test_id", Integer, ForeignKey("tests.id")),
+    Column("category_id", Integer, ForeignKey("categories.id")),
+    Column("filename", String(255), nullable=False),
+    Column("file_path", String(500), nullable=False),
+    Column("status", String(20), nullable=False, index=True),
+    Column("rows_processed", Integer, nullable=False),
+    Column("checkpoint_row", Integer, nullable=False),
+    Column("imported_count", Integer, nullable=False),
+    Column("new_count", Integer, nullable=False),
+    Column("reused_count", Integer, nullable=False),
+    Column("failed_count", Integer, nullable=False),
+    Column("errors", Text),
+    Column("last_error", Text),
+    Column("attempts", Integer),
+    Column("locked_at", DateTime(timezone=True)),
+    Column("started_at", DateTime(timezone=True)),
+    Column("finished_at", DateTime(timezone=True)),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Column("all_sheets", Boolean, nullable=False, server_default="0"),
+    Column("locked_by", String(32)),
+)
@@ -28,6 +28,10 @@ class UserResponse(UserBase):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
 
 class TokenData(BaseModel):
     username: Optional[str] = None
@@ -246,6 +250,25 @@ class UserAnswerResponse(UserAnswerBase):
     class Config:
         from_attributes = True
 
+class UserAnswerBatchCreate(BaseModel):
+    answers: List[UserAnswerCreate]
+
+class UserAnswerBatchItem(BaseModel):
+    question_id: int
+    status: str  # created, updated, error
+    is_correct: bool = False
+    points_earned: int = 0
+    error: Optional[str] = None
+
+class UserAnswerBatchResponse(BaseModel):
+    session_id: int
+    saved_count: int
+    failed_count: int
+    score: int
+    max_score: int
+    percentage: float
+    results: List[UserAnswerBatchItem]
+
 class TestSessionBase(BaseModel):
     test_id: int
     assignment_id: Optional[int] = None
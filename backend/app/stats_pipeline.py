@@ -0,0 +1,216 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from . import models, user_stats
+from .config import settings
+from .database import SessionLocal
+
+# Сколько событий забирать из очереди за один проход
+CLAIM_BATCH_SIZE = 50
+# Через сколько считать событие "processing" зависшим (воркер упал)
+STALE_LOCK_TIMEOUT = timedelta(minutes=5)
+# Через сколько повторить событие, упавшее на конфликте блокировок
+LOCK_RETRY_DELAY = timedelta(seconds=1)
+LOCK_ERROR_MARKERS = ("database is locked", "deadlock detected", "could not serialize access")
+
+
+def enqueue_session_completed(db: Session, session: models.TestSession) -> None:
+    """Поставить событие завершения сессии в очередь (в транзакции вызывающего кода).
+
+    Событие на сессию одно: повторный вызов ничего не добавляет.
+    """
+    exists = db.query(models.StatisticsOutbox.id).filter(
+        models.StatisticsOutbox.session_id == session.id
+    ).first()
+    if exists:
+        return
+
+    db.add(models.StatisticsOutbox(
+        session_id=session.id,
+        event_type='session_completed',
+        status='pending',
+        attempts=0,
+        available_at=datetime.utcnow()
+    ))
+
+
+def handle_session_completed(db: Session, session_id: int) -> None:
+    """Пересчитать статистику пользователя по завершенной сессии (без commit).
+
+    Сводка назначения обновляется синхронно при завершении сессии
+    (group_stats.record_completed_session), здесь ее нет.
+    """
+    session = db.query(models.TestSession).filter(
+        models.TestSession.id == session_id
+    ).first()
+    if not session or not session.is_completed:
+        return
+
+    user_stats.apply_user_statistics(db, session.user_id, session.test_id, session)
+
+
+def is_lock_conflict(error: Exception) -> bool:
+    """Ошибка из-за конкурентной записи (SQLite busy, deadlock/serialization в PostgreSQL)"""
+    if not isinstance(error, OperationalError):
+        return False
+    message = str(error).lower()
+    return any(marker in message for marker in LOCK_ERROR_MARKERS)
+
+
+def process_event(event_id: int) -> bool:
+    """Обработать одно событие; результат и отметка о нем фиксируются одной транзакцией"""
+    db = SessionLocal()
+    try:
+        event = db.query(models.StatisticsOutbox).filter(
+            models.StatisticsOutbox.id == event_id
+        ).first()
+        if not event or event.status == 'done':
+            return True
+
+        try:
+            handle_session_completed(db, event.session_id)
+            event.status = 'done'
+            event.processed_at = datetime.utcnow()
+            event.last_error = None
+            db.commit()
+            return True
+        except Exception as e:
+            db.rollback()
+            print(f"❌ Ошибка обработки события статистики {event_id}: {e}")
+
+            event = db.query(models.StatisticsOutbox).filter(
+                models.StatisticsOutbox.id == event_id
+            ).first()
+            event.last_error = str(e)[:1000]
+            event.locked_at = None
+            if is_lock_conflict(e):
+                # Конфликт блокировок с другим воркером - не ошибка события, попытку не тратим
+                event.status = 'pending'
+                event.available_at = datetime.utcnow() + LOCK_RETRY_DELAY
+                db.commit()
+                return False
+
+            event.attempts = (event.attempts or 0) + 1
+            if event.attempts >= settings.STATS_MAX_ATTEMPTS:
+                event.status = 'failed'
+            else:
+                event.status = 'pending'
+                event.available_at = datetime.utcnow() + timedelta(seconds=2 ** event.attempts)
+            db.commit()
+            return False
+    finally:
+        db.close()
+
+
+def claim_events(db: Session, limit: int = CLAIM_BATCH_SIZE) -> List[int]:
+    """Забрать готовые к обработке события (атомарно pending -> processing)"""
+    now = datetime.utcnow()
+
+    # Возвращаем в очередь события, зависшие после падения воркера
+    db.query(models.StatisticsOutbox).filter(
+        models.StatisticsOutbox.status == 'processing',
+        models.StatisticsOutbox.locked_at < now - STALE_LOCK_TIMEOUT
+    ).update({"status": 'pending', "locked_at": None}, synchronize_session=False)
+
+    candidates = db.query(models.StatisticsOutbox.id).filter(
+        models.StatisticsOutbox.status == 'pending',
+        models.StatisticsOutbox.available_at <= now
+    ).order_by(models.StatisticsOutbox.id).limit(limit).all()
+
+    claimed = []
+    for (event_id,) in candidates:
+        updated = db.query(models.StatisticsOutbox).filter(
+            models.StatisticsOutbox.id == event_id,
+            models.StatisticsOutbox.status == 'pending'
+        ).update({"status": 'processing', "locked_at": now}, synchronize_session=False)
+        if updated:
+            claimed.append(event_id)
+
+    db.commit()
+    return claimed
+
+
+class StatisticsPipeline:
+    """Диспетчер очереди статистики и пул воркеров внутри процесса"""
+
+    def __init__(self, workers: int, poll_interval: float):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._executor = None
+        self._thread = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.workers <= 0 or self.is_running:
+            return
+        self._stopping.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="stats-worker")
+        self._thread = threading.Thread(target=self._run, name="stats-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def notify(self) -> None:
+        """Разбудить диспетчер после commit нового события"""
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                db = SessionLocal()
+                try:
+                    event_ids = claim_events(db)
+                finally:
+                    db.close()
+
+                if event_ids:
+                    list(self._executor.map(process_event, event_ids))
+                    continue
+            except Exception as e:
+                print(f"❌ Ошибка диспетчера статистики: {e}")
+
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+
+pipeline = StatisticsPipeline(settings.STATS_WORKERS, settings.STATS_POLL_INTERVAL)
+
+
+def dispatch(db: Session, session: models.TestSession) -> None:
+    """После commit: отдать событие воркерам или, без воркеров, обработать сразу"""
+    if pipeline.is_running:
+        pipeline.notify()
+        return
+
+    event = db.query(models.StatisticsOutbox.id).filter(
+        models.StatisticsOutbox.session_id == session.id
+    ).first()
+    if not event:
+        return
+
+    claimed = db.query(models.StatisticsOutbox).filter(
+        models.StatisticsOutbox.id == event.id,
+        models.StatisticsOutbox.status == 'pending'
+    ).update({"status": 'processing', "locked_at": datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+
+    if claimed:
+        process_event(event.id)
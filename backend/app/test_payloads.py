@@ -0,0 +1,344 @@
+import hashlib
+import json
+import random
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import settings
+
+# Виды сериализованных представлений теста, которые лежат в кэше
+PAYLOAD_KINDS = ("full", "full_hidden", "student")
+# Поля полного представления, раскрывающие ответ на вопрос
+ANSWER_KEY_FIELDS = ("correct_answer", "explanation")
+
+
+class InMemoryPayloadBackend:
+    """LRU-кэш сериализованных payload'ов в памяти процесса.
+
+    Любой другой backend (например, Redis) должен реализовать
+    те же методы get / set / delete.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: "OrderedDict[str, Tuple[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[str, Any]]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Tuple[str, Any]) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+
+_backend = InMemoryPayloadBackend(settings.TEST_PAYLOAD_CACHE_SIZE)
+
+
+def set_backend(backend) -> None:
+    """Подключить внешний backend кэша"""
+    global _backend
+    _backend = backend
+
+
+def _cache_key(kind: str, test_id: int) -> str:
+    return f"test:{test_id}:{kind}"
+
+
+def get_test_version(db: Session, test_id: int) -> Optional[str]:
+    """Версия теста: его updated_at, последний updated_at вопросов и их число"""
+    row = db.query(
+        models.Test.updated_at,
+        func.max(models.Question.updated_at),
+        func.count(models.TestQuestion.id)
+    ).outerjoin(
+        models.TestQuestion,
+        models.TestQuestion.test_id == models.Test.id
+    ).outerjoin(
+        models.Question,
+        models.Question.id == models.TestQuestion.question_id
+    ).filter(
+        models.Test.id == test_id
+    ).group_by(models.Test.id).first()
+
+    if row is None:
+        return None
+
+    test_updated_at, questions_updated_at, questions_count = row
+    return f"{test_id}:{test_updated_at}:{questions_updated_at}:{questions_count}"
+
+
+def make_etag(kind: str, version: str) -> str:
+    digest = hashlib.sha1(f"{kind}:{version}".encode("utf-8")).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def serialize(payload) -> bytes:
+    """Сериализовать как JSONResponse в FastAPI"""
+    return json.dumps(
+        jsonable_encoder(payload),
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":")
+    ).encode("utf-8")
+
+
+def get_or_build(kind: str, test_id: int, version: str, build: Callable[[], Any]) -> Any:
+    """Вернуть закэшированный payload для версии теста, собрав его при промахе"""
+    key = _cache_key(kind, test_id)
+    cached = _backend.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    payload = build()
+    _backend.set(key, (version, payload))
+    return payload
+
+
+def invalidate_test(test_id: int) -> None:
+    """Сбросить все закэшированные представления теста"""
+    for kind in PAYLOAD_KINDS:
+        _backend.delete(_cache_key(kind, test_id))
+
+
+def build_full_payload(test: models.Test) -> dict:
+    """Полное представление теста с вопросами и ключами ответов"""
+    test_data = {
+        "id": test.id,
+        "title": test.title,
+        "description": test.description,
+        "author_id": test.author_id,
+        "time_limit": test.time_limit,
+        "max_attempts": test.max_attempts,
+        "show_results": test.show_results,
+        "shuffle_questions": test.shuffle_questions,
+        "shuffle_answers": test.shuffle_answers,
+        "passing_score": test.passing_score,
+        "is_public": test.is_public,
+        "is_active": test.is_active,
+        "created_at": test.created_at,
+        "updated_at": test.updated_at,
+        "questions": []
+    }
+
+    for tq in test.questions:
+        question = tq.question
+        if not question:
+            continue
+
+        type_data = None
+        if question.type:
+            type_data = {
+                "id": question.type.id,
+                "name": question.type.name,
+                "description": question.type.description
+            }
+
+        answer_type_data = None
+        if question.answer_type:
+            answer_type_data = {
+                "id": question.answer_type.id,
+                "name": question.answer_type.name,
+                "description": question.answer_type.description
+            }
+
+        test_data["questions"].append({
+            "id": question.id,
+            "question_text": question.question_text,
+            "type": type_data,
+            "answer_type": answer_type_data,
+            "answer_type_id": question.answer_type_id,  # Важно!
+            "category_id": question.category_id,
+            "difficulty": question.difficulty,
+            "explanation": question.explanation or "",
+            "time_limit": question.time_limit or 60,
+            "points": tq.points or question.points or 1,
+            "media_url": question.media_url or "",
+            "sources": question.sources or "",
+            "allow_latex": question.allow_latex or False,
+            "blackbox_description": question.blackbox_description or "",
+            "correct_answer": question.correct_answer or "",
+            "answer_requirements": question.answer_requirements or "",
+            "answer_options": [
+                {
+                    "id": option.id,
+                    "option_text": option.option_text,
+                    "is_correct": option.is_correct,
+                    "sort_order": option.sort_order
+                }
+                for option in question.answer_options
+            ],
+            "test_question_id": tq.id
+        })
+
+    return test_data
+
+
+def hide_answer_keys(payload: dict, visible_question_ids=()) -> dict:
+    """Убрать из полного представления ключи ответов (кроме вопросов visible_question_ids)"""
+    visible_question_ids = set(visible_question_ids)
+    for question in payload["questions"]:
+        if question["id"] in visible_question_ids:
+            continue
+        for field in ANSWER_KEY_FIELDS:
+            question.pop(field, None)
+        for option in question["answer_options"]:
+            option.pop("is_correct", None)
+    return payload
+
+
+# ========== ПРЕДСТАВЛЕНИЕ ДЛЯ ТЕСТИРУЕМОГО ==========
+
+def _open_object(data: dict, field: str) -> bytes:
+    """Сериализовать dict, оставив объект открытым для дописывания массива field"""
+    return serialize(data)[:-1] + f',"{field}":['.encode("utf-8")
+
+
+def compile_student_payload(test: models.Test) -> dict:
+    """Представление теста без ключей ответов, разложенное на готовые JSON-фрагменты.
+
+    Каждый вопрос и вариант сериализуется один раз на версию теста, а порядок
+    вопросов и вариантов при выдаче меняется простой перестановкой фрагментов.
+    """
+    test_data = {
+        "id": test.id,
+        "title": test.title,
+        "description": test.description,
+        "author_id": test.author_id,
+        "time_limit": test.time_limit,
+        "max_attempts": test.max_attempts,
+        "show_results": test.show_results,
+        "shuffle_questions": test.shuffle_questions,
+        "shuffle_answers": test.shuffle_answers,
+        "passing_score": test.passing_score,
+        "is_public": test.is_public,
+        "is_active": test.is_active,
+        "created_at": test.created_at,
+        "updated_at": test.updated_at
+    }
+
+    questions = []
+    for tq in test.questions:
+        question = tq.question
+        if not question:
+            continue
+
+        question_data = {
+            "id": question.id,
+            "question_text": question.question_text,
+            "type": {
+                "id": question.type.id,
+                "name": question.type.name,
+                "description": question.type.description
+            } if question.type else None,
+            "answer_type": {
+                "id": question.answer_type.id,
+                "name": question.answer_type.name,
+                "description": question.answer_type.description
+            } if question.answer_type else None,
+            "answer_type_id": question.answer_type_id,
+            "category_id": question.category_id,
+            "difficulty": question.difficulty,
+            "time_limit": question.time_limit or 60,
+            "points": tq.points or question.points or 1,
+            "media_url": question.media_url or "",
+            "sources": question.sources or "",
+            "allow_latex": question.allow_latex or False,
+            "blackbox_description": question.blackbox_description or "",
+            "answer_requirements": question.answer_requirements or "",
+            "test_question_id": tq.id
+        }
+
+        questions.append({
+            "id": question.id,
+            "head": _open_object(question_data, "answer_options"),
+            "options": [
+                serialize({
+                    "id": option.id,
+                    "option_text": option.option_text,
+                    "sort_order": option.sort_order
+                })
+                for option in question.answer_options
+            ],
+            "option_ids": [option.id for option in question.answer_options],
+            # Варианты черного ящика не перемешиваем (как и на фронтенде)
+            "shuffle_options": not (question.type and question.type.name == "blackbox")
+        })
+
+    return {
+        "head": _open_object(test_data, "questions"),
+        "questions": questions,
+        "shuffle_questions": bool(test.shuffle_questions),
+        "shuffle_answers": bool(test.shuffle_answers)
+    }
+
+
+def session_rng(session_id: int) -> random.Random:
+    """Генератор, дающий один и тот же порядок для сессии при каждом запросе"""
+    return random.Random(f"{settings.SECRET_KEY}:session:{session_id}")
+
+
+def _arrange(compiled: dict, rng: Optional[random.Random]):
+    """Порядок вопросов и индексов вариантов; O(n), без обращений к базе"""
+    questions = compiled["questions"]
+    if rng is not None and compiled["shuffle_questions"]:
+        questions = questions[:]
+        rng.shuffle(questions)
+
+    arranged = []
+    for question in questions:
+        option_order = list(range(len(question["options"])))
+        if rng is not None and compiled["shuffle_answers"] and question["shuffle_options"]:
+            rng.shuffle(option_order)
+        arranged.append((question, option_order))
+
+    return arranged
+
+
+def session_order(compiled: dict, session_id: int) -> list:
+    """Порядок вопросов и вариантов, который видел тестируемый в сессии"""
+    return [
+        {
+            "question_id": question["id"],
+            "option_ids": [question["option_ids"][i] for i in option_order]
+        }
+        for question, option_order in _arrange(compiled, session_rng(session_id))
+    ]
+
+
+def render_student_payload(compiled: dict, rng: Optional[random.Random] = None) -> bytes:
+    """Собрать JSON из фрагментов; при переданном rng применить перемешивание теста"""
+    parts = [compiled["head"]]
+    for index, (question, option_order) in enumerate(_arrange(compiled, rng)):
+        if index:
+            parts.append(b",")
+        parts.append(question["head"])
+        parts.append(b",".join(question["options"][i] for i in option_order))
+        parts.append(b"]}")
+
+    parts.append(b"]}")
+    return b"".join(parts)
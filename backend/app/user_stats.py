@@ -0,0 +1,111 @@
+from datetime import datetime
+
+from sqlalchemy import and_, case, func
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import upsert_insert
+
+
+def collect_category_stats(db: Session, test_id: int, session_id: int) -> dict:
+    """Статистика сессии по категориям одним запросом TestQuestion -> Question -> UserAnswer"""
+    rows = db.query(
+        models.Question.category_id,
+        func.count(models.TestQuestion.id).label("questions_count"),
+        func.count(models.UserAnswer.id).label("questions_answered"),
+        func.sum(case((models.UserAnswer.is_correct == True, 1), else_=0)).label("correct_answers"),
+        func.sum(case(
+            (models.UserAnswer.is_correct == True, func.coalesce(models.UserAnswer.points_earned, 0)),
+            else_=0
+        )).label("total_points")
+    ).select_from(
+        models.TestQuestion
+    ).join(
+        models.Question,
+        models.Question.id == models.TestQuestion.question_id
+    ).outerjoin(
+        models.UserAnswer,
+        and_(
+            models.UserAnswer.question_id == models.Question.id,
+            models.UserAnswer.session_id == session_id
+        )
+    ).filter(
+        models.TestQuestion.test_id == test_id,
+        models.Question.category_id.isnot(None)
+    ).group_by(
+        models.Question.category_id
+    ).all()
+
+    return {
+        row.category_id: {
+            "questions_count": row.questions_count,
+            "questions_answered": row.questions_answered or 0,
+            "correct_answers": int(row.correct_answers or 0),
+            "total_points": int(row.total_points or 0)
+        }
+        for row in rows
+    }
+
+
+def apply_user_statistics(db: Session, user_id: int, test_id: int, session) -> None:
+    """Учесть завершенную сессию в статистике пользователя (без commit).
+
+    Постоянное число запросов независимо от размера теста: агрегат по
+    категориям и один INSERT ... ON CONFLICT DO UPDATE на все категории.
+    Счетчики увеличиваются в самой базе (col = col + :x), поэтому параллельные
+    воркеры не затирают обновления друг друга.
+    Фиксирует транзакцию вызывающий код (см. stats_pipeline).
+    """
+    print(f"📈 Обновление статистики для пользователя {user_id}, тест {test_id}")
+
+    category_stats = collect_category_stats(db, test_id, session.id)
+    if not category_stats:
+        return
+
+    now = datetime.utcnow()
+    percentage = session.percentage or 0
+    rows = [
+        {
+            "user_id": user_id,
+            "category_id": category_id,
+            "tests_completed": 1,
+            "questions_answered": stats["questions_answered"],
+            "correct_answers": stats["correct_answers"],
+            "total_points": stats["total_points"],
+            "average_score": (
+                (stats["correct_answers"] / stats["questions_answered"]) * 100
+                if stats["questions_answered"] > 0 else 0
+            ),
+            "best_score": percentage,
+            "last_activity": now
+        }
+        for category_id, stats in category_stats.items()
+    ]
+
+    table = models.UserStatistics.__table__
+    statement = upsert_insert(db)(table).values(rows)
+    excluded = statement.excluded
+
+    questions_answered = func.coalesce(table.c.questions_answered, 0) + excluded.questions_answered
+    correct_answers = func.coalesce(table.c.correct_answers, 0) + excluded.correct_answers
+    best_score = func.coalesce(table.c.best_score, 0)
+
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.category_id],
+        set_={
+            "tests_completed": func.coalesce(table.c.tests_completed, 0) + excluded.tests_completed,
+            "questions_answered": questions_answered,
+            "correct_answers": correct_answers,
+            "total_points": func.coalesce(table.c.total_points, 0) + excluded.total_points,
+            # Пересчитываем средний балл по уже увеличенным счетчикам
+            "average_score": case(
+                (questions_answered > 0, correct_answers * 100.0 / questions_answered),
+                else_=func.coalesce(table.c.average_score, 0)
+            ),
+            # Обновляем лучший результат
+            "best_score": case((best_score < excluded.best_score, excluded.best_score), else_=best_score),
+            "last_activity": excluded.last_activity
+        }
+    ))
+
+    print(f"📊 Статистика: обновлено категорий {len(rows)}")
@@ -1,8 +1,20 @@
 import pandas as pd
+import numpy as np
 import io
-from typing import List, Dict, Any, Optional
+import csv
+import os
+import multiprocessing
+import queue
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Iterator, BinaryIO
+from openpyxl import load_workbook
 from fastapi import UploadFile, HTTPException
 from datetime import datetime
+from ..config import settings
 
 class QuestionFileImporter:
     @staticmethod
@@ -25,24 +37,14 @@ class QuestionFileImporter:
     def parse_excel(file_content: bytes) -> pd.DataFrame:
         """Парсинг Excel файла"""
         try:
-            # Читаем все листы
+            # Книга открывается один раз: и список листов, и данные из нее
             excel_file = pd.ExcelFile(io.BytesIO(file_content))
             
             # Пробуем найти лист с вопросами
-            sheet_names = excel_file.sheet_names
-            sheet_name = None
-            
-            # Ищем подходящий лист
-            for name in sheet_names:
-                if any(keyword in name.lower() for keyword in ['questions', 'вопросы', 'data', 'sheet']):
-                    sheet_name = name
-                    break
-            
-            if sheet_name is None:
-                sheet_name = sheet_names[0]
+            sheet_name = pick_question_sheet(excel_file.sheet_names)
             
             # Читаем данные
-            df = pd.read_excel(io.BytesIO(file_content), sheet_name=sheet_name)
+            df = excel_file.parse(sheet_name)
             
             return df
         except Exception as e:
@@ -146,73 +148,17 @@ def normalize_column_names(df: pd.DataFrame) -> pd.DataFrame:
     
 @staticmethod
 def extract_questions_from_dataframe(df: pd.DataFrame, default_category: str = "Общие знания") -> List[Dict]:
-    """Извлечение вопросов из DataFrame"""
-    questions = []
+    """Извлечение вопросов из DataFrame (строки с ошибками разбора пропускаются)"""
+    frame = _frame([_map_column(col) for col in df.columns], df.values.tolist())
+    records, error_mask = normalize_frame(frame)
     
-    for index, row in df.iterrows():
-        try:
-            # Пропускаем пустые строки
-            if pd.isna(row.get('question', '')):
-                continue
-            
-            question_data = {
-                'question_text': str(row.get('question', '')).strip(),
-                'question_type': row.get('type', 'text').strip().lower(),
-                'answer_type': row.get('answer_type', 'text').strip().lower(),  # ← ДОБАВЬТЕ ЭТО!
-                'category': row.get('category', default_category).strip(),
-                'difficulty': int(row.get('difficulty', 1)),
-                'points': int(row.get('points', 1)),
-                'explanation': str(row.get('explanation', '')).strip() if pd.notna(row.get('explanation')) else None
-            }
-            
-            # Обработка правильного ответа
-            if pd.notna(row.get('correct_answer')):
-                question_data['correct_answer'] = str(row.get('correct_answer')).strip()
-            
-            # Обработка вариантов ответов
-            options = None
-            if pd.notna(row.get('options')):
-                options_str = str(row.get('options'))
-                if ';' in options_str:
-                    options = [opt.strip() for opt in options_str.split(';') if opt.strip()]
-                elif ',' in options_str:
-                    options = [opt.strip() for opt in options_str.split(',') if opt.strip()]
-                elif '|' in options_str:
-                    options = [opt.strip() for opt in options_str.split('|') if opt.strip()]
-                else:
-                    options = [options_str.strip()]
-            
-            if options:
-                question_data['options'] = options
-                
-                # Обработка правильных вариантов (для multiple choice)
-                if pd.notna(row.get('correct_options')):
-                    correct_opts_str = str(row.get('correct_options'))
-                    if ';' in correct_opts_str:
-                        correct_options = [opt.strip() for opt in correct_opts_str.split(';') if opt.strip()]
-                    elif ',' in correct_opts_str:
-                        correct_options = [opt.strip() for opt in correct_opts_str.split(',') if opt.strip()]
-                    elif '|' in correct_opts_str:
-                        correct_options = [opt.strip() for opt in correct_opts_str.split('|') if opt.strip()]
-                    else:
-                        correct_options = [correct_opts_str.strip()]
-                    
-                    question_data['correct_options'] = correct_options
-            
-            # Обработка blackbox_description
-            if pd.notna(row.get('blackbox_description')):
-                question_data['blackbox_description'] = str(row.get('blackbox_description')).strip()
-            
-            # Обработка media_url
-            if pd.notna(row.get('media_url')):
-                question_data['media_url'] = str(row.get('media_url')).strip()
-            
-            questions.append(question_data)
-            
-        except Exception as e:
-            # Пропускаем строку с ошибкой
-            print(f"Ошибка при обработке строки {index}: {str(e)}")
+    questions = []
+    for record, has_errors in zip(records, error_mask):
+        if has_errors:
+            print(f"Ошибка при обработке строки {record['row_number']}: {'; '.join(record['errors'])}")
             continue
+        record['category'] = record['category'] or default_category
+        questions.append(record)
     
     return questions
     
@@ -341,4 +287,607 @@ def convert_to_question_create(question_data: Dict, category_id: int, author_id:
                 'sort_order': i
             })
     
-    return question
\ No newline at end of file
+    return question
+
+
+# ========== ПОТОКОВЫЙ ИМПОРТ ==========
+# Файл читается порциями по IMPORT_CHUNK_SIZE строк, поэтому расход памяти
+# зависит от размера порции, а не от размера файла.
+
+IMPORT_CHUNK_SIZE = 1000
+DEFAULT_CATEGORY = "Общие знания"
+
+QUESTION_TYPES = ['text', 'blackbox', 'image', 'video', 'audio', 'code']
+ANSWER_TYPES = ['text', 'single_choice', 'multiple_choice']
+
+# Типы, которые можно сохранить при импорте -> id в базе
+IMPORT_QUESTION_TYPE_IDS = {'text': 1, 'blackbox': 2}
+IMPORT_ANSWER_TYPE_IDS = {'text': 1, 'single_choice': 2, 'multiple_choice': 3}
+
+# Общий маппинг колонок для всех эндпоинтов импорта
+IMPORT_COLUMN_MAPPING = {
+    'вопрос': 'question',
+    'текст вопроса': 'question',
+    'текст': 'question',
+    'question': 'question',
+    'question text': 'question',
+
+    'тип вопроса': 'question_type',
+    'тип_вопроса': 'question_type',
+    'тип вопроса type': 'question_type',
+    'тип вопроса question_type': 'question_type',
+    'question_type': 'question_type',
+    'qtype': 'question_type',
+
+    'тип ответа': 'answer_type',
+    'тип_ответа': 'answer_type',
+    'тип ответа answer_type': 'answer_type',
+    'тип ответа type': 'answer_type',
+    'answer_type': 'answer_type',
+    'answer type': 'answer_type',
+
+    # Общее поле type (может быть как question_type, так и answer_type)
+    'тип': 'type',
+    'type': 'type',
+
+    'варианты': 'options',
+    'варианты ответов': 'options',
+    'варианты ответа': 'options',
+    'options': 'options',
+    'choices': 'options',
+
+    'правильный ответ': 'correct_answer',
+    'ответ': 'correct_answer',
+    'correct_answer': 'correct_answer',
+    'correct answer': 'correct_answer',
+    'answer': 'correct_answer',
+
+    'правильные варианты': 'correct_options',
+    'правильные варианты ответов': 'correct_options',
+    'correct_options': 'correct_options',
+    'correct options': 'correct_options',
+    'correct choices': 'correct_options',
+
+    'категория': 'category',
+    'тема': 'category',
+    'раздел': 'category',
+    'category': 'category',
+    'topic': 'category',
+
+    'сложность': 'difficulty',
+    'difficulty': 'difficulty',
+
+    'баллы': 'points',
+    'очки': 'points',
+    'points': 'points',
+    'score': 'points',
+
+    'объяснение': 'explanation',
+    'пояснение': 'explanation',
+    'комментарий': 'explanation',
+    'explanation': 'explanation',
+    'comment': 'explanation',
+
+    'описание черного ящика': 'blackbox_description',
+    'описание': 'blackbox_description',
+    'blackbox_description': 'blackbox_description',
+    'description': 'blackbox_description',
+
+    'url медиа': 'media_url',
+    'ссылка': 'media_url',
+    'media_url': 'media_url',
+    'media': 'media_url',
+    'url': 'media_url',
+}
+
+IMPORT_FIELDS = [
+    'question', 'question_type', 'answer_type', 'type', 'options', 'correct_answer',
+    'correct_options', 'category', 'difficulty', 'points', 'explanation',
+    'blackbox_description', 'media_url'
+]
+
+
+def _map_column(name) -> str:
+    key = str(name).strip().lower()
+    return IMPORT_COLUMN_MAPPING.get(key, key)
+
+
+def _frame(columns: List[str], rows: List[list]) -> pd.DataFrame:
+    """Порция строк как DataFrame из строк с нормализованными колонками"""
+    df = pd.DataFrame(rows, columns=columns, dtype=object)
+    df = df.loc[:, ~df.columns.duplicated()]
+    for field in IMPORT_FIELDS:
+        if field not in df.columns:
+            df[field] = ''
+    return df.fillna('').astype(str)
+
+
+def _detect_csv_format(file_obj: BinaryIO, sample_size: int = 64 * 1024):
+    """Кодировка и разделитель CSV по первым байтам файла"""
+    sample = file_obj.read(sample_size)
+    file_obj.seek(0)
+
+    # Обрезаем по последнему переводу строки, чтобы не разрезать многобайтный символ
+    if len(sample) == sample_size and b'\n' in sample:
+        sample = sample[:sample.rfind(b'\n')]
+
+    for encoding in ['utf-8-sig', 'cp1251', 'latin1']:
+        try:
+            text = sample.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+
+    try:
+        separator = csv.Sniffer().sniff(text, delimiters=';,\t').delimiter
+    except csv.Error:
+        separator = ','
+
+    return encoding, separator
+
+
+def iter_csv_chunks(file_obj: BinaryIO, chunk_size: int = IMPORT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    encoding, separator = _detect_csv_format(file_obj)
+    reader = pd.read_csv(
+        file_obj,
+        sep=separator,
+        encoding=encoding,
+        encoding_errors='replace',
+        dtype=str,
+        keep_default_na=False,
+        chunksize=chunk_size
+    )
+    for chunk in reader:
+        columns = [_map_column(col) for col in chunk.columns]
+        yield _frame(columns, chunk.values.tolist())
+
+
+def pick_question_sheet(sheet_names: List[str]) -> str:
+    """Лист с вопросами: по ключевому слову в названии, иначе первый"""
+    for name in sheet_names:
+        if any(keyword in name.lower() for keyword in ['questions', 'вопросы', 'data', 'sheet']):
+            return name
+    return sheet_names[0]
+
+
+def iter_worksheet_chunks(worksheet, chunk_size: int = IMPORT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    rows = worksheet.iter_rows(values_only=True)
+    header = next(rows, None)
+    if header is None:
+        return
+
+    columns = [_map_column(col) if col is not None else '' for col in header]
+    chunk = []
+    for values in rows:
+        values = list(values[:len(columns)]) + [None] * (len(columns) - len(values))
+        chunk.append(values)
+        if len(chunk) >= chunk_size:
+            yield _frame(columns, chunk)
+            chunk = []
+    if chunk:
+        yield _frame(columns, chunk)
+
+
+def iter_xlsx_chunks(file_obj: BinaryIO, chunk_size: int = IMPORT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    # read_only: листы читаются потоково, без загрузки всей книги в память
+    workbook = load_workbook(file_obj, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[pick_question_sheet(workbook.sheetnames)]
+        yield from iter_worksheet_chunks(worksheet, chunk_size)
+    finally:
+        workbook.close()
+
+
+def iter_xls_chunks(file_obj: BinaryIO, chunk_size: int = IMPORT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    # Старый формат .xls потоково не читается - загружаем лист целиком
+    excel_file = pd.ExcelFile(file_obj)
+    df = excel_file.parse(pick_question_sheet(excel_file.sheet_names), dtype=str)
+    columns = [_map_column(col) for col in df.columns]
+    for start in range(0, len(df), chunk_size):
+        yield _frame(columns, df.iloc[start:start + chunk_size].values.tolist())
+
+
+def iter_file_chunks(filename: str, file_obj: BinaryIO, chunk_size: int = IMPORT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """Порции строк файла с нормализованными названиями колонок"""
+    name = filename.lower()
+    if name.endswith('.csv'):
+        return iter_csv_chunks(file_obj, chunk_size)
+    if name.endswith('.xlsx'):
+        return iter_xlsx_chunks(file_obj, chunk_size)
+    if name.endswith('.xls'):
+        return iter_xls_chunks(file_obj, chunk_size)
+    raise HTTPException(status_code=400, detail="Неподдерживаемый формат файла")
+
+
+# Служебный разделитель, которым заменяется найденный в ячейке разделитель вариантов
+_UNIT_SEPARATOR = '\x1f'
+
+
+def split_options_column(series: pd.Series) -> pd.Series:
+    """Разбить колонку со списками вариантов по разделителю ; , | (первому найденному в ячейке).
+
+    Колоночные операции pandas вместо цикла по строкам; результат - список
+    непустых вариантов в каждой ячейке.
+    """
+    values = series.str.strip()
+    has_semicolon = values.str.contains(';', regex=False)
+    has_comma = ~has_semicolon & values.str.contains(',', regex=False)
+    has_pipe = ~has_semicolon & ~has_comma & values.str.contains('|', regex=False)
+
+    unified = values.copy()
+    for mask, sep in [(has_semicolon, ';'), (has_comma, ','), (has_pipe, '|')]:
+        if mask.any():
+            unified[mask] = values[mask].str.replace(sep, _UNIT_SEPARATOR, regex=False)
+
+    parts = unified.str.split(_UNIT_SEPARATOR).explode().str.strip()
+    parts = parts[parts.notna() & (parts != '')]
+    grouped = parts.groupby(level=0).agg(list).reindex(series.index)
+    return pd.Series([value if isinstance(value, list) else [] for value in grouped], index=series.index)
+
+
+def _int_column(series: pd.Series, default: int):
+    """(значения, маска ошибок): пусто -> default, нечисловое -> ошибка"""
+    raw = series.str.strip()
+    numbers = pd.to_numeric(raw, errors='coerce')
+    invalid = (raw != '') & (numbers.isna() | np.isinf(numbers))
+    values = np.trunc(numbers.where(~invalid & numbers.notna(), default)).astype(int)
+    return values, invalid
+
+
+def _choose(candidates: List[pd.Series], allowed: List[str], default: pd.Series) -> pd.Series:
+    """Первое значение из candidates, входящее в allowed, иначе default"""
+    result = default.copy()
+    for candidate in reversed(candidates):
+        result = candidate.where(candidate.isin(allowed), result)
+    return result
+
+
+def normalize_frame(df: pd.DataFrame, first_row_number: int = 2):
+    """Нормализация порции строк за один колоночный проход.
+
+    Возвращает (records, error_mask): список словарей вопросов (как ожидают
+    эндпоинты импорта) и булев массив строк с ошибками разбора. Полностью
+    пустые строки отбрасываются, номер строки при этом сохраняется.
+    """
+    text = df[IMPORT_FIELDS].apply(lambda column: column.str.strip())
+    row_numbers = pd.Series(np.arange(len(df)) + first_row_number, index=df.index)
+
+    non_empty = (text != '').any(axis=1)
+    text = text[non_empty]
+    row_numbers = row_numbers[non_empty]
+    if text.empty:
+        return [], np.zeros(0, dtype=bool)
+
+    options = split_options_column(text['options'])
+    correct_options = split_options_column(text['correct_options'])
+
+    question_type_value = text['question_type'].str.lower()
+    answer_type_value = text['answer_type'].str.lower()
+    type_value = text['type'].str.lower()
+
+    # Тип вопроса: явный, затем общее поле type, затем по описанию черного ящика
+    inferred_question_type = pd.Series(
+        np.where(text['blackbox_description'] != '', 'blackbox', 'text'), index=text.index
+    )
+    question_type = _choose([question_type_value, type_value], QUESTION_TYPES, inferred_question_type)
+
+    # Тип ответа: явный, затем type, затем по наличию вариантов
+    inferred_answer_type = pd.Series(
+        np.select(
+            [correct_options.str.len() > 1, options.str.len() > 0],
+            ['multiple_choice', 'single_choice'],
+            default='text'
+        ),
+        index=text.index
+    )
+    answer_type = _choose([answer_type_value, type_value], ANSWER_TYPES, inferred_answer_type)
+
+    difficulty, bad_difficulty = _int_column(text['difficulty'], 1)
+    points, bad_points = _int_column(text['points'], 1)
+    empty_question = text['question'] == ''
+
+    error_mask = (empty_question | bad_difficulty | bad_points).to_numpy()
+
+    normalized = pd.DataFrame({
+        'row_number': row_numbers,
+        'question_text': text['question'],
+        'question_type': question_type,
+        'answer_type': answer_type,
+        'options': options,
+        'correct_answer': text['correct_answer'],
+        'correct_options': correct_options,
+        'category': text['category'],
+        'difficulty': difficulty,
+        'points': points,
+        'explanation': text['explanation'],
+        'blackbox_description': text['blackbox_description'],
+        'media_url': text['media_url'],
+    })
+    records = normalized.to_dict('records')
+
+    # Сообщения собираем только для строк с ошибками
+    for position in np.flatnonzero(error_mask):
+        index = text.index[position]
+        errors = []
+        if empty_question[index]:
+            errors.append("Пустой текст вопроса")
+        if bad_difficulty[index]:
+            errors.append(f"Некорректное значение 'difficulty': {text['difficulty'][index]}")
+        if bad_points[index]:
+            errors.append(f"Некорректное значение 'points': {text['points'][index]}")
+        records[position]['errors'] = errors
+
+    for record in records:
+        record.setdefault('errors', [])
+        record['category'] = record['category'] or None
+        record['row_number'] = int(record['row_number'])
+        record['difficulty'] = int(record['difficulty'])
+        record['points'] = int(record['points'])
+
+    return records, error_mask
+
+
+# Сколько готовых порций листа может ждать в очереди, пока импорт пишет предыдущие
+SHEET_QUEUE_CHUNKS = 2
+# Как часто процесс пула, упершийся в полную очередь, проверяет отмену импорта
+SHEET_PUT_TIMEOUT = 0.5
+
+_sheet_pool = None
+_sheet_manager = None
+_sheet_pool_lock = threading.Lock()
+
+
+def _get_sheet_pool():
+    """Общий на процесс пул разбора листов и менеджер очередей к нему.
+
+    Создаются один раз при первом импорте всех листов. Контекст spawn:
+    fork процесса с потоками (воркеры, пул базы) небезопасен.
+    """
+    global _sheet_pool, _sheet_manager
+    with _sheet_pool_lock:
+        if _sheet_pool is None:
+            context = multiprocessing.get_context("spawn")
+            _sheet_manager = context.Manager()
+            _sheet_pool = ProcessPoolExecutor(
+                max_workers=max(1, settings.IMPORT_SHEET_WORKERS),
+                mp_context=context
+            )
+        return _sheet_pool, _sheet_manager
+
+
+def shutdown_sheet_pool() -> None:
+    global _sheet_pool, _sheet_manager
+    with _sheet_pool_lock:
+        if _sheet_pool is not None:
+            _sheet_pool.shutdown(wait=True, cancel_futures=True)
+            _sheet_manager.shutdown()
+            _sheet_pool = None
+            _sheet_manager = None
+
+
+def parse_sheet(file_path: str, sheet_name: str, chunk_size: int, output, cancelled) -> None:
+    """Разобрать лист .xlsx порциями в очередь output (выполняется в процессе пула).
+
+    В очередь уходят ('chunk', записи), затем ('done', None) или ('error', текст).
+    Очередь ограничена, поэтому в памяти не больше SHEET_QUEUE_CHUNKS порций
+    листа. Лист без колонки с текстом вопроса пропускается. Пустая категория
+    в строке заменяется названием листа.
+    """
+    def put(item) -> bool:
+        while True:
+            try:
+                output.put(item, timeout=SHEET_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                if cancelled.is_set():
+                    return False
+
+    try:
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            worksheet = workbook[sheet_name]
+            header = next(worksheet.iter_rows(max_row=1, values_only=True), None)
+            if header and 'question' in {_map_column(col) for col in header if col is not None}:
+                first_row_number = 2
+                for chunk in iter_worksheet_chunks(worksheet, chunk_size):
+                    records, _ = normalize_frame(chunk, first_row_number)
+                    first_row_number += len(chunk)
+                    for record in records:
+                        record['category'] = record['category'] or sheet_name
+                    if records and not put(('chunk', records)):
+                        return
+        finally:
+            workbook.close()
+    except Exception as e:
+        put(('error', f"{sheet_name}: {e}"))
+        return
+
+    put(('done', None))
+
+
+def iter_workbook_records(file_path: str, chunk_size: int = IMPORT_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """Вопросы со всех подходящих листов .xlsx, листы разбираются параллельно.
+
+    Книга в этом процессе открывается один раз, только ради списка листов;
+    каждый процесс общего пула открывает файл сам (объекты openpyxl между
+    процессами не передаются) и отдает записи порциями через свою очередь.
+    Записи отдаются в порядке листов по мере разбора, поэтому импорт пишет
+    и сохраняет прогресс, не дожидаясь конца большого листа.
+
+    row_number сквозной, как если бы листы шли подряд в одной таблице
+    (по нему фоновый импорт ставит контрольную точку); номер строки на
+    листе - в sheet_row.
+    """
+    workbook = load_workbook(file_path, read_only=True)
+    try:
+        sheet_names = list(workbook.sheetnames)
+    finally:
+        workbook.close()
+
+    executor, manager = _get_sheet_pool()
+    cancelled = manager.Event()
+    outputs = [manager.Queue(maxsize=SHEET_QUEUE_CHUNKS) for _ in sheet_names]
+    futures = [
+        executor.submit(parse_sheet, file_path, sheet_name, chunk_size, output, cancelled)
+        for sheet_name, output in zip(sheet_names, outputs)
+    ]
+
+    offset = 0
+    try:
+        for sheet_name, output, future in zip(sheet_names, outputs, futures):
+            last_row = offset
+            while True:
+                try:
+                    kind, payload = output.get(timeout=SHEET_PUT_TIMEOUT)
+                except queue.Empty:
+                    if future.done():
+                        # Процесс пула упал, не успев ничего сообщить
+                        future.result()
+                        raise RuntimeError(f"Лист {sheet_name} не разобран")
+                    continue
+                if kind == 'done':
+                    break
+                if kind == 'error':
+                    raise RuntimeError(payload)
+                for record in payload:
+                    record['sheet'] = sheet_name
+                    record['sheet_row'] = record['row_number']
+                    record['row_number'] += offset
+                    last_row = record['row_number']
+                    yield record
+            offset = last_row
+    finally:
+        # Импорт прерван или закончен: недоразобранные листы больше не нужны
+        cancelled.set()
+        for future in futures:
+            future.cancel()
+
+
+@contextmanager
+def _local_path(file_obj: BinaryIO, suffix: str):
+    """Путь к содержимому файла: процессам пула нужен файл на диске"""
+    name = getattr(file_obj, 'name', None)
+    if isinstance(name, str) and os.path.isfile(name):
+        yield name
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as temp_file:
+        shutil.copyfileobj(file_obj, temp_file)
+    try:
+        yield temp_file.name
+    finally:
+        os.remove(temp_file.name)
+
+
+def iter_question_records(filename: str, file_obj: BinaryIO, chunk_size: int = IMPORT_CHUNK_SIZE,
+                          all_sheets: bool = False) -> Iterator[Dict[str, Any]]:
+    """Генератор нормализованных вопросов из CSV/Excel.
+
+    Номер строки считается как в таблице: строка 1 - заголовок.
+    Полностью пустые строки пропускаются. all_sheets - читать все листы
+    .xlsx с вопросами (лист = категория), а не один.
+    """
+    if all_sheets and not filename.lower().endswith('.csv'):
+        if not filename.lower().endswith('.xlsx'):
+            raise HTTPException(status_code=400, detail="Импорт всех листов поддерживается только для .xlsx")
+        with _local_path(file_obj, '.xlsx') as file_path:
+            yield from iter_workbook_records(file_path, chunk_size)
+        return
+
+    first_row_number = 2
+    for chunk in iter_file_chunks(filename, file_obj, chunk_size):
+        records, _ = normalize_frame(chunk, first_row_number)
+        first_row_number += len(chunk)
+        yield from records
+
+
+def row_label(record: Dict[str, Any]) -> str:
+    """Строка файла для сообщений об ошибках"""
+    if record.get('sheet'):
+        return f"Лист «{record['sheet']}», строка {record['sheet_row']}"
+    return f"Строка {record['row_number']}"
+
+
+def build_answer_options(record: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Варианты ответа с отметкой правильных"""
+    correct_answer = record['correct_answer']
+    correct_options = record['correct_options']
+
+    answer_options = []
+    for i, option in enumerate(record['options']):
+        if record['answer_type'] == 'multiple_choice':
+            is_correct = option in correct_options
+        else:
+            is_correct = (bool(correct_answer) and option == correct_answer) or option in correct_options
+
+        answer_options.append({
+            'option_text': option,
+            'is_correct': is_correct,
+            'sort_order': i
+        })
+    return answer_options
+
+
+def import_errors(record: Dict[str, Any]) -> List[str]:
+    """Ошибки, из-за которых строку нельзя импортировать"""
+    errors = list(record['errors'])
+    if record['question_type'] not in IMPORT_QUESTION_TYPE_IDS:
+        errors.append(f"Неподдерживаемый тип вопроса '{record['question_type']}'")
+    if record['answer_type'] not in IMPORT_ANSWER_TYPE_IDS:
+        errors.append(f"Неподдерживаемый тип ответа '{record['answer_type']}'")
+    return errors
+
+
+def question_fields(record: Dict[str, Any], category_id: Optional[int]) -> Dict[str, Any]:
+    """Поля модели Question для импортируемой строки"""
+    return {
+        'question_text': record['question_text'],
+        'type_id': IMPORT_QUESTION_TYPE_IDS[record['question_type']],
+        'answer_type_id': IMPORT_ANSWER_TYPE_IDS[record['answer_type']],
+        'category_id': category_id,
+        'difficulty': record['difficulty'],
+        'explanation': record['explanation'],
+        'time_limit': 60,
+        'points': record['points'],
+        'correct_answer': record['correct_answer'],
+        'sources': 'Импортировано из файла',
+        'allow_latex': False,
+        'blackbox_description': record['blackbox_description'],
+        'answer_requirements': '',
+        'is_active': True
+    }
+
+
+def validate_record(record: Dict[str, Any]) -> List[str]:
+    """Полная проверка вопроса (для предпросмотра)"""
+    errors = list(record['errors'])
+    question_type = record['question_type']
+    answer_type = record['answer_type']
+
+    if answer_type in ['single_choice', 'multiple_choice']:
+        if not record['options']:
+            errors.append(f"Для типа ответа '{answer_type}' нужны варианты ответов")
+
+        if answer_type == 'single_choice' and not record['correct_answer']:
+            errors.append("Для single_choice нужен правильный ответ (correct_answer)")
+
+        if answer_type == 'multiple_choice' and not record['correct_options']:
+            errors.append("Для multiple_choice нужны правильные варианты (correct_options)")
+
+    elif answer_type == 'text' and question_type not in ['image', 'video', 'audio']:
+        if not record['correct_answer']:
+            errors.append("Для текстового вопроса нужен правильный ответ")
+
+    if not (1 <= record['difficulty'] <= 5):
+        errors.append("Сложность должна быть от 1 до 5")
+
+    if record['points'] <= 0:
+        errors.append("Баллы должны быть положительными")
+
+    if question_type == 'blackbox' and not record['blackbox_description']:
+        errors.append("Для blackbox нужно описание черного ящика")
+
+    if question_type in ['image', 'video', 'audio'] and not record['media_url']:
+        errors.append(f"Для типа вопроса '{question_type}' нужен URL медиафайла")
+
+    return errors
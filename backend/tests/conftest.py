@@ -0,0 +1,109 @@
+"""Общие фикстуры тестов.
+
+Настройки читаются при импорте app.config, поэтому окружение для тестов
+(временная SQLite, без фоновых воркеров, дешевый Argon2) задается здесь,
+до импорта приложения.
+"""
+import os
+import tempfile
+
+_tmp_dir = tempfile.mkdtemp(prefix="testing-platform-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{_tmp_dir}/test.db",
+    "DATABASE_READ_URL": "",
+    "STATS_WORKERS": "0",
+    "IMPORT_WORKERS": "0",
+    "HASH_WORKERS": "0",
+    "IMPORT_SHEET_WORKERS": "2",
+    "IMPORT_UPLOAD_DIR": os.path.join(_tmp_dir, "imports"),
+    "ARGON2_TIME_COST": "1",
+    "ARGON2_MEMORY_COST": "1024",
+    "ARGON2_PARALLELISM": "1",
+})
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import models, migrations, auth, passwords, answer_keys, test_payloads
+from app.config import settings
+from app.database import engine, SessionLocal
+from app.main import app
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    migrations.upgrade(engine)
+    yield
+
+
+@pytest.fixture(autouse=True)
+def clean_database(schema):
+    """Пустая база и холодные кэши перед каждым тестом"""
+    with engine.begin() as connection:
+        for table in reversed(models.Base.metadata.sorted_tables):
+            connection.execute(table.delete())
+    answer_keys.clear()
+    test_payloads.set_backend(test_payloads.InMemoryPayloadBackend(settings.TEST_PAYLOAD_CACHE_SIZE))
+    auth.principal_cache.clear()
+
+    db = SessionLocal()
+    try:
+        db.add_all([
+            models.Role(id=1, name="student"),
+            models.Role(id=2, name="teacher"),
+            models.Role(id=3, name="admin"),
+            models.QuestionType(id=1, name="text"),
+            models.QuestionType(id=2, name="blackbox"),
+            models.AnswerType(id=1, name="text"),
+            models.AnswerType(id=2, name="single_choice"),
+            models.AnswerType(id=3, name="multiple_choice"),
+            models.Category(id=1, name="Общие знания"),
+        ])
+        db.commit()
+    finally:
+        db.close()
+    yield
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def make_user(db, username: str, role_id: int = 1, password: str = "secret") -> models.User:
+    user = models.User(
+        username=username,
+        email=f"{username}@example.com",
+        password_hash=passwords.hash_password(password),
+        role_id=role_id,
+        is_active=True
+    )
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    return user
+
+
+def auth_headers(user: models.User) -> dict:
+    token = auth.create_access_token(data=auth.build_token_claims(user))
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def teacher(db):
+    return make_user(db, "teacher", role_id=2)
+
+
+@pytest.fixture
+def student(db):
+    return make_user(db, "student")
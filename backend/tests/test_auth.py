@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+from passlib.context import CryptContext
+
+from app import models, passwords
+
+from .conftest import auth_headers, make_user
+
+
+def test_register_login_and_me(client):
+    response = client.post("/auth/register", json={
+        "username": "ivan", "email": "ivan@example.com", "password": "secret"
+    })
+    assert response.status_code == 200
+    assert response.json()["role_id"] == 1
+
+    response = client.post("/auth/register", json={
+        "username": "ivan", "email": "other@example.com", "password": "secret"
+    })
+    assert response.status_code == 400
+
+    response = client.post("/auth/login", json={"username": "ivan", "password": "wrong"})
+    assert response.status_code == 401
+
+    response = client.post("/auth/login", json={"username": "ivan", "password": "secret"})
+    assert response.status_code == 200
+    tokens = response.json()
+    assert tokens["refresh_token"]
+
+    me = client.get("/auth/me", headers={"Authorization": f"Bearer {tokens['access_token']}"})
+    assert me.status_code == 200
+    assert me.json()["username"] == "ivan"
+
+
+def test_login_rehashes_outdated_password_hash(client, db):
+    weak_context = CryptContext(schemes=["argon2"], argon2__time_cost=1, argon2__memory_cost=512,
+                                argon2__parallelism=1)
+    user = models.User(username="olga", password_hash=weak_context.hash("secret"), role_id=1, is_active=True)
+    db.add(user)
+    db.commit()
+    old_hash = user.password_hash
+
+    response = client.post("/auth/login", json={"username": "olga", "password": "secret"})
+    assert response.status_code == 200
+
+    db.expire_all()
+    user = db.query(models.User).filter(models.User.username == "olga").one()
+    assert user.password_hash != old_hash
+    assert passwords.pwd_context.verify("secret", user.password_hash)
+    # Обновление хеша - не смена пароля: выданные токены остаются действительными
+    assert user.token_version == 0
+
+
+def test_principal_cache_does_not_mix_accounts_with_the_same_username(client, db):
+    old = make_user(db, "petr")
+    make_user(db, "other")
+    old_headers = auth_headers(old)
+    assert client.get("/auth/me", headers=old_headers).json()["id"] == old.id
+
+    # Массовое удаление не вызывает событий ORM, кэш об этом не знает
+    db.query(models.User).filter(models.User.id == old.id).delete(synchronize_session=False)
+    db.commit()
+    new = make_user(db, "petr")
+
+    assert client.get("/auth/me", headers=auth_headers(new)).json()["id"] == new.id
+
+
+def test_hashing_pool_rejects_when_queue_is_full():
+    pool = passwords.HashingPool(workers=0, max_concurrency=1, max_queue=0)
+    with pytest.raises(passwords.HashingOverloaded):
+        asyncio.run(pool.run(passwords.hash_password, "secret"))
+    assert pool.status()["rejected"] == 1
+    assert pool.status()["queue_depth"] == 0
+
+
+def test_hashing_pool_serves_several_event_loops():
+    pool = passwords.HashingPool(workers=0, max_concurrency=1, max_queue=10)
+
+    async def hash_concurrently():
+        return await asyncio.gather(*(pool.run(passwords.hash_password, "secret") for _ in range(3)))
+
+    # Ожидание на семафоре в одном loop не мешает следующему
+    for _ in range(2):
+        assert len(asyncio.run(hash_concurrently())) == 3
+    assert pool.status()["completed"] == 6
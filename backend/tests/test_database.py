@@ -0,0 +1,44 @@
+import threading
+import time
+
+from sqlalchemy import create_engine, event
+
+from app.database import MeasuredQueuePool, PoolMetrics
+
+
+def make_engine(tmp_path, metrics):
+    pool_class = type("MeasuredQueuePool", (MeasuredQueuePool,), {"metrics": metrics})
+    db_engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        connect_args={"check_same_thread": False},
+        poolclass=pool_class,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=5
+    )
+    event.listen(db_engine, "checkout", metrics.on_checkout)
+    event.listen(db_engine, "checkin", metrics.on_checkin)
+    return db_engine
+
+
+def test_only_blocked_checkouts_count_as_waits(tmp_path):
+    metrics = PoolMetrics()
+    db_engine = make_engine(tmp_path, metrics)
+
+    for _ in range(3):
+        with db_engine.connect():
+            pass
+    assert metrics.snapshot()["checkouts"] == 3
+    assert metrics.snapshot()["waits"] == 0
+
+    connection = db_engine.connect()
+    waiter = threading.Thread(target=lambda: db_engine.connect().close())
+    waiter.start()
+    time.sleep(0.05)
+    connection.close()
+    waiter.join()
+
+    snapshot = metrics.snapshot()
+    assert snapshot["checkouts"] == 5
+    assert snapshot["waits"] == 1
+    assert snapshot["max_wait_ms"] >= 40
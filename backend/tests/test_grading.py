@@ -0,0 +1,219 @@
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from app import answer_keys, crud, models, test_payloads
+from app.database import SessionLocal
+
+from .conftest import auth_headers
+
+
+def make_test(db, author):
+    test = models.Test(title="Арифметика", author_id=author.id, max_attempts=0, is_active=True, is_public=True)
+    text_question = models.Question(
+        question_text="Сколько будет 2+2?", type_id=1, answer_type_id=1, category_id=1,
+        author_id=author.id, correct_answer="4", points=1
+    )
+    choice_question = models.Question(
+        question_text="Выберите простое число", type_id=1, answer_type_id=2, category_id=1,
+        author_id=author.id, points=2
+    )
+    db.add_all([test, text_question, choice_question])
+    db.flush()
+    wrong = models.AnswerOption(question_id=choice_question.id, option_text="4", is_correct=False)
+    right = models.AnswerOption(question_id=choice_question.id, option_text="3", is_correct=True)
+    db.add_all([
+        wrong, right,
+        models.TestQuestion(test_id=test.id, question_id=text_question.id, sort_order=0, points=1),
+        models.TestQuestion(test_id=test.id, question_id=choice_question.id, sort_order=1, points=2),
+    ])
+    db.commit()
+    return test, text_question, choice_question, wrong, right
+
+
+def start_session(client, user, test):
+    response = client.post("/test-sessions/", json={"test_id": test.id}, headers=auth_headers(user))
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def answer(client, user, session_id, question_id, **fields):
+    response = client.post(
+        f"/test-sessions/{session_id}/answers",
+        json={"question_id": question_id, "time_spent": 5, **fields},
+        headers=auth_headers(user)
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+def session_score(db, session_id):
+    db.expire_all()
+    return db.query(models.TestSession).filter(models.TestSession.id == session_id).one().score
+
+
+def test_reanswer_replaces_previous_answer_and_score(client, db, teacher, student):
+    test, text_question, choice_question, wrong, right = make_test(db, teacher)
+    session_id = start_session(client, student, test)
+
+    assert answer(client, student, session_id, text_question.id, answer_text=" 4 ")["is_correct"]
+    assert answer(client, student, session_id, choice_question.id, selected_options=f"[{right.id}]")["points_earned"] == 2
+    assert session_score(db, session_id) == 3
+
+    # Повторный ответ заменяет прежний, а не добавляет баллы
+    assert not answer(client, student, session_id, choice_question.id, selected_options=f"[{wrong.id}]")["is_correct"]
+    assert session_score(db, session_id) == 1
+
+    response = client.post(
+        f"/test-sessions/{session_id}/answers/batch",
+        json={"answers": [
+            {"question_id": text_question.id, "answer_text": "5", "time_spent": 1},
+            {"question_id": choice_question.id, "selected_options": f"[{right.id}]", "time_spent": 1},
+        ]},
+        headers=auth_headers(student)
+    )
+    assert response.status_code == 200
+    assert [item["status"] for item in response.json()["results"]] == ["updated", "updated"]
+    assert response.json()["score"] == 2
+    assert db.query(models.UserAnswer).filter(models.UserAnswer.session_id == session_id).count() == 2
+
+    completed = client.post(f"/test-sessions/{session_id}/complete", headers=auth_headers(student)).json()
+    assert (completed["score"], completed["max_score"], completed["percentage"]) == (2, 3, 66.67)
+
+
+def test_recalculate_keeps_the_session_max_score(client, db, teacher, student):
+    test, text_question, choice_question, wrong, right = make_test(db, teacher)
+    session_id = start_session(client, student, test)
+    answer(client, student, session_id, text_question.id, answer_text="4")
+    client.post(f"/test-sessions/{session_id}/complete", headers=auth_headers(student))
+
+    # После прохождения в тест добавили вопрос, а счет сессии разошелся с ответами
+    extra = models.Question(question_text="Новый", type_id=1, answer_type_id=1, category_id=1,
+                            author_id=teacher.id, correct_answer="1", points=5)
+    db.add(extra)
+    db.flush()
+    db.add(models.TestQuestion(test_id=test.id, question_id=extra.id, sort_order=2, points=5))
+    db.query(models.TestSession).filter(models.TestSession.id == session_id).update(
+        {"score": 3, "percentage": 100}, synchronize_session=False
+    )
+    db.commit()
+
+    repaired = crud.recalculate_session_scores(db, test_id=test.id)
+    assert repaired == [{"session_id": session_id, "score": [3, 1], "percentage": [100, 33.33]}]
+
+    db.expire_all()
+    session = db.get(models.TestSession, session_id)
+    assert (session.score, session.max_score, session.percentage) == (1, 3, 33.33)
+    assert crud.recalculate_session_scores(db, test_id=test.id) == []
+
+
+def test_answer_key_follows_changes_made_elsewhere(client, db, teacher, student):
+    test, text_question, *_ = make_test(db, teacher)
+    session_id = start_session(client, student, test)
+    assert answer(client, student, session_id, text_question.id, answer_text="4")["is_correct"]
+
+    # Правка из другого процесса: версия теста сдвинута, локальный invalidate_* не вызывался
+    text_question.correct_answer = "четыре"
+    text_question.updated_at = datetime.utcnow()
+    answer_keys.mark_question_changed(db, text_question.id)
+    db.commit()
+
+    assert not answer(client, student, session_id, text_question.id, answer_text="4")["is_correct"]
+    assert answer(client, student, session_id, text_question.id, answer_text="Четыре")["is_correct"]
+
+
+def test_key_compiled_during_invalidation_is_not_cached(db, teacher, monkeypatch):
+    test, *_ = make_test(db, teacher)
+    compile_answer_key = answer_keys.compile_answer_key
+
+    def compile_and_invalidate(db, test_id):
+        key = compile_answer_key(db, test_id)
+        answer_keys.invalidate_test(test_id)
+        return key
+
+    monkeypatch.setattr(answer_keys, "compile_answer_key", compile_and_invalidate)
+    answer_keys.get_answer_key(db, test.id)
+    assert test.id not in answer_keys._cache
+
+    monkeypatch.setattr(answer_keys, "compile_answer_key", compile_answer_key)
+    answer_keys.get_answer_key(db, test.id)
+    assert test.id in answer_keys._cache
+
+
+def test_grading_reads_version_from_the_loaded_test(client, db, teacher, student, monkeypatch):
+    test, text_question, *_ = make_test(db, teacher)
+    session_id = start_session(client, student, test)
+
+    def aggregate_version(db, test_id):
+        raise AssertionError("grading must not aggregate the test version")
+
+    monkeypatch.setattr(test_payloads, "get_test_version", aggregate_version)
+    assert answer(client, student, session_id, text_question.id, answer_text="4")["is_correct"]
+    assert answer(client, student, session_id, text_question.id, answer_text="5")["points_earned"] == 0
+
+
+def submit_batch(client, user, session_id, answers):
+    return client.post(
+        f"/test-sessions/{session_id}/answers/batch",
+        json={"answers": answers},
+        headers=auth_headers(user)
+    )
+
+
+def test_batch_grades_questions_outside_the_test(client, db, teacher, student):
+    test, text_question, *_ = make_test(db, teacher)
+    outside = models.Question(
+        question_text="Столица Франции?", type_id=1, answer_type_id=1, category_id=1,
+        author_id=teacher.id, correct_answer="Париж", points=5
+    )
+    db.add(outside)
+    db.commit()
+    session_id = start_session(client, student, test)
+
+    response = submit_batch(client, student, session_id, [
+        {"question_id": text_question.id, "answer_text": "4", "time_spent": 1},
+        {"question_id": outside.id, "answer_text": "париж", "time_spent": 1},
+        {"question_id": outside.id + 100, "answer_text": "?", "time_spent": 1},
+    ])
+    assert response.status_code == 200
+    assert [(item["status"], item["points_earned"]) for item in response.json()["results"]] == [
+        ("created", 1), ("created", 1), ("error", 0)
+    ]
+
+    assert submit_batch(client, student, session_id, []).status_code == 400
+
+
+def test_batch_retries_after_a_concurrent_insert(client, db, teacher, student, monkeypatch):
+    test, text_question, *_ = make_test(db, teacher)
+    session_id = start_session(client, student, test)
+    add_user_answers_batch = crud.add_user_answers_batch
+    calls = []
+
+    def racing_batch(db, answers, session):
+        calls.append(session.id)
+        if len(calls) == 1:
+            # Параллельный запрос успел вставить ответ на тот же вопрос
+            other = SessionLocal()
+            other.add(models.UserAnswer(session_id=session.id, question_id=text_question.id,
+                                        answer_text="5", is_correct=False, points_earned=0))
+            other.commit()
+            other.close()
+            raise IntegrityError("INSERT INTO user_answers", {}, Exception("UNIQUE constraint failed"))
+        return add_user_answers_batch(db, answers, session)
+
+    monkeypatch.setattr(crud, "add_user_answers_batch", racing_batch)
+    response = submit_batch(client, student, session_id, [
+        {"question_id": text_question.id, "answer_text": "4", "time_spent": 1},
+    ])
+    assert response.status_code == 200
+    assert response.json()["results"][0]["status"] == "updated"
+    assert response.json()["score"] == 1
+    assert db.query(models.UserAnswer).filter(models.UserAnswer.session_id == session_id).count() == 1
+
+    def always_conflicting(db, answers, session):
+        raise IntegrityError("INSERT INTO user_answers", {}, Exception("UNIQUE constraint failed"))
+
+    monkeypatch.setattr(crud, "add_user_answers_batch", always_conflicting)
+    assert submit_batch(client, student, session_id, [
+        {"question_id": text_question.id, "answer_text": "4", "time_spent": 1},
+    ]).status_code == 409
@@ -0,0 +1,105 @@
+from datetime import datetime
+
+from app import group_stats, models
+
+from .conftest import auth_headers, make_user
+
+
+def complete_session(db, user, test, assignment, score, max_score):
+    session = models.TestSession(
+        user_id=user.id,
+        test_id=test.id,
+        assignment_id=assignment.id,
+        score=score,
+        max_score=max_score,
+        percentage=round(score / max_score * 100, 2),
+        is_completed=True,
+        finished_at=datetime.utcnow()
+    )
+    db.add(session)
+    db.flush()
+    group_stats.record_completed_session(db, session)
+    db.commit()
+    return session
+
+
+def make_assignment(db, teacher):
+    group = models.StudyGroup(name="9А", invite_code="INVITE9A", created_by=teacher.id, is_active=True)
+    db.add(group)
+    db.flush()
+    test = models.Test(title="Дроби", author_id=teacher.id, passing_score=70, is_active=True)
+    db.add(test)
+    db.flush()
+    assignment = models.TestAssignment(test_id=test.id, group_id=group.id, assigned_by=teacher.id, is_active=True)
+    db.add(assignment)
+    db.flush()
+    return group, test, assignment
+
+
+def group_stats_response(client, group, user):
+    response = client.get(f"/groups/{group.id}/stats", headers=auth_headers(user))
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_group_stats_use_exact_best_attempts_of_active_members(client, db, teacher):
+    group, test, assignment = make_assignment(db, teacher)
+
+    anna = make_user(db, "anna")
+    boris = make_user(db, "boris")
+    left = make_user(db, "left")
+    db.add_all([
+        models.GroupMember(group_id=group.id, user_id=teacher.id, role='owner', is_active=True),
+        models.GroupMember(group_id=group.id, user_id=anna.id, is_active=True),
+        models.GroupMember(group_id=group.id, user_id=boris.id, is_active=True),
+        models.GroupMember(group_id=group.id, user_id=left.id, is_active=False),
+    ])
+    db.commit()
+
+    complete_session(db, anna, test, assignment, 1, 3)
+    complete_session(db, anna, test, assignment, 2, 3)
+    complete_session(db, boris, test, assignment, 3, 3)
+    complete_session(db, left, test, assignment, 0, 3)
+
+    summary = db.query(models.AssignmentSummary).filter(
+        models.AssignmentSummary.assignment_id == assignment.id
+    ).one()
+    assert summary.completed_count == 2
+
+    stats = group_stats_response(client, group, teacher)
+    stat = stats["test_statistics"][0]
+
+    assert stat["total_participants"] == 3
+    assert {participant["user_id"] for participant in stat["participants"]} == {teacher.id, anna.id, boris.id}
+    assert stat["completed_count"] == 2
+    assert stat["min_score"] == 66.67
+    assert stat["max_score"] == 100
+    assert stat["median_score"] == 83.3
+    assert stat["passed_count"] == 1
+    assert stat["failed_count"] == 1
+    assert stat["scores_distribution"] == {"excellent": 1, "good": 0, "satisfactory": 1, "poor": 0}
+
+    # Лучшая попытка в статистике участника та же, что в статистике теста
+    (anna_stats,) = [member for member in stats["members"] if member["user_id"] == anna.id]
+    (anna_score,) = anna_stats["test_scores"]
+    assert anna_score["best_percentage"] == 66.67
+    assert anna_score["total_attempts"] == 2
+    assert not anna_score["is_passed"]
+
+
+def test_joining_member_adds_existing_best_to_summary(client, db, teacher):
+    group, test, assignment = make_assignment(db, teacher)
+    db.add(models.GroupMember(group_id=group.id, user_id=teacher.id, role='owner', is_active=True))
+    vera = make_user(db, "vera")
+    db.commit()
+
+    # Попытка сделана до вступления в группу: в сводку пока не попадает
+    complete_session(db, vera, test, assignment, 3, 3)
+    assert group_stats_response(client, group, teacher)["test_statistics"][0]["completed_count"] == 0
+
+    response = client.post(f"/groups/join/{group.id}", headers=auth_headers(vera))
+    assert response.status_code == 200
+
+    stat = group_stats_response(client, group, teacher)["test_statistics"][0]
+    assert (stat["completed_count"], stat["max_score"], stat["passed_count"]) == (1, 100, 1)
+    assert [participant["percentage"] for participant in stat["participants"] if participant["user_id"] == vera.id] == [100]
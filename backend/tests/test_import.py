@@ -0,0 +1,248 @@
+import io
+import time
+
+from openpyxl import Workbook
+
+from app import models, import_jobs
+from app.database import SessionLocal
+from app.utils import file_importer
+from .conftest import auth_headers, make_user
+
+
+def make_workbook(sheets: dict) -> bytes:
+    """.xlsx из {название листа: [строки, первая - заголовок]}"""
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    for title, rows in sheets.items():
+        worksheet = workbook.create_sheet(title)
+        for row in rows:
+            worksheet.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+CSV_CONTENT = (
+    "Вопрос;Варианты;Правильный ответ;Категория\n"
+    "Столица Франции?;Париж|Лион|Марсель;Париж;География\n"
+    "2 + 2 = ?;3|4|5;4;\n"
+    ";1|2;1;\n"
+).encode("utf-8")
+
+WORKBOOK_SHEETS = {
+    "Физика": [
+        ["Вопрос", "Варианты", "Правильный ответ"],
+        ["Единица силы?", "Ньютон;Джоуль;Ватт", "Ньютон"],
+        ["Единица работы?", "Ньютон;Джоуль;Ватт", "Джоуль"],
+    ],
+    "Химия": [
+        ["Вопрос", "Варианты", "Правильный ответ", "Категория"],
+        ["Символ натрия?", "Na;N;Ne", "Na", ""],
+        ["", "", "", ""],
+        ["Символ золота?", "Au;Ag;Al", "Au", "Металлы"],
+    ],
+    "Заметки": [
+        ["Комментарий к файлу"],
+        ["Этот лист не содержит вопросов"],
+    ],
+}
+
+
+def upload(content: bytes, filename: str):
+    return {"file": (filename, content, "application/octet-stream")}
+
+
+def test_csv_import_into_bank(client, db, teacher):
+    response = client.post(
+        "/questions/import-file",
+        files=upload(CSV_CONTENT, "questions.csv"),
+        headers=auth_headers(teacher)
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["imported_count"] == 2
+    assert data["failed_count"] == 1
+    assert any("Строка 4" in error for error in data["errors"])
+
+    question = db.query(models.Question).filter(models.Question.question_text == "Столица Франции?").one()
+    options = {option.option_text: option.is_correct for option in question.answer_options}
+    assert options == {"Париж": True, "Лион": False, "Марсель": False}
+
+
+def test_csv_reimport_reuses_bank_questions(client, db, teacher):
+    for _ in range(2):
+        response = client.post(
+            "/questions/import-file",
+            files=upload(CSV_CONTENT, "questions.csv"),
+            headers=auth_headers(teacher)
+        )
+    data = response.json()
+    assert data["new_count"] == 0
+    assert data["reused_count"] == 2
+    assert db.query(models.Question).count() == 2
+
+
+def test_reimport_by_another_author_creates_own_questions(client, db, teacher):
+    other = make_user(db, "other_teacher", role_id=2)
+    for author in (teacher, other):
+        response = client.post(
+            "/questions/import-file",
+            files=upload(CSV_CONTENT, "questions.csv"),
+            headers=auth_headers(author)
+        )
+    assert response.json()["new_count"] == 2
+    assert db.query(models.Question).filter(models.Question.author_id == other.id).count() == 2
+
+
+def test_multi_sheet_preview(client, teacher):
+    response = client.post(
+        "/questions/import-preview?all_sheets=true",
+        files=upload(make_workbook(WORKBOOK_SHEETS), "bank.xlsx"),
+        headers=auth_headers(teacher)
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total_questions"] == 4
+    assert data["valid_questions"] == 4
+    assert [row["category"] for row in data["preview"]] == ["Физика", "Физика", "Химия", "Металлы"]
+
+
+def test_multi_sheet_import_into_test(client, db, teacher):
+    test = models.Test(title="Естествознание", author_id=teacher.id, is_active=True)
+    db.add(test)
+    db.commit()
+
+    response = client.post(
+        f"/tests/{test.id}/import-questions?all_sheets=true",
+        files=upload(make_workbook(WORKBOOK_SHEETS), "bank.xlsx"),
+        headers=auth_headers(teacher)
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["imported_count"] == 4
+    assert data["failed_count"] == 0
+
+    linked = db.query(models.Question.question_text, models.Category.name).join(
+        models.TestQuestion, models.TestQuestion.question_id == models.Question.id
+    ).join(
+        models.Category, models.Category.id == models.Question.category_id
+    ).filter(models.TestQuestion.test_id == test.id).order_by(models.TestQuestion.sort_order).all()
+    assert linked == [
+        ("Единица силы?", "Физика"),
+        ("Единица работы?", "Физика"),
+        ("Символ натрия?", "Химия"),
+        ("Символ золота?", "Металлы"),
+    ]
+
+
+def test_multi_sheet_errors_name_the_sheet(client, teacher):
+    sheets = {
+        "Физика": [
+            ["Вопрос", "Баллы"],
+            ["Единица силы?", "много"],
+        ]
+    }
+    response = client.post(
+        "/questions/import-file?all_sheets=true",
+        files=upload(make_workbook(sheets), "bank.xlsx"),
+        headers=auth_headers(teacher)
+    )
+    data = response.json()
+    assert data["imported_count"] == 0
+    assert data["errors"] == ["Лист «Физика», строка 2: Некорректное значение 'points': много"]
+
+
+def test_background_multi_sheet_job(client, teacher):
+    response = client.post(
+        "/questions/import-jobs?all_sheets=true",
+        files=upload(make_workbook(WORKBOOK_SHEETS), "bank.xlsx"),
+        headers=auth_headers(teacher)
+    )
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    # Без пула воркеров задача выполняется фоном сразу после ответа
+    status = client.get(f"/import-jobs/{job_id}", headers=auth_headers(teacher)).json()
+    assert status["status"] == "done"
+    assert status["rows_processed"] == 4
+    assert status["imported_count"] == 4
+
+
+def test_csv_reimport_into_test_links_questions_once(client, db, teacher):
+    test = models.Test(title="Повтор", author_id=teacher.id, is_active=True)
+    db.add(test)
+    db.commit()
+
+    for _ in range(2):
+        response = client.post(
+            f"/tests/{test.id}/import-questions",
+            files=upload(CSV_CONTENT, "questions.csv"),
+            headers=auth_headers(teacher)
+        )
+        assert response.status_code == 200
+
+    assert db.query(models.TestQuestion).filter(models.TestQuestion.test_id == test.id).count() == 2
+
+
+def queue_job(db, teacher):
+    return import_jobs.create_job(db, "questions.csv", io.BytesIO(CSV_CONTENT), author_id=teacher.id)
+
+
+def steal_lock(job_id, owner="other-worker"):
+    session = SessionLocal()
+    try:
+        session.query(models.ImportJob).filter(models.ImportJob.id == job_id).update(
+            {"locked_by": owner}, synchronize_session=False
+        )
+        session.commit()
+    finally:
+        session.close()
+
+
+def test_reclaimed_job_discards_writes_of_the_old_worker(db, teacher):
+    job = queue_job(db, teacher)
+    lock_token = import_jobs.claim_job(db, job.id)
+    assert lock_token
+
+    # Пока старый воркер читает файл, задачу забирает другой
+    def should_stop():
+        steal_lock(job.id)
+        return False
+
+    import_jobs.run_job(job.id, lock_token, should_stop=should_stop)
+
+    db.expire_all()
+    job = db.get(models.ImportJob, job.id)
+    assert (job.status, job.locked_by, job.imported_count) == ("running", "other-worker", 0)
+    assert db.query(models.Question).count() == 0
+
+
+def test_heartbeat_extends_the_lock_until_it_is_taken(db, teacher):
+    job = queue_job(db, teacher)
+    lock_token = import_jobs.claim_job(db, job.id)
+    claimed_at = db.get(models.ImportJob, job.id).locked_at
+
+    with import_jobs._Heartbeat(job.id, lock_token, interval=0.05) as heartbeat:
+        time.sleep(0.2)
+        db.expire_all()
+        assert db.get(models.ImportJob, job.id).locked_at > claimed_at
+        assert not heartbeat.lost.is_set()
+
+        steal_lock(job.id)
+        assert heartbeat.lost.wait(2)
+
+
+def test_workbook_records_stream_in_chunks_and_stop_early(tmp_path):
+    rows = [["Вопрос", "Правильный ответ"]] + [[f"Вопрос {index}", "ответ"] for index in range(200)]
+    path = tmp_path / "big.xlsx"
+    path.write_bytes(make_workbook({"Большой": rows, "Второй": rows[:3]}))
+
+    records = file_importer.iter_workbook_records(str(path), chunk_size=10)
+    first = next(records)
+    assert (first["sheet"], first["row_number"], first["question_text"]) == ("Большой", 2, "Вопрос 0")
+    # Импорт прерван: процессы пула не должны остаться висеть на полной очереди
+    records.close()
+
+    all_records = list(file_importer.iter_workbook_records(str(path), chunk_size=10))
+    assert len(all_records) == 202
+    assert (all_records[-1]["sheet"], all_records[-1]["sheet_row"], all_records[-1]["row_number"]) == ("Второй", 3, 204)
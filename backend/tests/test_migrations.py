@@ -0,0 +1,162 @@
+import json
+
+from sqlalchemy import create_engine, inspect, text
+
+from app import migrations, models
+
+
+def make_engine(tmp_path, name="migrations.db"):
+    return create_engine(f"sqlite:///{tmp_path / name}")
+
+
+def test_migrated_schema_matches_models(tmp_path):
+    db_engine = make_engine(tmp_path)
+    migrations.upgrade(db_engine)
+    inspector = inspect(db_engine)
+
+    for model_table in models.Base.metadata.sorted_tables:
+        columns = {column["name"] for column in inspector.get_columns(model_table.name)}
+        assert {column.name for column in model_table.columns} <= columns, model_table.name
+
+        index_names = {index["name"] for index in inspector.get_indexes(model_table.name)}
+        assert {index.name for index in model_table.indexes} <= index_names, model_table.name
+
+
+def test_hot_index_migration_rescores_deduplicated_sessions(tmp_path):
+    db_engine = make_engine(tmp_path)
+    migrations.upgrade(db_engine, target="0002")
+    assert "uq_user_answers_session_question" not in {
+        index["name"] for index in inspect(db_engine).get_indexes("user_answers")
+    }
+
+    with db_engine.begin() as connection:
+        connection.execute(text("INSERT INTO roles (id, name) VALUES (1, 'student')"))
+        connection.execute(text("INSERT INTO question_types (id, name) VALUES (1, 'text')"))
+        connection.execute(text("INSERT INTO answer_types (id, name) VALUES (1, 'text')"))
+        connection.execute(text("INSERT INTO categories (id, name) VALUES (1, 'Общие знания')"))
+        connection.execute(text("INSERT INTO users (id, username, password_hash, role_id) VALUES (1, 'u', 'x', 1)"))
+        connection.execute(text("INSERT INTO tests (id, title, author_id) VALUES (1, 'Тест', 1)"))
+        for question_id in (1, 2):
+            connection.execute(text(
+                "INSERT INTO questions (id, question_text, type_id, answer_type_id, category_id, author_id) "
+                "VALUES (:id, 'Вопрос', 1, 1, 1, 1)"
+            ), {"id": question_id})
+        connection.execute(text(
+            "INSERT INTO test_sessions (id, user_id, test_id, score, max_score, percentage, is_completed) "
+            "VALUES (1, 1, 1, 3, 2, 150, 1)"
+        ))
+        # На вопрос 1 ответили дважды: сначала верно, потом неверно
+        for answer_id, question_id, points in ((1, 1, 1), (2, 2, 1), (3, 1, 0)):
+            connection.execute(text(
+                "INSERT INTO user_answers (id, session_id, question_id, points_earned) "
+                "VALUES (:id, 1, :question_id, :points)"
+            ), {"id": answer_id, "question_id": question_id, "points": points})
+
+    migrations.upgrade(db_engine)
+
+    with db_engine.connect() as connection:
+        answers = connection.execute(text("SELECT id FROM user_answers ORDER BY id")).scalars().all()
+        session = connection.execute(text("SELECT score, max_score, percentage FROM test_sessions")).one()
+
+    assert answers == [2, 3]
+    assert (session.score, session.max_score, session.percentage) == (1, 2, 50)
+
+
+def test_user_statistics_duplicates_are_merged_before_unique_index(tmp_path):
+    db_engine = make_engine(tmp_path)
+    migrations.upgrade(db_engine, target="0002")
+
+    with db_engine.begin() as connection:
+        connection.execute(text("INSERT INTO roles (id, name) VALUES (1, 'student')"))
+        connection.execute(text("INSERT INTO categories (id, name) VALUES (1, 'Общие знания')"))
+        connection.execute(text("INSERT INTO users (id, username, password_hash, role_id) VALUES (1, 'u', 'x', 1)"))
+        for row in (
+            {"id": 1, "tests": 1, "answered": 4, "correct": 1, "points": 1, "best": 25},
+            {"id": 2, "tests": 2, "answered": 6, "correct": 5, "points": 7, "best": 90},
+        ):
+            connection.execute(text(
+                "INSERT INTO user_statistics (id, user_id, category_id, tests_completed, questions_answered, "
+                "correct_answers, total_points, average_score, best_score) "
+                "VALUES (:id, 1, 1, :tests, :answered, :correct, :points, 0, :best)"
+            ), row)
+
+    migrations.upgrade(db_engine)
+
+    with db_engine.connect() as connection:
+        rows = connection.execute(text("SELECT * FROM user_statistics")).all()
+    assert len(rows) == 1
+    merged = rows[0]
+    assert merged.id == 1
+    assert (merged.tests_completed, merged.questions_answered, merged.correct_answers) == (3, 10, 6)
+    assert (merged.total_points, merged.best_score, merged.average_score) == (8, 90, 60.0)
+
+    stats_indexes = {index["name"]: index for index in inspect(db_engine).get_indexes("user_statistics")}
+    assert "ix_user_statistics_user_category" not in stats_indexes
+    assert stats_indexes["uq_user_statistics_user_category"]["unique"]
+
+
+def test_duplicate_test_questions_are_removed_before_unique_index(tmp_path):
+    db_engine = make_engine(tmp_path)
+    migrations.upgrade(db_engine, target="0002")
+
+    with db_engine.begin() as connection:
+        connection.execute(text("INSERT INTO roles (id, name) VALUES (1, 'student')"))
+        connection.execute(text("INSERT INTO question_types (id, name) VALUES (1, 'text')"))
+        connection.execute(text("INSERT INTO answer_types (id, name) VALUES (1, 'text')"))
+        connection.execute(text("INSERT INTO categories (id, name) VALUES (1, 'Общие знания')"))
+        connection.execute(text("INSERT INTO users (id, username, password_hash, role_id) VALUES (1, 'u', 'x', 1)"))
+        connection.execute(text("INSERT INTO tests (id, title, author_id) VALUES (1, 'Тест', 1)"))
+        connection.execute(text(
+            "INSERT INTO questions (id, question_text, type_id, answer_type_id, category_id, author_id) "
+            "VALUES (1, 'Вопрос', 1, 1, 1, 1)"
+        ))
+        # Повторный импорт связал вопрос с тестом второй раз
+        for link_id, sort_order in ((1, 0), (2, 5)):
+            connection.execute(text(
+                "INSERT INTO test_questions (id, test_id, question_id, sort_order, points) "
+                "VALUES (:id, 1, 1, :sort_order, 1)"
+            ), {"id": link_id, "sort_order": sort_order})
+
+    migrations.upgrade(db_engine)
+
+    with db_engine.connect() as connection:
+        links = connection.execute(text("SELECT id, sort_order FROM test_questions")).all()
+    assert [tuple(link) for link in links] == [(1, 0)]
+
+    indexes = {index["name"]: index for index in inspect(db_engine).get_indexes("test_questions")}
+    assert indexes["uq_test_questions_test_question"]["unique"]
+
+
+def test_statistics_migration_fills_bests_and_summaries(tmp_path):
+    db_engine = make_engine(tmp_path)
+    migrations.upgrade(db_engine, target="0001")
+
+    with db_engine.begin() as connection:
+        connection.execute(text("INSERT INTO roles (id, name) VALUES (1, 'student')"))
+        for user_id in (1, 2, 3):
+            connection.execute(text(
+                "INSERT INTO users (id, username, password_hash, role_id) VALUES (:id, :name, 'x', 1)"
+            ), {"id": user_id, "name": f"u{user_id}"})
+        connection.execute(text("INSERT INTO tests (id, title, author_id) VALUES (1, 'Тест', 1)"))
+        connection.execute(text("INSERT INTO study_groups (id, name, invite_code, created_by) VALUES (1, 'Г', 'G', 1)"))
+        connection.execute(text("INSERT INTO test_assignments (id, test_id, group_id, assigned_by) VALUES (1, 1, 1, 1)"))
+        # Третий пользователь вышел из группы
+        for user_id, is_active in ((2, 1), (3, 0)):
+            connection.execute(text(
+                "INSERT INTO group_members (group_id, user_id, is_active) VALUES (1, :user_id, :is_active)"
+            ), {"user_id": user_id, "is_active": is_active})
+        for session_id, user_id, percentage in ((1, 2, 40), (2, 2, 75.5), (3, 3, 10)):
+            connection.execute(text(
+                "INSERT INTO test_sessions (id, user_id, test_id, assignment_id, percentage, is_completed) "
+                "VALUES (:id, :user_id, 1, 1, :percentage, 1)"
+            ), {"id": session_id, "user_id": user_id, "percentage": percentage})
+
+    migrations.upgrade(db_engine, target="0002")
+
+    with db_engine.connect() as connection:
+        bests = connection.execute(text("SELECT user_id, session_id FROM member_assignment_best ORDER BY user_id")).all()
+        summary = connection.execute(text("SELECT completed_count, score_sum, histogram FROM assignment_summaries")).one()
+
+    assert [tuple(row) for row in bests] == [(2, 2), (3, 3)]
+    assert (summary.completed_count, summary.score_sum) == (1, 75.5)
+    assert json.loads(summary.histogram) == {"75.5": 1}
@@ -0,0 +1,86 @@
+from app import models
+
+from .conftest import auth_headers
+
+
+def make_ordered_test(db, author):
+    test = models.Test(title="Порядок", author_id=author.id, is_active=True, is_public=True,
+                       shuffle_questions=False, shuffle_answers=False)
+    db.add(test)
+    db.flush()
+
+    questions = []
+    for text in ("Первый", "Второй", "Третий"):
+        question = models.Question(question_text=text, type_id=1, answer_type_id=2, category_id=1,
+                                   author_id=author.id, points=1)
+        db.add(question)
+        db.flush()
+        # Верный вариант идет первым
+        for sort_order, is_correct in ((0, True), (1, False), (2, False)):
+            db.add(models.AnswerOption(question_id=question.id, option_text=f"{text} {sort_order}",
+                                       is_correct=is_correct, sort_order=sort_order))
+        questions.append(question)
+
+    # Порядок в тесте не совпадает с порядком id вопросов
+    for sort_order, question in zip((2, 0, 1), questions):
+        db.add(models.TestQuestion(test_id=test.id, question_id=question.id, sort_order=sort_order, points=1))
+    db.commit()
+    return test
+
+
+def test_payloads_keep_question_and_option_order(client, db, teacher):
+    test = make_ordered_test(db, teacher)
+
+    full = client.get(f"/tests/{test.id}/full", headers=auth_headers(teacher)).json()
+    assert [question["question_text"] for question in full["questions"]] == ["Второй", "Третий", "Первый"]
+    for question in full["questions"]:
+        assert [option["sort_order"] for option in question["answer_options"]] == [0, 1, 2]
+        assert question["answer_options"][0]["is_correct"]
+
+    student = client.get(f"/tests/{test.id}/student", headers=auth_headers(teacher)).json()
+    assert [question["question_text"] for question in student["questions"]] == ["Второй", "Третий", "Первый"]
+    for question in student["questions"]:
+        assert [option["sort_order"] for option in question["answer_options"]] == [0, 1, 2]
+
+
+def question_keys(payload):
+    return [
+        (question.get("correct_answer"), [option.get("is_correct") for option in question["answer_options"]])
+        for question in payload["questions"]
+    ]
+
+
+def test_full_payload_hides_answer_keys_from_students(client, db, teacher, student):
+    test = make_ordered_test(db, teacher)
+
+    full = client.get(f"/tests/{test.id}/full", headers=auth_headers(teacher)).json()
+    assert all(options[0] for _, options in question_keys(full))
+
+    hidden = client.get(f"/tests/{test.id}/full", headers=auth_headers(student)).json()
+    assert [question["question_text"] for question in hidden["questions"]] == ["Второй", "Третий", "Первый"]
+    assert question_keys(hidden) == [(None, [None, None, None])] * 3
+    assert all("explanation" not in question for question in hidden["questions"])
+
+
+def test_review_reveals_keys_according_to_show_results(client, db, teacher, student):
+    test = make_ordered_test(db, teacher)
+    test.show_results = 'immediately'
+    db.commit()
+    first_question = test.questions[0].question_id
+
+    session_id = client.post("/test-sessions/", json={"test_id": test.id}, headers=auth_headers(student)).json()["id"]
+    review = client.get(f"/test-sessions/{session_id}/review", headers=auth_headers(student)).json()
+    assert question_keys(review) == [(None, [None, None, None])] * 3
+
+    client.post(
+        f"/test-sessions/{session_id}/answers",
+        json={"question_id": first_question, "selected_options": "[]", "time_spent": 1},
+        headers=auth_headers(student)
+    )
+    review = client.get(f"/test-sessions/{session_id}/review", headers=auth_headers(student)).json()
+    revealed = [question["id"] for question in review["questions"] if "is_correct" in question["answer_options"][0]]
+    assert revealed == [first_question]
+
+    test.show_results = 'never'
+    db.commit()
+    assert client.get(f"/test-sessions/{session_id}/review", headers=auth_headers(student)).status_code == 403
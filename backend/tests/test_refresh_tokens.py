@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+from app import models, refresh_tokens
+
+from .conftest import make_user
+
+
+def login(client, username="ivan"):
+    response = client.post("/auth/login", json={"username": username, "password": "secret"})
+    assert response.status_code == 200
+    return response.json()["refresh_token"]
+
+
+def refresh(client, token):
+    return client.post("/auth/refresh", json={"refresh_token": token})
+
+
+def age_rotation(db, token, seconds):
+    db.query(models.RefreshToken).filter(
+        models.RefreshToken.token_hash == refresh_tokens.hash_token(token)
+    ).update({"revoked_at": datetime.utcnow() - timedelta(seconds=seconds)}, synchronize_session=False)
+    db.commit()
+
+
+def test_rotation_issues_a_new_token(client, db):
+    make_user(db, "ivan")
+    first = login(client)
+
+    response = refresh(client, first)
+    assert response.status_code == 200
+    second = response.json()["refresh_token"]
+    assert second != first
+    assert response.json()["access_token"]
+
+    assert refresh(client, second).status_code == 200
+
+
+def test_concurrent_refresh_within_grace_window_is_a_conflict(client, db):
+    make_user(db, "ivan")
+    first = login(client)
+    second = refresh(client, first).json()["refresh_token"]
+
+    # Вторая вкладка пришла со старым токеном сразу после ротации
+    assert refresh(client, first).status_code == 409
+    # Цепочка жива: новый токен по-прежнему действует
+    assert refresh(client, second).status_code == 200
+
+
+def test_reuse_after_grace_window_revokes_the_family(client, db):
+    make_user(db, "ivan")
+    first = login(client)
+    second = refresh(client, first).json()["refresh_token"]
+    age_rotation(db, first, seconds=3600)
+
+    assert refresh(client, first).status_code == 401
+    assert refresh(client, second).status_code == 401
+
+    db.expire_all()
+    reasons = {token.revoked_reason for token in db.query(models.RefreshToken)}
+    assert reasons == {"rotated", "reused"}
+
+
+def test_logout_revokes_the_chain(client, db):
+    make_user(db, "ivan")
+    token = login(client)
+
+    assert client.post("/auth/logout", json={"refresh_token": token}).status_code == 200
+    assert refresh(client, token).status_code == 401
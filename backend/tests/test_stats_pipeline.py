@@ -0,0 +1,99 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy.exc import OperationalError
+
+from app import models, stats_pipeline
+
+from .conftest import make_user
+
+
+def make_test(db, author):
+    test = models.Test(title="Физика", author_id=author.id, is_active=True)
+    question = models.Question(
+        question_text="Сколько будет 2+2?", type_id=1, answer_type_id=1, category_id=1,
+        author_id=author.id, correct_answer="4", points=1
+    )
+    db.add_all([test, question])
+    db.flush()
+    db.add(models.TestQuestion(test_id=test.id, question_id=question.id, points=1))
+    db.commit()
+    return test, question
+
+
+def complete_session(db, user, test, question, is_correct=True):
+    session = models.TestSession(
+        user_id=user.id, test_id=test.id, score=int(is_correct), max_score=1,
+        percentage=100 if is_correct else 0, is_completed=True, finished_at=datetime.utcnow()
+    )
+    db.add(session)
+    db.flush()
+    db.add(models.UserAnswer(
+        session_id=session.id, question_id=question.id, answer_text="4" if is_correct else "5",
+        is_correct=is_correct, points_earned=int(is_correct)
+    ))
+    stats_pipeline.enqueue_session_completed(db, session)
+    db.commit()
+    return db.query(models.StatisticsOutbox).filter(models.StatisticsOutbox.session_id == session.id).one()
+
+
+def user_statistics(db, user):
+    db.expire_all()
+    return db.query(models.UserStatistics).filter(models.UserStatistics.user_id == user.id).all()
+
+
+def test_event_is_counted_once(db, teacher, student):
+    test, question = make_test(db, teacher)
+    event = complete_session(db, student, test, question)
+
+    assert stats_pipeline.process_event(event.id)
+    assert stats_pipeline.process_event(event.id)
+
+    (stats,) = user_statistics(db, student)
+    assert (stats.tests_completed, stats.questions_answered, stats.correct_answers) == (1, 1, 1)
+
+
+def test_parallel_events_do_not_lose_updates(db, teacher, student):
+    test, question = make_test(db, teacher)
+    events = [complete_session(db, student, test, question, is_correct=index % 2 == 0) for index in range(6)]
+    event_ids = [event.id for event in events]
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        list(executor.map(stats_pipeline.process_event, event_ids))
+    # События, отложенные из-за блокировок, дообрабатываются следующим проходом
+    for _ in range(5):
+        db.expire_all()
+        pending = [event.id for event in db.query(models.StatisticsOutbox).filter(
+            models.StatisticsOutbox.status != 'done'
+        )]
+        if not pending:
+            break
+        for event_id in pending:
+            stats_pipeline.process_event(event_id)
+
+    (stats,) = user_statistics(db, student)
+    assert (stats.tests_completed, stats.questions_answered, stats.correct_answers) == (6, 6, 3)
+    assert stats.average_score == 50
+    assert stats.best_score == 100
+
+
+def test_lock_conflict_does_not_consume_attempts(db, teacher, student, monkeypatch):
+    test, question = make_test(db, teacher)
+    event = complete_session(db, student, test, question)
+
+    def locked(db, session_id):
+        raise OperationalError("UPDATE user_statistics", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(stats_pipeline, "handle_session_completed", locked)
+    assert not stats_pipeline.process_event(event.id)
+    db.refresh(event)
+    assert (event.status, event.attempts) == ('pending', 0)
+
+    def broken(db, session_id):
+        raise ValueError("boom")
+
+    monkeypatch.setattr(stats_pipeline, "handle_session_completed", broken)
+    assert not stats_pipeline.process_event(event.id)
+    db.refresh(event)
+    assert (event.status, event.attempts) == ('pending', 1)
+    assert user_statistics(db, student) == []
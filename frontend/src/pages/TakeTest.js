@@ -751,11 +751,8 @@ const TakeTest = () => {
     if (state.sessionId) {
       setSessionId(state.sessionId);
       
-      if (state.testData) {
-        initializeTest(state.testData);
-      } else {
-        loadTest();
-      }
+      // Вопросы всегда берем из представления без ключей ответов
+      loadTest();
     } else {
       navigate(`/test/${testId}/intro`);
     }
@@ -790,7 +787,7 @@ const TakeTest = () => {
     try {
       setLoading(true);
       
-      const response = await api.get(`/tests/${testId}/full`);
+      const response = await api.get(`/tests/${testId}/student`, { params: { shuffle: false } });
       const testData = response.data;
       
       initializeTest(testData);
@@ -983,6 +980,15 @@ const TakeTest = () => {
     });
   };
 
+  // Ключи ответов, которые уже можно показать (зависит от show_results теста)
+  const loadAnswerKeys = async () => {
+    if (!sessionId || resultsMode === 'never') return;
+    try {
+      const response = await api.get(`/test-sessions/${sessionId}/review`);
+      setTestDataWithAnswers(response.data);
+    } catch (error) {}
+  };
+
   const saveAnswer = async (questionId, answerData) => {
     try {
       if (!sessionId) {
@@ -1018,6 +1024,7 @@ const TakeTest = () => {
       }));
       
       if (resultsMode === 'immediately') {
+        await loadAnswerKeys();
         setShowingResult(true);
         
         const timer = setTimeout(() => {
@@ -1150,6 +1157,7 @@ const TakeTest = () => {
       };
       
       setCompletionData(completionDataWithTime);
+      await loadAnswerKeys();
       setTestCompleted(true);
       
       if (questionTimerRef.current) {
@@ -1431,6 +1439,9 @@ const TakeTest = () => {
     );
     
     const questionWithCorrectAnswers = currentQuestionFromData?.question || currentQuestionFromData || currentQuestionData;
+    const correctOptionIds = new Set(
+      (questionWithCorrectAnswers.answer_options || []).filter(option => option.is_correct).map(option => option.id)
+    );
 
     const answerOptions = shuffledAnswerOptions[currentQuestionData.id] || 
                          currentQuestionData.answer_options || 
@@ -1487,7 +1498,7 @@ const TakeTest = () => {
                 onChange={(e) => handleSingleChoiceChange(currentQuestionData.id, parseInt(e.target.value))}
               >
                 {answerOptions.map((option, index) => {
-                  const isCorrect = option.is_correct;
+                  const isCorrect = correctOptionIds.has(option.id);
                   const isSelected = currentAnswer.selected_options?.includes(option.id);
                   const showCorrect = showDetails && isCorrect;
                   
@@ -1547,7 +1558,7 @@ const TakeTest = () => {
             <FormControl component="fieldset" fullWidth disabled={isDisabled}>
               <FormGroup>
                 {answerOptions.map((option, index) => {
-                  const isCorrect = option.is_correct;
+                  const isCorrect = correctOptionIds.has(option.id);
                   const isSelected = currentAnswer.selected_options?.includes(option.id);
                   const showCorrect = showDetails && isCorrect;
                   
@@ -23,14 +23,76 @@ api.interceptors.request.use(
   }
 );
 
+// Один запрос обновления на все одновременно упавшие запросы
+let refreshPromise = null;
+
+// 409: этот refresh-токен только что обменяла другая вкладка.
+// Ждем, пока она сохранит новую пару в localStorage, и берем ее.
+const waitForRotatedTokens = async (usedRefreshToken, conflictError) => {
+  for (let attempt = 0; attempt < 10; attempt++) {
+    const currentRefreshToken = localStorage.getItem('refresh_token');
+    if (currentRefreshToken && currentRefreshToken !== usedRefreshToken) {
+      return localStorage.getItem('token');
+    }
+    await new Promise((resolve) => setTimeout(resolve, 200));
+  }
+  throw conflictError;
+};
+
+const refreshTokens = () => {
+  if (!refreshPromise) {
+    const refreshToken = localStorage.getItem('refresh_token');
+    refreshPromise = axios
+      .post(`${API_BASE_URL}/auth/refresh`, { refresh_token: refreshToken })
+      .then((response) => {
+        localStorage.setItem('token', response.data.access_token);
+        localStorage.setItem('refresh_token', response.data.refresh_token);
+        return response.data.access_token;
+      })
+      .catch((refreshError) => {
+        if (refreshError.response?.status === 409) {
+          return waitForRotatedTokens(refreshToken, refreshError);
+        }
+        throw refreshError;
+      })
+      .finally(() => {
+        refreshPromise = null;
+      });
+  }
+  return refreshPromise;
+};
+
+const redirectToLogin = () => {
+  localStorage.removeItem('token');
+  localStorage.removeItem('refresh_token');
+  localStorage.removeItem('user');
+  window.location.href = '/login';
+};
+
 // Обрабатываем ошибки
 api.interceptors.response.use(
   (response) => response,
-  (error) => {
+  async (error) => {
+    const originalRequest = error.config;
     if (error.response?.status === 401) {
-      localStorage.removeItem('token');
-      localStorage.removeItem('user');
-      window.location.href = '/login';
+      // Access-токен истек - пробуем обновить его по refresh-токену и повторить запрос
+      const isAuthRequest = originalRequest?.url?.startsWith('/auth/login');
+      if (localStorage.getItem('refresh_token') && originalRequest && !originalRequest._retry && !isAuthRequest) {
+        originalRequest._retry = true;
+        try {
+          const token = await refreshTokens();
+          originalRequest.headers.Authorization = `Bearer ${token}`;
+          return api(originalRequest);
+        } catch (refreshError) {
+          // Выходим только если сервер отверг refresh-токен; при 409 и сетевых
+          // ошибках общие для вкладок токены не трогаем
+          if (refreshError.response?.status === 401) {
+            redirectToLogin();
+          }
+          return Promise.reject(refreshError);
+        }
+      }
+      redirectToLogin();
     }
     return Promise.reject(error);
   }
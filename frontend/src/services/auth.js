@@ -13,6 +13,9 @@ export const authService = {
     if (response.data.access_token) {
       localStorage.setItem('token', response.data.access_token);
     }
+    if (response.data.refresh_token) {
+      localStorage.setItem('refresh_token', response.data.refresh_token);
+    }
     return response.data;
   },
 
@@ -24,7 +27,13 @@ export const authService = {
 
   // Выход
   logout: () => {
+    const refreshToken = localStorage.getItem('refresh_token');
+    if (refreshToken) {
+      // Отзываем refresh-токен на сервере, результат не ждем
+      api.post('/auth/logout', { refresh_token: refreshToken }).catch(() => {});
+    }
     localStorage.removeItem('token');
+    localStorage.removeItem('refresh_token');
     localStorage.removeItem('user');
   },
 